@@ -0,0 +1,73 @@
+"""
+Measure how long write_tree_html() takes to lay out and draw long random
+trees, projective or not.
+
+    python2 benchmarks/html_layout.py [--runs N] [--root DIR]
+
+With '--root', dep_tregex is imported from DIR, e.g. a checkout of an older
+revision to compare against.
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_SIZES = [50, 200, 500, 1000]
+
+class _NullFile:
+    def write(self, s):
+        pass
+
+def _random_tree(Tree, rng, N, projective):
+    """
+    Return a random tree of N words.
+    """
+    heads = [0] * N
+    if projective:
+        # Attach each word to a neighbor-ish word to its left, or to the
+        # root: arcs then only nest.
+        for node in range(2, N + 1):
+            heads[node - 1] = rng.randint(max(1, node - 5), node - 1)
+    else:
+        # Attach each word to any earlier word in a random order.
+        order = range(1, N + 1)
+        rng.shuffle(order)
+        for i, node in enumerate(order[1:], start=1):
+            heads[node - 1] = order[rng.randint(0, i - 1)]
+
+    forms = [rng.choice([u'a', u'cat', u'sat', u'on', u'the', u'mat'])
+             for node in range(N)]
+    return Tree(forms, forms, [u'X'] * N, [u'X'] * N, [[]] * N, heads,
+                [u'dep'] * N)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--runs', type=int, default=3,
+                        help='trees of each size and kind to draw')
+    parser.add_argument('--root', default=_ROOT,
+                        help='directory to import dep_tregex from')
+    args = parser.parse_args()
+
+    sys.path.insert(0, args.root)
+    from dep_tregex.tree import Tree
+    from dep_tregex.tree_to_html import write_tree_html
+
+    rng = random.Random(0)
+    print('%6s %14s %14s' % ('words', 'projective', 'non-projective'))
+    for N in _SIZES:
+        times = []
+        for projective in [True, False]:
+            trees = [_random_tree(Tree, rng, N, projective)
+                     for run in range(args.runs)]
+            start = time.time()
+            for tree in trees:
+                write_tree_html(_NullFile(), tree, static=True)
+            times.append((time.time() - start) / args.runs)
+        print('%6i %13.3fs %13.3fs' % ((N,) + tuple(times)))
+
+if __name__ == '__main__':
+    main()
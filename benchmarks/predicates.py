@@ -0,0 +1,62 @@
+"""
+Measure string conditions: compile_string_predicate(), which turns literal
+regexes into plain string tests, against searching the compiled regex.
+
+    python2 benchmarks/predicates.py [RUNS]
+"""
+
+import os
+import random
+import sys
+import time
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, _ROOT)
+
+from dep_tregex.tree_pattern import compile_regex, compile_string_predicate
+
+# (regex, ignore_case, anywhere), as in /regex/, /regex/i, /regex/g.
+_CONDITIONS = [
+    (u'the', False, False),
+    (u'dog|cat', False, False),
+    (u'ous', False, True),
+    (u'd.g', False, False),
+    (u'the', True, False),
+    ]
+
+_WORDS = [u'the', u'dog', u'cat', u'famous', u'a', u'runs', u'saw', u'of',
+          u'dig', u'THE', u'hotdog', u'nervous', u'big', u'and']
+
+def _time(pred_fn, words, runs):
+    """
+    Return total time of applying 'pred_fn' to all words 'runs' times.
+    """
+    start = time.time()
+    for run in range(runs):
+        for word in words:
+            pred_fn(word)
+    return time.time() - start
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    rng = random.Random(0)
+    words = [rng.choice(_WORDS) for i in range(6000)]
+
+    print('%-12s %10s %10s' % ('condition', 'regex', 'predicate'))
+    for pattern, ignore_case, anywhere in _CONDITIONS:
+        r = compile_regex(pattern, ignore_case, anywhere)
+        regex_fn = lambda s: r.search(s) is not None
+        pred_fn = compile_string_predicate(pattern, ignore_case, anywhere)
+
+        # Predicates may cache results per string; that's part of the deal,
+        # but let the first run fill the cache outside the timing.
+        for word in words:
+            pred_fn(word)
+
+        flags = (u'i' if ignore_case else u'') + (u'g' if anywhere else u'')
+        print('%-12s %9.3fs %9.3fs' % (
+            (u'/%s/%s' % (pattern, flags)).encode('utf-8'),
+            _time(regex_fn, words, runs), _time(pred_fn, words, runs)))
+
+if __name__ == '__main__':
+    main()
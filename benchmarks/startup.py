@@ -0,0 +1,84 @@
+"""
+Measure how long building the script parser takes without and with cached
+lexer and parser tables (see _table_cache_dir() in tree_script.py).
+
+    python2 benchmarks/startup.py [RUNS]
+"""
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, _ROOT)
+
+from dep_tregex.tree_script import _TreeScriptParser
+
+_SCRIPT = u"{ x form 'dog' :: set lemma x 'dog'; }\n"
+_TREE = u'1\tdog\tdog\tNOUN\tNOUN\t_\t0\troot\t_\t_\n\n'
+
+def _median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+def _time_calls(fn, runs):
+    """
+    Return median time of a call to 'fn', in seconds.
+    """
+    times = []
+    for run in range(runs):
+        start = time.time()
+        fn()
+        times.append(time.time() - start)
+    return _median(times)
+
+def _time_sed(script_filename, runs):
+    """
+    Return median wall time of a 'sed' process on a one-tree input, in
+    seconds.
+    """
+    times = []
+    for run in range(runs):
+        start = time.time()
+        process = subprocess.Popen(
+            [sys.executable, '-m', 'dep_tregex', 'sed', script_filename],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, cwd=_ROOT)
+        process.communicate(_TREE.encode('utf-8'))
+        times.append(time.time() - start)
+    return _median(times)
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 30
+    dirname = tempfile.mkdtemp()
+    try:
+        script_filename = os.path.join(dirname, 'script.txt')
+        with open(script_filename, 'w') as f:
+            f.write(_SCRIPT.encode('utf-8'))
+
+        results = []
+        for label, cache_dir in [('no cache', ''),
+                                 ('cached', os.path.join(dirname, 'cache'))]:
+            os.environ['DEP_TREGEX_CACHE_DIR'] = cache_dir
+
+            # Fill the cache, if any.
+            _TreeScriptParser('tree_scripts')
+
+            results.append((label, [
+                _time_calls(_TreeScriptParser.make_lexer, runs),
+                _time_calls(
+                    lambda: _TreeScriptParser.make_parser('tree_scripts'),
+                    runs),
+                _time_sed(script_filename, runs)]))
+    finally:
+        shutil.rmtree(dirname)
+
+    print('%-10s %12s %12s %12s' % ('', 'make_lexer', 'make_parser', 'sed'))
+    for label, times in results:
+        print('%-10s %10.1fms %10.1fms %10.1fms' % (
+            (label,) + tuple(t * 1000 for t in times)))
+
+if __name__ == '__main__':
+    main()
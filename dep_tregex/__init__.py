@@ -1,6 +1,7 @@
 from dep_tregex.conll import *
 from dep_tregex.tree import *
 from dep_tregex.tree_action import *
+from dep_tregex.tree_compiler import *
 from dep_tregex.tree_pattern import *
 from dep_tregex.tree_script import *
 from dep_tregex.tree_state import *
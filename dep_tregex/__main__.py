@@ -1,21 +1,31 @@
 from __future__ import print_function
 
 import argparse
-import cgi
 import codecs
 import collections
-import random
+import os
+import re
 import sys
-import tempfile
-import webbrowser
 
 from dep_tregex.conll import *
+from dep_tregex.tree_compiler import *
 from dep_tregex.tree_script import *
 from dep_tregex.tree_to_html import *
 
 ## ----------------------------------------------------------------------------
 #                                  Actions
 
+def _close_stdin():
+    """
+    Close stdin once no more trees are needed from it, so that whoever writes
+    to it gets SIGPIPE instead of producing trees nobody reads.
+    """
+    # sys.stdin.close() leaves the descriptor open.
+    try:
+        os.close(sys.stdin.fileno())
+    except OSError:
+        pass
+
 # - Extract words - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
 def words():
@@ -34,17 +44,20 @@ def wc():
 # - N'th tree - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
 def nth(num):
-    trees_read = 0
     for i, tree in enumerate(read_trees_conll(sys.stdin)):
         if i + 1 == num:
             write_tree_conll(sys.stdout, tree)
+            break
+    _close_stdin()
 
 # - Head  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
 def head(num):
     for i, tree in enumerate(read_trees_conll(sys.stdin)):
-        if i < num:
-            write_tree_conll(sys.stdout, tree)
+        write_tree_conll(sys.stdout, tree)
+        if i + 1 == num:
+            break
+    _close_stdin()
 
 # - Tail  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
@@ -71,6 +84,8 @@ def not_head(num):
 # - Shuffle - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
 def shuf():
+    import random
+
     trees = list(read_trees_conll(sys.stdin))
     random.shuffle(trees)
     for tree in trees:
@@ -78,151 +93,521 @@ def shuf():
 
 # - HTML  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
-_HL_LIMIT = 100
-_HL_LIMIT_MSG = 'Too many trees; #%i and on will not be highlighted on hover.'
 _LIMIT_MSG = 'Printing only %i trees; override with --limit'
 
-def _html(limit, fields, file):
+def _html(limit, fields, writer):
     """
-    Print trees from stdin and write HTML to 'file'.
+    Print trees from stdin as HTML.
 
-    limit: maximal number of trees to print
+    limit: maximal number of trees to print, or None
     fields: CoNLL fields to print in trees
-    file: file to write HTML to
+    writer: HtmlWriter or PagedHtmlWriter to draw trees with
     """
-    write_prologue_html(file)
-
     for i, tree in enumerate(read_trees_conll(sys.stdin)):
-        # Respect the limits.
+        # Respect the limits. The tree past the limit tells that there are
+        # more, and no more are read.
         if i == limit:
             print(_LIMIT_MSG % i, file=sys.stderr)
-        if i >= limit:
-            continue
-        if i == _HL_LIMIT:
-            print(_HL_LIMIT_MSG % i, file=sys.stderr)
+            _close_stdin()
+            break
 
         # Draw.
-        static = i >= _HL_LIMIT
-        write_tree_html(file, tree, fields, [], static)
+        writer.write_tree(tree, fields)
 
-    write_epilogue_html(file)
+    writer.close()
+
+def html(limit, fields, view, new, pages=None, page_size=100, cache=None):
+    """
+    Print trees from stdin as HTML.
+
+    pages: if not None, write a directory of pages of 'page_size' trees
+    there instead of a single page
+    cache: SvgCache to reuse drawings from, or None
+    """
+    import webbrowser
+
+    # Write pages and view the index.
+    if pages is not None:
+        writer = PagedHtmlWriter(pages, page_size, cache)
+        _html(limit, fields, writer)
+        if view:
+            filename = os.path.abspath(writer.index_filename)
+            webbrowser.open('file://' + filename, new=new*2)
+        return
 
-def html(limit, fields, view, new):
     # If need not view in browser, write HTML to stdout.
     if not view:
-        _html(limit, fields, file=sys.stdout)
+        _html(limit, fields, HtmlWriter(sys.stdout, cache))
         return
 
     # Create temporary file.
+    import tempfile
     f = tempfile.NamedTemporaryFile(delete=False, suffix='.html')
     filename = f.name
     f.close()
 
     # Write HTML to temporary file.
     with codecs.open(filename, 'wb', encoding='utf-8') as f:
-        _html(limit, fields, file=f)
+        _html(limit, fields, HtmlWriter(f, cache))
 
     # Open that file.
     webbrowser.open('file://' + filename, new=new*2)
 
 # - Grep  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
-def _grep_text(pattern):
+def _matcher(pattern, stats=None, pattern_no=0):
+    """
+    Return function (tree, node) -> whether the pattern matches the node.
+    If 'stats' (a ScriptProfile) is given, record matching to it as a pattern
+    number 'pattern_no'.
+    """
+    if stats is None:
+        return lambda tree, node: pattern.match(tree, node, {})
+    return lambda tree, node: stats.match(pattern_no, pattern, tree, node, {})
+
+def _write_profile(stats, json_filename):
+    """
+    Print a ScriptProfile to stderr; also write it to 'json_filename' as JSON
+    unless that's None.
+    """
+    stats.write_report(sys.stderr)
+    if json_filename is not None:
+        with open(json_filename, 'wt') as f:
+            stats.write_json(f)
+
+def _instrument(patterns, hot_spots):
+    """
+    Return a PatternProfile with patterns instrumented, or None if 'hot_spots'
+    is 0.
+    """
+    if not hot_spots:
+        return None
+    pattern_stats = PatternProfile()
+    for pattern in patterns:
+        pattern_stats.instrument(pattern)
+    return pattern_stats
+
+def _write_hot_spots(pattern_stats, patterns, hot_spots):
+    """
+    Print 'hot_spots' patterns which took most time to stderr, annotated with
+    per-sub-pattern statistics.
+    """
+    patterns = sorted(patterns, key=lambda p: -pattern_stats.times[p])
+    for pattern in patterns[:hot_spots]:
+        sys.stderr.write('\n')
+        pattern_stats.write_report(sys.stderr, pattern)
+
+def _read_trees(pipeline):
+    """
+    Return iterator over trees from stdin; if 'pipeline' is True, stdin is
+    read in a background thread.
+    """
+    if pipeline:
+        return read_trees_conll_threaded(sys.stdin)
+    return read_trees_conll(sys.stdin)
+
+def _output(file, pipeline):
+    """
+    Return a file-like object to write to 'file' with; if 'pipeline' is True,
+    it writes in a background thread. Call _close_output() when done.
+    """
+    if pipeline:
+        return ThreadedWriter(file)
+    return file
+
+def _close_output(output):
+    """
+    Wait for output made by _output() to be written.
+    """
+    if isinstance(output, ThreadedWriter):
+        output.close()
+
+def _grep_text(pattern, stats=None, pipeline=False):
     """
     Read trees from stdin and print those who match the pattern.
+
+    pattern: TreePattern
+    stats: ScriptProfile to record matching to, or None
+    pipeline: if True, read and write in background threads
     """
-    # Parse pattern.
-    pattern = parse_pattern(pattern)
+    match_fn = _matcher(pattern, stats)
+    output = _output(sys.stdout, pipeline)
 
-    for tree in read_trees_conll(sys.stdin):
+    for tree in _read_trees(pipeline):
         # Match.
         match = False
         for node in range(1, len(tree) + 1):
-            if pattern.match(tree, node, {}):
+            if match_fn(tree, node):
                 match = True
                 break
 
         # Print.
         if match:
-            write_tree_conll(sys.stdout, tree)
+            write_tree_conll(output, tree)
+            if stats is not None:
+                stats.add_tree([0])
+
+    _close_output(output)
 
-def _grep_html(pattern, limit, fields, file):
+def _grep_html(pattern, limit, fields, file, stats=None, pipeline=False,
+               writer=None, cache=None):
     """
     Read trees from stdin, and print those who match the pattern as HTML,
     matched nodes highlighted.
 
-    pattern: pattern to match against
-    limit: maximal number of trees to print
+    pattern: TreePattern to match against
+    limit: maximal number of trees to print, or None
     fields: CoNLL fields to print in trees
     file: file to write HTML to
+    stats: ScriptProfile to record matching to, or None
+    pipeline: if True, read and write in background threads
+    writer: if not None, HtmlWriter or PagedHtmlWriter to draw trees with
+    instead of writing to 'file'
+    cache: SvgCache to reuse drawings from when writing to 'file', or None
     """
-    # Parse pattern.
-    pattern = parse_pattern(pattern)
-    write_prologue_html(file)
+    match_fn = _matcher(pattern, stats)
+    if writer is None:
+        file = _output(file, pipeline)
+        writer = HtmlWriter(file, cache)
     printed = 0
 
-    for tree in read_trees_conll(sys.stdin):
-        # Respect the limits.
+    for tree in _read_trees(pipeline):
+        # Respect the limits. The tree past the limit tells that there are
+        # more, and no more are read.
         if printed == limit:
             print(_LIMIT_MSG % printed, file=sys.stderr)
-            printed += 1
-        if printed >= limit:
-            continue
-        if printed == _HL_LIMIT:
-            print(_HL_LIMIT_MSG % printed, file=sys.stderr)
+            _close_stdin()
+            break
 
         # Match.
         matches = []
         for node in range(1, len(tree) + 1):
-            if pattern.match(tree, node, {}):
+            if match_fn(tree, node):
                 matches.append(node)
 
         # Draw.
-        static = printed >= _HL_LIMIT
         if matches:
-            write_tree_html(file, tree, fields, matches, static)
+            writer.write_tree(tree, fields, matches)
             printed += 1
+            if stats is not None:
+                stats.add_tree([0])
 
-    write_epilogue_html(file)
+    writer.close()
+    _close_output(file)
 
-def grep(pattern, html, limit, fields, view, new):
+_PATTERN_NAME_RE = re.compile(r'^[-_.a-zA-Z0-9]+$')
+
+def _read_named_patterns(filename):
+    """
+    Read a file of named patterns, one 'NAME PATTERN' per line.
+    Empty lines and lines starting with '#' are ignored. Names must be
+    distinct, since each names an output file.
+
+    Return a list of (name, pattern text).
+    """
+    named_patterns = []
+    line_nos = {}
+    with open(filename, 'rt') as f:
+        for line_no, line in enumerate(f, start=1):
+            line = line.decode('utf-8').strip()
+            if not line or line.startswith(u'#'):
+                continue
+
+            parts = line.split(None, 1)
+            if len(parts) != 2 or not _PATTERN_NAME_RE.match(parts[0]):
+                msg = '%s, line %i: expected a name and a pattern, got %r'
+                raise ValueError(msg % (filename, line_no, line))
+            if parts[0] in line_nos:
+                msg = '%s, line %i: pattern name %r is already used on ' \
+                      'line %i'
+                raise ValueError(msg % (filename, line_no, parts[0],
+                                        line_nos[parts[0]]))
+            line_nos[parts[0]] = line_no
+            named_patterns.append((parts[0], parts[1]))
+    return named_patterns
+
+def _grep_many(patterns_filename, output_dir, profile=False,
+               profile_json=None, hot_spots=0, pipeline=False):
+    """
+    Read trees from stdin and match each against all named patterns from
+    'patterns_filename' in a single pass.
+
+    If 'output_dir' is None, print every tree that matched something, preceded
+    by a '# patterns: NAME...' comment. Otherwise, write trees matching
+    pattern NAME to 'output_dir/NAME.conll'.
+
+    profile: if True, print per-pattern statistics to stderr
+    profile_json: if not None, also write them to this file as JSON
+    hot_spots: print this many most expensive patterns to stderr, with
+    per-sub-pattern statistics
+    pipeline: if True, read and write in background threads
+    """
+    named_patterns = _read_named_patterns(patterns_filename)
+
+    # Parse every distinct pattern once and extract its literal prefilter.
+    # Identically written patterns share the parse, and, per tree, the verdict.
+    parsed = {}
+    patterns = []
+    names = []
+    for name, text in named_patterns:
+        if text not in parsed:
+            pattern = parse_pattern(text)
+            parsed[text] = (len(patterns), pattern, required_literals(pattern))
+            patterns.append(pattern)
+            names.append(name)
+        else:
+            pattern_no = parsed[text][0]
+            names[pattern_no] += u' ' + name
+
+    # Matching functions.
+    stats = None
+    if profile:
+        stats = ScriptProfile(patterns, names)
+    pattern_stats = _instrument(patterns, hot_spots)
+    match_fns = [_matcher(pattern, stats, pattern_no)
+                 for pattern_no, pattern in enumerate(patterns)]
+
+    # Open output files.
+    files = {}
+    if output_dir is not None:
+        for name, text in named_patterns:
+            filename = os.path.join(output_dir, name + '.conll')
+            files[name] = codecs.open(filename, 'wb', encoding='utf-8')
+    outputs = dict((name, _output(f, pipeline)) for name, f in files.items())
+    stdout = _output(sys.stdout, pipeline)
+
+    try:
+        for tree in _read_trees(pipeline):
+            vocabularies = {}
+            verdicts = {}
+            matched = []
+
+            # Match.
+            for name, text in named_patterns:
+                if text not in verdicts:
+                    pattern_no, pattern, requirements = parsed[text]
+                    match_fn = match_fns[pattern_no]
+                    match = False
+                    if has_required_literals(tree, requirements, vocabularies):
+                        for node in range(1, len(tree) + 1):
+                            if match_fn(tree, node):
+                                match = True
+                                break
+                    verdicts[text] = match
+                    if match and stats is not None:
+                        stats.add_tree([pattern_no])
+                if verdicts[text]:
+                    matched.append(name)
+
+            # Print.
+            if output_dir is not None:
+                for name in matched:
+                    write_tree_conll(outputs[name], tree)
+            elif matched:
+                stdout.write(u'# patterns: %s\n' % u' '.join(matched))
+                write_tree_conll(stdout, tree)
+    finally:
+        for output in outputs.values() + [stdout]:
+            _close_output(output)
+        for f in files.values():
+            f.close()
+        if pattern_stats is not None:
+            pattern_stats.restore()
+
+    if stats is not None:
+        _write_profile(stats, profile_json)
+    if pattern_stats is not None:
+        _write_hot_spots(pattern_stats, patterns, hot_spots)
+
+def grep(pattern, html, limit, fields, view, new, profile=False,
+         profile_json=None, hot_spots=0, pipeline=False, pages=None,
+         page_size=100, cache=None):
     """
     Read trees from stdin and print those who match the pattern.
     If 'html' is False, print CoNLL trees.
     If 'html' is True and 'view' is False, print HTML to stdout.
     If 'html' is True and 'view' is True, view HTML in browser.
+    If 'pages' is not None, write HTML to a directory of pages of 'page_size'
+    trees there instead, and view its index if 'view' is True.
+
+    profile: if True, print pattern statistics to stderr
+    profile_json: if not None, also write them to this file as JSON
+    hot_spots: if not 0, print the pattern to stderr with per-sub-pattern
+    statistics
+    pipeline: if True, read and write in background threads
+    cache: SvgCache to reuse drawings from, or None
     """
-    if not html:
-        _grep_text(pattern)
-        return
+    pattern = parse_pattern(pattern)
+    stats = ScriptProfile([pattern]) if profile else None
+    pattern_stats = _instrument([pattern], hot_spots)
+    try:
+        if not html:
+            _grep_text(pattern, stats, pipeline)
+
+        elif pages is not None:
+            import webbrowser
+            writer = PagedHtmlWriter(pages, page_size, cache)
+            _grep_html(pattern, limit, fields, None, stats, pipeline, writer)
+            if view:
+                filename = os.path.abspath(writer.index_filename)
+                webbrowser.open('file://' + filename, new=new*2)
+
+        elif not view:
+            _grep_html(pattern, limit, fields, sys.stdout, stats, pipeline,
+                       cache=cache)
 
-    if not view:
-        _grep_html(pattern, limit, fields, file=sys.stdout)
-        return
+        else:
+            # Create temporary file.
+            import tempfile
+            import webbrowser
+            f = tempfile.NamedTemporaryFile(delete=False, suffix='.html')
+            filename = f.name
+            f.close()
+
+            # Write HTML to temporary file.
+            with codecs.open(filename, 'wb', encoding='utf-8') as f:
+                _grep_html(pattern, limit, fields, f, stats, pipeline,
+                           cache=cache)
+
+            # Open that file.
+            webbrowser.open('file://' + filename, new=new*2)
+    finally:
+        if pattern_stats is not None:
+            pattern_stats.restore()
+
+    if stats is not None:
+        _write_profile(stats, profile_json)
+    if pattern_stats is not None:
+        _write_hot_spots(pattern_stats, [pattern], hot_spots)
 
-     # Create temporary file.
-    f = tempfile.NamedTemporaryFile(delete=False, suffix='.html')
-    filename = f.name
-    f.close()
+# - Sed - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
-    # Write HTML to temporary file.
-    with codecs.open(filename, 'wb', encoding='utf-8') as f:
-        _grep_html(pattern, limit, fields, file=f)
+_DISPATCH_MSG = 'tree #%i: attempted %i of %i scripts'
+_DISPATCH_TOTAL_MSG = 'total: attempted %.1f of %i scripts per tree on average'
+_BUDGET_MSG = 'tree #%i: script %s exceeded %i steps%s: %s'
+_FIXPOINT_MSG = 'tree #%i: still changing after %i rounds'
 
-    # Open that file.
-    webbrowser.open('file://' + filename, new=new*2)
+def _script_label(script, script_no):
+    """
+    Return a string identifying a script in diagnostics.
+    """
+    pos = getattr(script, 'pos', None)
+    text = getattr(script, 'text', None)
+    where = '%i:%i' % (pos[2], pos[3]) if pos else '#%i' % (script_no + 1)
+    if text is None:
+        return where
+    return where + u' ' + u' '.join(text.split())
+
+def _read_scripts(filename):
+    """
+    Read scripts from a text file, from a bundle made by 'bundle' command, or
+    from a module made by 'compile-scripts' command.
+    Return list of TreeScript objects.
+    """
+    if is_scripts_bundle(filename):
+        with open(filename, 'rb') as f:
+            return read_scripts_bundle(f)
+    if is_compiled_scripts(filename):
+        return load_compiled_scripts(filename)
+    with open(filename, 'rt') as f:
+        return parse_scripts(f.read().decode('utf-8'))
+
+def bundle(scripts_filename, bundle_filename):
+    """
+    Parse scripts from file and write them as a bundle, which 'sed' reads
+    without parsing.
+    """
+    scripts = _read_scripts(scripts_filename)
+    with open(bundle_filename, 'wb') as f:
+        write_scripts_bundle(f, scripts)
 
-# - Sed - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+def compile_scripts_file(scripts_filename, module_filename):
+    """
+    Parse scripts from file and write them as a Python module, which 'sed'
+    runs without interpreting the scripts.
+    """
+    scripts = _read_scripts(scripts_filename)
+    with open(module_filename, 'wt') as f:
+        compile_scripts(f, scripts, os.path.basename(scripts_filename))
 
-def sed(scripts_filename):
-    # Read scripts.
-    with open(scripts_filename, 'rt') as f:
-        scripts = parse_scripts(f.read().decode('utf-8'))
+def sed(scripts_filename, dispatch_report=False, profile=False,
+        profile_json=None, hot_spots=0, max_steps=None, over_budget='fail',
+        max_rounds=None, pipeline=False):
+    """
+    Apply scripts from file to trees from stdin, print trees to stdout.
+    The file may also be a bundle made by 'bundle' command, or a module made
+    by 'compile-scripts' command.
+
+    dispatch_report: if True, print how many scripts each tree needed to
+    stderr
+    profile: if True, print per-script statistics to stderr
+    profile_json: if not None, also write them to this file as JSON
+    hot_spots: print patterns of this many most expensive scripts to stderr,
+    with per-sub-pattern statistics
+    max_steps: if not None, limit each script to this many pattern steps per
+    tree; compiled modules don't count steps
+    over_budget: what to do when a script exceeds 'max_steps': 'skip' prints
+    the tree unchanged and goes on, 'fail' exits
+    max_rounds: if not None, re-apply all scripts to each tree until it stops
+    changing, but at most this many times
+    pipeline: if True, read and write in background threads
+    """
+    scripts = _read_scripts(scripts_filename)
+    index = ScriptIndex(scripts)
+    stats = ScriptProfile(scripts) if profile else None
+    patterns = [script.pattern for script in scripts]
+    pattern_stats = _instrument(patterns, hot_spots)
+    budget = None
+    if max_steps is not None:
+        budget = StepBudget(max_steps)
+        for pattern in patterns:
+            budget.instrument(pattern)
+    fixpoint = Fixpoint(max_rounds) if max_rounds is not None else None
+    attempted = 0
 
     # Edit trees.
-    for tree in read_trees_conll(sys.stdin):
-        tree = run_tree_scripts(tree, scripts)
-        write_tree_conll(sys.stdout, tree)
+    output = _output(sys.stdout, pipeline)
+    try:
+        for i, tree in enumerate(_read_trees(pipeline)):
+            try:
+                new_tree = run_tree_scripts(tree, scripts, index, stats,
+                                            budget, fixpoint)
+            except StepBudgetExceeded as e:
+                forms = [tree.forms(j) for j in range(1, len(tree) + 1)]
+                skip = over_budget == 'skip'
+                script = _script_label(scripts[e.script_no], e.script_no)
+                msg = _BUDGET_MSG % (i + 1, script, e.steps,
+                                     '; skipping tree' if skip else '',
+                                     u' '.join(forms))
+                print(msg.encode('utf-8'), file=sys.stderr)
+                if not skip:
+                    sys.exit(1)
+                new_tree = tree
+            write_tree_conll(output, new_tree)
+            if fixpoint is not None and not fixpoint.converged:
+                print(_FIXPOINT_MSG % (i + 1, fixpoint.rounds),
+                      file=sys.stderr)
+
+            # Report.
+            if dispatch_report:
+                attempted += index.attempted
+                print(_DISPATCH_MSG % (i + 1, index.attempted, len(scripts)),
+                      file=sys.stderr)
+    finally:
+        _close_output(output)
+        # Instrumented after pattern_stats: undo first.
+        if budget is not None:
+            budget.restore()
+        if pattern_stats is not None:
+            pattern_stats.restore()
+
+    if dispatch_report and attempted:
+        print(_DISPATCH_TOTAL_MSG % (float(attempted) / (i + 1), len(scripts)),
+              file=sys.stderr)
+    if stats is not None:
+        _write_profile(stats, profile_json)
+    if pattern_stats is not None:
+        _write_hot_spots(pattern_stats, patterns, hot_spots)
 
 # - Gdb - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
@@ -270,6 +655,7 @@ def _gdb_tree(scripts, scripts_text, tree, fields, file):
     fields: CoNLL fields to print in trees
     file: file to write HTML to
     """
+    import cgi
 
     # Original tree.
     file.write(u'    <h1>Original tree</h1>\n')
@@ -402,6 +788,8 @@ def gdb(scripts_filename, fields, view, new):
         return
 
     # Create temporary file.
+    import tempfile
+    import webbrowser
     f = tempfile.NamedTemporaryFile(delete=False, suffix='.html')
     filename = f.name
     f.close()
@@ -417,13 +805,31 @@ def gdb(scripts_filename, fields, view, new):
 #                                  Main
 
 if __name__ == '__main__':
+    # Die quietly when whoever reads stdout goes away (e.g. 'head'), like
+    # other command-line tools, rather than with a traceback.
+    import signal
+    signal.signal(signal.SIGPIPE, signal.SIG_DFL)
+
     parser = argparse.ArgumentParser('python -mdep_tregex')
     subparsers = parser.add_subparsers(dest='cmd')
 
     def _add_html_arguments(p, limit=True):
         if limit:
-            p.add_argument('--limit', help='draw only first N trees', type=int,
-                           metavar='N', default=10)
+            p.add_argument('--limit', help='draw only first N trees '
+                           '(default: 10, or all with --pages)', type=int,
+                           metavar='N')
+            p.add_argument('--pages', help='write a directory of HTML pages '
+                           'to DIR instead, with index.html linking to them',
+                           metavar='DIR')
+            p.add_argument('--page-size', help='with --pages, draw at most N '
+                           'trees on a page (default: 100)', type=int,
+                           metavar='N', default=100)
+            p.add_argument('--svg-cache', help='reuse drawings of trees seen '
+                           'before from DIR, and keep new ones there',
+                           metavar='DIR')
+            p.add_argument('--svg-cache-size', help='keep at most N megabytes '
+                           'of drawings in --svg-cache (default: 100)',
+                           type=int, metavar='N', default=100)
         p.add_argument('--lemma', help='include LEMMA field',
                        action='store_true')
         p.add_argument('--cpostag', help='include CPOSTAG field',
@@ -437,6 +843,33 @@ if __name__ == '__main__':
         p.add_argument('--reuse-tab', help='reuse already opened browser tabs',
                         action='store_true')
 
+    def _add_profile_arguments(p):
+        p.add_argument('--profile', help='print per-script statistics to '
+                       'stderr', action='store_true')
+        p.add_argument('--profile-json', help='also write statistics to FILE '
+                       'as JSON', metavar='FILE')
+        p.add_argument('--hot-spots', help='print N most expensive patterns '
+                       'to stderr, with statistics for each sub-pattern',
+                       type=int, metavar='N', default=0)
+
+    def _add_pipeline_argument(p):
+        p.add_argument('--pipeline', help='read and write trees in background '
+                       'threads', action='store_true')
+
+    def _limit_from_args(p, args):
+        if args.limit is None:
+            return None if args.pages is not None else 10
+        if args.limit <= 0:
+            p.error('--limit has to be positive')
+        return args.limit
+
+    def _cache_from_args(p, args):
+        if args.svg_cache_size <= 0:
+            p.error('--svg-cache-size has to be positive')
+        if args.svg_cache is None:
+            return None
+        return SvgCache(args.svg_cache, args.svg_cache_size * 2**20)
+
     def _fields_from_args(args):
         fields = []
         if args.lemma:
@@ -472,14 +905,51 @@ if __name__ == '__main__':
 
     # Grep.
     grep_p = subparsers.add_parser('grep', help='filter trees by pattern')
-    grep_p.add_argument('PATTERN', help='dep-tregex pattern')
+    grep_p.add_argument('PATTERN', help='dep-tregex pattern', nargs='?')
+    grep_p.add_argument('--patterns', help="match against all named patterns "
+                        "from FILE ('NAME PATTERN' per line) in one pass",
+                        metavar='FILE')
+    grep_p.add_argument('--output-dir', help='with --patterns, write trees '
+                        'matching pattern NAME to DIR/NAME.conll',
+                        metavar='DIR')
     grep_p.add_argument('--html', help='view matches in browser',
                         action='store_true')
     _add_html_arguments(grep_p)
+    _add_profile_arguments(grep_p)
+    _add_pipeline_argument(grep_p)
 
     # Sed.
     sed_p = subparsers.add_parser('sed', help='apply tree scripts to trees')
-    sed_p.add_argument('FILE', help='scripts file')
+    sed_p.add_argument('FILE', help='scripts file, bundle or compiled '
+                       'module')
+    sed_p.add_argument('--dispatch-report', help='print to stderr how many '
+                       'scripts each tree needed', action='store_true')
+    _add_profile_arguments(sed_p)
+    _add_pipeline_argument(sed_p)
+    sed_p.add_argument('--max-steps', help='let each script try at most N '
+                       'sub-pattern matches per tree (not for compiled '
+                       'modules)', type=int, metavar='N')
+    sed_p.add_argument('--over-budget', help='when a script exceeds '
+                       '--max-steps, skip the tree (print it unchanged) or '
+                       'fail (default)', choices=['skip', 'fail'],
+                       default='fail')
+    sed_p.add_argument('--until-fixpoint', help='re-apply the scripts to each '
+                       'tree until it stops changing', action='store_true')
+    sed_p.add_argument('--max-rounds', help='with --until-fixpoint, apply the '
+                       'scripts at most N times (default: 10)', type=int,
+                       metavar='N', default=10)
+
+    # Bundle.
+    bundle_p = subparsers.add_parser('bundle', help='precompile tree scripts '
+                                     'for sed')
+    bundle_p.add_argument('FILE', help='scripts file')
+    bundle_p.add_argument('OUTPUT', help='bundle file to write')
+
+    # Compile scripts.
+    compile_p = subparsers.add_parser('compile-scripts', help='compile tree '
+                                      'scripts to a Python module for sed')
+    compile_p.add_argument('FILE', help='scripts file')
+    compile_p.add_argument('OUTPUT', help='Python module to write')
 
     # Html
     html_p = subparsers.add_parser('html', help='view trees in browser')
@@ -532,18 +1002,60 @@ if __name__ == '__main__':
         shuf()
 
     elif args.cmd == 'grep':
-        fields = _fields_from_args(args)
-        new = not args.reuse_tab
-        grep(args.PATTERN, args.html, args.limit, fields, not args.print, new)
+        profile = args.profile or args.profile_json is not None
+        if args.pages is not None and not args.html:
+            grep_p.error('--pages requires --html')
+        if args.svg_cache is not None and not args.html:
+            grep_p.error('--svg-cache requires --html')
+        if args.patterns is not None:
+            if args.PATTERN is not None:
+                grep_p.error("can't use both PATTERN and --patterns")
+            if args.html:
+                grep_p.error("can't use --html with --patterns")
+            _grep_many(args.patterns, args.output_dir, profile,
+                       args.profile_json, args.hot_spots, args.pipeline)
+        else:
+            if args.PATTERN is None:
+                grep_p.error('either PATTERN or --patterns is required')
+            if args.output_dir is not None:
+                grep_p.error('--output-dir requires --patterns')
+            if args.page_size <= 0:
+                grep_p.error('--page-size has to be positive')
+            limit = _limit_from_args(grep_p, args)
+            cache = _cache_from_args(grep_p, args)
+            fields = _fields_from_args(args)
+            new = not args.reuse_tab
+            grep(args.PATTERN, args.html, limit, fields, not args.print,
+                 new, profile, args.profile_json, args.hot_spots,
+                 args.pipeline, args.pages, args.page_size, cache)
 
     elif args.cmd == 'sed':
-        sed(args.FILE)
+        profile = args.profile or args.profile_json is not None
+        if args.max_steps is not None and args.max_steps <= 0:
+            sed_p.error('--max-steps has to be positive')
+        if args.max_steps is not None and is_compiled_scripts(args.FILE):
+            sed_p.error("can't use --max-steps with a compiled module")
+        if args.max_rounds <= 0:
+            sed_p.error('--max-rounds has to be positive')
+        max_rounds = args.max_rounds if args.until_fixpoint else None
+        sed(args.FILE, args.dispatch_report, profile, args.profile_json,
+            args.hot_spots, args.max_steps, args.over_budget, max_rounds,
+            args.pipeline)
+
+    elif args.cmd == 'bundle':
+        bundle(args.FILE, args.OUTPUT)
+
+    elif args.cmd == 'compile-scripts':
+        compile_scripts_file(args.FILE, args.OUTPUT)
 
     elif args.cmd == 'html':
-        if args.limit <= 0:
-            html_p.error('--limit has to be positive')
+        if args.page_size <= 0:
+            html_p.error('--page-size has to be positive')
+        limit = _limit_from_args(html_p, args)
+        cache = _cache_from_args(html_p, args)
         fields = _fields_from_args(args)
-        html(args.limit, fields, not args.print, not args.reuse_tab)
+        html(limit, fields, not args.print, not args.reuse_tab, args.pages,
+             args.page_size, cache)
 
     elif args.cmd == 'gdb':
         fields = _fields_from_args(args)
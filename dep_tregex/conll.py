@@ -1,3 +1,5 @@
+import sys
+
 from dep_tregex.tree import Tree
 
 def _valid(text, empty_allowed=False):
@@ -55,6 +57,10 @@ def read_trees_conll(filename_or_file, errors='strict'):
                         [], [], [], [], [], [], []
                 continue
 
+            # Skip comments (e.g. tags written by 'grep --patterns').
+            if line.startswith(u'#'):
+                continue
+
             # Split the line and check the format.
             parts = line.split(u'\t')
             if len(parts) != 10:
@@ -143,3 +149,136 @@ def write_tree_conll(file, tree):
         file.write(u'\t'.join(parts) + u'\t_\t_\n')
 
     file.write(u'\n')
+
+## ----------------------------------------------------------------------------
+#                              Threaded I/O
+
+# Background threads only do blocking reads and writes, which release the
+# GIL; parsing and formatting stay in the main thread, since threads can't
+# run Python code in parallel. Data travels between threads in chunks of
+# about this many bytes.
+_CHUNK_SIZE = 65536
+
+class _ReadAhead:
+    """
+    Iterable over lines of a file, which reads the file in a background
+    thread, at most 'queue_size' chunks ahead.
+    """
+
+    def __init__(self, file, queue_size):
+        import Queue
+        import threading
+
+        self._file = file
+        self._queue = Queue.Queue(queue_size)
+
+        # A daemon thread won't keep the process alive if the file is not read
+        # to the end.
+        thread = threading.Thread(target=self._run)
+        thread.daemon = True
+        thread.start()
+
+    def __repr__(self):
+        return repr(self._file)
+
+    def _run(self):
+        # Chunks of lines go along with the exception that ended reading, if
+        # any; an empty chunk means end of file.
+        try:
+            while True:
+                lines = self._file.readlines(_CHUNK_SIZE)
+                self._queue.put((lines, None))
+                if not lines:
+                    return
+        except Exception:
+            self._queue.put(([], sys.exc_info()))
+
+    def __iter__(self):
+        while True:
+            lines, exc_info = self._queue.get()
+            if exc_info is not None:
+                raise exc_info[0], exc_info[1], exc_info[2]
+            if not lines:
+                return
+            for line in lines:
+                yield line
+
+def read_trees_conll_threaded(file, errors='strict', queue_size=16):
+    """
+    Same as read_trees_conll(), but the file is read in a background thread,
+    so that waiting for input overlaps with processing the trees.
+
+    file: file object to read trees from.
+    queue_size: how many chunks of the file may be read ahead.
+    """
+    return read_trees_conll(_ReadAhead(file, queue_size), errors)
+
+class ThreadedWriter:
+    """
+    File-like object, which collects writes into chunks and writes them to
+    the underlying file in a background thread, so that waiting for output
+    overlaps with producing it.
+
+    The first exception in the background thread is re-raised by the next
+    write() or by close().
+    """
+
+    def __init__(self, file, queue_size=16):
+        """
+        file: file-like object to write to.
+        queue_size: how many chunks may wait; write() blocks when there are
+        more.
+        """
+        import Queue
+        import threading
+
+        self._file = file
+        self._queue = Queue.Queue(queue_size)
+        self._chunk = []
+        self._chunk_size = 0
+        self._exc_info = None
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            data = self._queue.get()
+            if data is None:
+                return
+
+            # After an error, keep draining the queue so that write() doesn't
+            # block forever.
+            if self._exc_info is not None:
+                continue
+            try:
+                self._file.write(data)
+            except Exception:
+                self._exc_info = sys.exc_info()
+
+    def _raise(self):
+        exc_info = self._exc_info
+        if exc_info is not None:
+            raise exc_info[0], exc_info[1], exc_info[2]
+
+    def _put_chunk(self):
+        self._queue.put(''.join(self._chunk))
+        self._chunk = []
+        self._chunk_size = 0
+
+    def write(self, s):
+        self._raise()
+        self._chunk.append(s)
+        self._chunk_size += len(s)
+        if self._chunk_size >= _CHUNK_SIZE:
+            self._put_chunk()
+
+    def close(self):
+        """
+        Wait until everything is written. Doesn't close the underlying file.
+        """
+        if self._chunk:
+            self._put_chunk()
+        self._queue.put(None)
+        self._thread.join()
+        self._raise()
@@ -9,7 +9,8 @@ def _check_is_not_a_str_list(l, name):
 class Tree:
     # - Constructor - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
-    def __init__(self, forms, lemmas, cpostags, postags, feats, heads, deprels):
+    def __init__(self, forms, lemmas, cpostags, postags, feats, heads, deprels,
+                 ids=None):
         """
         Construct a tree.
 
@@ -20,6 +21,8 @@ class Tree:
         feats: list of featuresets; each featureset is a list of 'unicode'.
         head: list of int
         deprels: list of 'unicode'
+        ids: list of distinct positive int node ids (see ids()); default is
+             1, 2, ..., N.
         """
 
         # Store.
@@ -33,6 +36,9 @@ class Tree:
 
         # Check lengths.
         N = len(self._forms)
+        if ids is None:
+            ids = range(1, N + 1)
+        self._ids = list(ids)
         msg = 'invalid %s: %r. Expected %i elements.'
         if len(self._lemmas) != N:
             raise ValueError(msg % ('lemmas', self._lemmas, N))
@@ -46,6 +52,8 @@ class Tree:
             raise ValueError(msg % ('heads', self._heads, N))
         if len(self._deprels) != N:
             raise ValueError(msg % ('deprels', self._deprels, N))
+        if len(self._ids) != N:
+            raise ValueError(msg % ('ids', self._ids, N))
 
         # Check indices.
         if not all(0 <= head <= N for head in self._heads):
@@ -61,28 +69,42 @@ class Tree:
         _check_is_not_a_str_list(self._heads, 'Tree.heads')
         _check_is_not_a_str_list(self._deprels, 'Tree.deprels')
 
+        # Index by id.
+        self._node_by_id = {0: 0}
+        for node, id in enumerate(self._ids, start=1):
+            self._node_by_id[id] = node
+        if len(self._node_by_id) != N + 1 or not all(id > 0 for id in self._ids):
+            raise ValueError('invalid ids: %r' % self._ids)
+
+        # Mutators re-run the constructor; keep handing out ids from where
+        # we've stopped, so that ids of deleted nodes are not reused.
+        next_id = max(self._ids) + 1 if self._ids else 1
+        self._next_id = max(next_id, getattr(self, '_next_id', 1))
+
+        # Joined FEATS strings and FEATS sets are computed on demand (see
+        # feats_string() and feats_set()).
+        self._feats_strings = [None] * N
+        self._feats_sets = [None] * N
+
         # Compose children index.
         self._children = [[] for node in range(N + 1)]
         for node, head in enumerate(self._heads, start=1):
             self._children[head].append(node)
 
-        # Check tree validity: connectivity and looplessness.
-        queue = [0]
-        visited = set()
-        i = 0
-
-        while i < len(queue):
-            node = queue[i]
-            visited.add(node)
-            i += 1
-
-            for child in self.children(node):
-                if child in visited:
-                    raise ValueError('loop in a tree; heads %r' % self._heads)
-                queue.append(child)
-
-        if len(queue) != len(self) + 1:
+        # Check tree validity: connectivity and looplessness. Every node has
+        # one head, so nodes on a loop are not reachable from the root.
+        # Along the way, list nodes in depth-first order, where every subtree
+        # is a contiguous interval (see subtree()).
+        self._preorder = []
+        stack = [0]
+        while stack:
+            node = stack.pop()
+            self._preorder.append(node)
+            stack.extend(reversed(self._children[node]))
+
+        if len(self._preorder) != len(self) + 1:
             raise ValueError('dicsonnected node, heads %r' % self._heads)
+        self._subtree_intervals = None
 
     # - Getters - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
@@ -137,6 +159,35 @@ class Tree:
             raise IndexError()
         return self._feats[i - 1]
 
+    def feats_string(self, i):
+        """
+        Return FEATS for i'th word as a single '|'-separated string.
+        i is 1-based.
+        """
+        feats = self.feats(i)
+
+        # The cached string is valid only while FEATS is the very same list:
+        # actions may replace the list in self._feats behind our back.
+        cached = self._feats_strings[i - 1]
+        if cached is None or cached[0] is not feats:
+            cached = (feats, u'|'.join(feats))
+            self._feats_strings[i - 1] = cached
+        return cached[1]
+
+    def feats_set(self, i):
+        """
+        Return FEATS for i'th word as a frozenset of string features.
+        i is 1-based.
+        """
+        feats = self.feats(i)
+
+        # Same caching scheme as in feats_string().
+        cached = self._feats_sets[i - 1]
+        if cached is None or cached[0] is not feats:
+            cached = (feats, frozenset(feats))
+            self._feats_sets[i - 1] = cached
+        return cached[1]
+
     def heads(self, i):
         """
         Return HEAD for i'th word.
@@ -155,6 +206,27 @@ class Tree:
             raise IndexError()
         return self._deprels[i - 1]
 
+    def ids(self, i):
+        """
+        Return id of i'th word. Ids don't change when words are moved, or
+        other words are copied or deleted; copies get new ids. Ids of deleted
+        words are never reused.
+        i is 1-based; root node's id is 0.
+        """
+        if i < 0:
+            raise IndexError()
+        if i == 0:
+            return 0
+        return self._ids[i - 1]
+
+    def node_by_id(self, id):
+        """
+        Return index of the word with given id, or None if there's no such
+        word (e.g. it was deleted).
+        Result is 1-based; 0 means "root node".
+        """
+        return self._node_by_id.get(id)
+
     def children(self, i):
         """
         Return a list of children for i'th word.
@@ -170,26 +242,51 @@ class Tree:
         i'th word.
         i is 1-based; 0 means "root node".
         """
-        result = []
-        for child in self.children(i):
-            result += [child] + self.children_recursive(child)
-        return result
+        return self.subtree(i)[1:]
+
+    def subtree(self, i):
+        """
+        Return a list of i'th word and all its descendants, in depth-first
+        order.
+        i is 1-based; 0 means "root node".
+        """
+        if i < 0:
+            raise IndexError()
+
+        # Compute where each subtree starts and ends in self._preorder.
+        if self._subtree_intervals is None:
+            N = len(self)
+            starts = [0] * (N + 1)
+            sizes = [1] * (N + 1)
+            for start, node in enumerate(self._preorder):
+                starts[node] = start
+            for node in reversed(self._preorder):
+                if node != 0:
+                    sizes[self._heads[node - 1]] += sizes[node]
+            self._subtree_intervals = (starts, sizes)
+
+        starts, sizes = self._subtree_intervals
+        start = starts[i]
+        return self._preorder[start:start + sizes[i]]
 
     # - Mutators  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
     def append(self, forms, lemmas, cpostags, postags, feats, heads, deprels):
         """
-        Append new nodes to the tree.
+        Append new nodes to the tree. New nodes get new ids.
         Arguments are the same as in constructor.
         """
+        forms = list(forms)
+        new_ids = range(self._next_id, self._next_id + len(forms))
         self.__init__(
-            self._forms + list(forms),
+            self._forms + forms,
             self._lemmas + list(lemmas),
             self._cpostags + list(cpostags),
             self._postags + list(postags),
             self._feats + list(feats),
             self._heads + list(heads),
-            self._deprels + list(deprels)
+            self._deprels + list(deprels),
+            self._ids + new_ids
             )
 
     def reorder(self, new_index_by_old_index):
@@ -217,6 +314,7 @@ class Tree:
         feats = [None] * N
         heads = [None] * N
         deprels = [None] * N
+        ids = [None] * N
 
         for old_index, new_index in enumerate(new_indices):
             old_head = self._heads[old_index]
@@ -232,14 +330,19 @@ class Tree:
             feats[new_index] = self._feats[old_index]
             heads[new_index] = new_head
             deprels[new_index] = self._deprels[old_index]
+            ids[new_index] = self._ids[old_index]
 
         # Update.
-        self.__init__(forms, lemmas, cpostags, postags, feats, heads, deprels)
+        self.__init__(forms, lemmas, cpostags, postags, feats, heads, deprels,
+                      ids)
 
     def delete(self, nodes):
         """
         Delete specified nodes from the tree.
         Lift the arcs of the orphaned nodes until their heads are non-deleted.
+
+        Return index remapping: new_index_by_old_index, like in move(), with
+        None for deleted nodes. Indices are 0-based.
         """
         # Check indices.
         N = len(self)
@@ -277,6 +380,7 @@ class Tree:
         feats = []
         heads = []
         deprels = []
+        ids = []
 
         for node in range(1, N + 1):
             if node in deleted:
@@ -288,9 +392,17 @@ class Tree:
             feats.append(self.feats(node))
             heads.append(new_nodes[alive_heads[node - 1]])
             deprels.append(self.deprels(node))
+            ids.append(self.ids(node))
 
         # Construct new tree.
-        self.__init__(forms, lemmas, cpostags, postags, feats, heads, deprels)
+        self.__init__(forms, lemmas, cpostags, postags, feats, heads, deprels,
+                      ids)
+
+        new_indices = [None] * N
+        for node in range(1, N + 1):
+            if node not in deleted:
+                new_indices[node - 1] = new_nodes[node] - 1
+        return new_indices
 
     def set_head(self, node, head):
         """
@@ -316,13 +428,25 @@ class Tree:
             self._postags,
             self._feats,
             heads,
-            self._deprels
+            self._deprels,
+            self._ids
             )
 
-    def append_copy(self, nodes):
+    BEFORE = '-'
+    AFTER = '+'
+
+    def insert_copy(self, nodes, anchor, where):
         """
-        Append a copy of gathered-together nodes at the end of the tree.
-        For every node, preserve the parent unless the parent was copied too.
+        Insert a copy of gathered-together nodes before or after the given
+        anchor node. For every node, preserve the parent unless the parent was
+        copied too.
+
+        Same as appending the copies at the end of the tree followed by move()
+        of the copies, but rebuilds the tree only once. Return index remapping
+        that move() would've returned then: new_index_by_old_index, where
+        copies are numbered after the old nodes. Indices are 0-based.
+
+        'anchor' can be either "-" (before) or "+" (after).
         """
         # Check indices.
         N = len(self)
@@ -330,16 +454,29 @@ class Tree:
             nodes = [nodes]
         if not all(0 < node <= N for node in nodes):
             raise IndexError()
+        if not 0 <= anchor <= N:
+            raise IndexError()
 
-        # Determine where we want the new nodes.
+        # Copies are numbered N + 1, N + 2, ... in the order of the originals.
         copied = sorted(nodes)
-        new_nodes = {0: 0}
-        new_node = N + 1
-        for node in copied:
-            new_nodes[node] = new_node
-            new_node += 1
+        copy_nodes = {}
+        for i, node in enumerate(copied):
+            copy_nodes[node] = N + 1 + i
+
+        # Compose the new order, like in move().
+        order = range(1, anchor)
+        if where == self.AFTER and anchor != 0:
+            order.append(anchor)
+        order.extend(range(N + 1, N + 1 + len(copied)))
+        if where == self.BEFORE and anchor != 0:
+            order.append(anchor)
+        order.extend(range(anchor + 1, N + 1))
+
+        new_indices = [None] * len(order)
+        for new_index, node in enumerate(order):
+            new_indices[node - 1] = new_index
 
-        # Prepare to append.
+        # Gather stuff in the new order.
         forms = []
         lemmas = []
         cpostags = []
@@ -347,25 +484,31 @@ class Tree:
         feats = []
         heads = []
         deprels = []
+        ids = []
 
-        for node in copied:
-            head = self.heads(node)
-            if head in copied:
-                head = new_nodes[head]
+        for node in order:
+            if node <= N:
+                head = self.heads(node)
+                id = self.ids(node)
+            else:
+                copy_no = node - N - 1
+                node = copied[copy_no]
+                head = copy_nodes.get(self.heads(node), self.heads(node))
+                id = self._next_id + copy_no
 
             forms.append(self.forms(node))
             lemmas.append(self.lemmas(node))
             cpostags.append(self.cpostags(node))
             postags.append(self.postags(node))
             feats.append(self.feats(node))
-            heads.append(head)
+            heads.append(new_indices[head - 1] + 1 if head != 0 else 0)
             deprels.append(self.deprels(node))
+            ids.append(id)
 
-        # Append.`
-        self.append(forms, lemmas, cpostags, postags, feats, heads, deprels)
-
-    BEFORE = '-'
-    AFTER = '+'
+        # Construct new tree.
+        self.__init__(forms, lemmas, cpostags, postags, feats, heads, deprels,
+                      ids)
+        return new_indices
 
     def move(self, nodes, anchor, where):
         """
@@ -13,6 +13,9 @@ class TreeAction:
     description).
     """
 
+    # Whether the action may set new attribute values (see ScriptIndex).
+    sets_attrs = False
+
     def get_backref(self, state, backref):
         """
         Return state.backrefs[backref] or raise TreeActionError if no such key.
@@ -81,18 +84,13 @@ def _gather(state, what, sel_what):
     else:
         return state.gather_group(what)
 
-def _move(state, what_list, anchor, sel_anchor, where):
+def _select_anchor(state, what_list, anchor, sel_anchor, where):
     """
-    Move specified nodes (what_list) w.r.t specified anchor. Anchor might be
-    a group of nodes, in which case a special behaviour is invoked.
-
-    what_list: list of nodes to move; after the move, the nodes will end up
-    next to each other
-
-    anchor, sel_anchor: node (or a node group) to the right or to the left of
-    which the moved nodes will go.
+    Return the node to move (or copy) nodes before or after, or None if there
+    is no such node.
 
-    where: Tree.BEFORE or Tree.AFTER
+    what_list: list of nodes to move, can't be the anchor
+    anchor, sel_anchor, where: see _move()
     """
 
     # If we're asked to move before/after the group, we select the
@@ -108,15 +106,31 @@ def _move(state, what_list, anchor, sel_anchor, where):
         anchor_list = _gather(state, anchor, sel_anchor)
         anchor_list = set(anchor_list) - set(what_list)
         if not anchor_list:
-            return
+            return None
 
         if where == Tree.BEFORE:
             anchor = min(anchor_list)
         else:
             anchor = max(anchor_list)
 
-    # Invoke.
-    state.move(what_list, anchor, where)
+    return anchor
+
+def _move(state, what_list, anchor, sel_anchor, where):
+    """
+    Move specified nodes (what_list) w.r.t specified anchor. Anchor might be
+    a group of nodes, in which case a special behaviour is invoked.
+
+    what_list: list of nodes to move; after the move, the nodes will end up
+    next to each other
+
+    anchor, sel_anchor: node (or a node group) to the right or to the left of
+    which the moved nodes will go.
+
+    where: Tree.BEFORE or Tree.AFTER
+    """
+    anchor = _select_anchor(state, what_list, anchor, sel_anchor, where)
+    if anchor is not None:
+        state.move(what_list, anchor, where)
 
 ## ----------------------------------------------------------------------------
 #                                   Actions
@@ -179,15 +193,11 @@ class Copy(TreeAction):
         if self.where == Tree.BEFORE and anchor == 0:
             self.error("can't move something before root")
 
-        # Append.
+        # Gather indices & insert copies. The copies aren't in the tree yet,
+        # so none of them can be the anchor.
         what = _gather(state, what, self.sel_what)
-        state.tree.append_copy(what)
-        num_new_words = len(what)
-        new_num_words = len(state.tree)
-
-        # Gather indices & move.
-        moved = range(new_num_words - num_new_words + 1, new_num_words + 1)
-        _move(state, moved, anchor, self.sel_anchor, self.where)
+        anchor = _select_anchor(state, [], anchor, self.sel_anchor, self.where)
+        state.insert_copy(what, anchor, self.where)
 
 class Delete(TreeAction):
     """
@@ -214,11 +224,22 @@ class Delete(TreeAction):
         # Do it.
         state.delete(deleted_nodes)
 
+def constant_fn(value):
+    """
+    Return a function 'newval_fn(x)' for MutateAttr which always returns
+    'value'. Unlike a lambda, it can be serialized along with the action.
+    """
+    newval_fn = lambda x, value=value: value
+    newval_fn.value = value
+    return newval_fn
+
 class MutateAttr(TreeAction):
     """
     Modify 'attr'
     """
 
+    sets_attrs = True
+
     def __init__(self, node, attr, newval_fn):
         """
         'node' should be a backreference (i.e. 'unicode').
@@ -227,13 +248,27 @@ class MutateAttr(TreeAction):
         self.attr = attr
         self.newval_fn = newval_fn
 
+    def __getstate__(self):
+        if not hasattr(self.newval_fn, 'value'):
+            raise TypeError("can't serialize function %r" % self.newval_fn)
+        state = self.__dict__.copy()
+        state['newval_fn'] = self.newval_fn.value
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.newval_fn = constant_fn(self.newval_fn)
+
     def apply(self, state):
         node = self.get_backref(state, self.node)
         if node == 0:
             self.error("can't set %r on root" % self.attr)
         # HACK: we use direct access to e.g. tree._forms.
         attr = getattr(state.tree, self.attr)
-        attr[node - 1] = self.newval_fn(attr[node - 1])
+        newval = self.newval_fn(attr[node - 1])
+        if newval != attr[node - 1]:
+            attr[node - 1] = newval
+            state.touch(node)
 
 class SetHead(TreeAction):
     """
@@ -265,7 +300,7 @@ class SetHead(TreeAction):
         if self.raise_on_invalid_head and not can_set_head:
             self.error("can't set head, invalid head")
         if can_set_head:
-            state.tree.set_head(node=node, head=head)
+            state.set_head(node=node, head=head)
 
 class GroupTogether(TreeAction):
     """
@@ -286,3 +321,16 @@ class GroupTogether(TreeAction):
         node1 = self.get_backref(state, self.node1)
         node2 = self.get_backref(state, self.node2)
         state.group_together(node1, node2)
+
+class CompiledActions(TreeAction):
+    """
+    All actions of a script, compiled into one Python function
+    'apply_fn(state)' (see compile_scripts()).
+    """
+
+    def __init__(self, apply_fn, sets_attrs):
+        self.apply_fn = apply_fn
+        self.sets_attrs = sets_attrs
+
+    def apply(self, state):
+        self.apply_fn(state)
@@ -0,0 +1,498 @@
+from dep_tregex.tree import *
+from dep_tregex.tree_action import *
+from dep_tregex.tree_pattern import *
+from dep_tregex.tree_pattern import _is_literal
+from dep_tregex.tree_script import *
+
+## ----------------------------------------------------------------------------
+#                               Compiled scripts
+
+# First line of every generated module.
+_COMPILED_HEADER = '# dep_tregex compiled scripts v1\n'
+
+def compiled_script(match_fn, apply_fn, radius, requirements, sets_attrs,
+                    pos=None, text=None, pattern_text=None):
+    """
+    Return a TreeScript made of generated functions (see compile_scripts()).
+
+    match_fn, radius, requirements: see CompiledPattern
+    apply_fn, sets_attrs: see CompiledActions
+    pos, text, pattern_text: 'pos' and 'text' of the original script, and
+    'text' of its pattern
+    """
+    pattern = CompiledPattern(match_fn, radius, requirements)
+    pattern.text = pattern_text
+    script = TreeScript(pattern, [CompiledActions(apply_fn, sets_attrs)])
+    script.pos = pos
+    script.text = text
+    return script
+
+def is_compiled_scripts(filename):
+    """
+    Return whether the file was written by compile_scripts().
+    """
+    with open(filename, 'rb') as f:
+        return f.readline() == _COMPILED_HEADER
+
+def load_compiled_scripts(filename):
+    """
+    Execute a module written by compile_scripts().
+    Return list of TreeScript objects.
+
+    The module runs as any Python code would: only load modules you trust.
+    """
+    with open(filename, 'rt') as f:
+        source = f.read()
+    if not source.startswith(_COMPILED_HEADER):
+        raise ValueError('not a dep_tregex compiled scripts module: %r' %
+                         filename)
+
+    # Not imp.load_source(): its .pyc cache goes stale if the module is
+    # rewritten within a second. And not a module object: when it's gone,
+    # Python clears its globals, which the functions still need.
+    namespace = {'__name__': '_dep_tregex_compiled', '__file__': filename}
+    exec(compile(source, filename, 'exec'), namespace)
+    return namespace['SCRIPTS']
+
+## ----------------------------------------------------------------------------
+#                                 Compiler
+
+class CompileError(ValueError):
+    pass
+
+def compile_scripts(file, scripts, source=None):
+    """
+    Write a Python module that does the same as the scripts, to a text file.
+    load_compiled_scripts() reads it back.
+
+    Every script becomes a pair of functions: its pattern is unrolled into
+    nested loops over the tree, and its actions into direct calls on
+    TreeState. Raise CompileError for patterns or actions the compiler
+    doesn't know.
+
+    file: file-like object to write to.
+    scripts: list of TreeScript objects, e.g. from parse_scripts().
+    source: name of the scripts file, for the module's comment.
+    """
+    compiler = _ScriptCompiler()
+    for script_no, script in enumerate(scripts):
+        compiler.add_script(script_no, script)
+
+    file.write(_COMPILED_HEADER)
+    if source is not None:
+        file.write('# Generated from %s; do not edit.\n' % source)
+    file.write('\n')
+    file.write('from dep_tregex.tree_action import TreeActionError\n')
+    file.write('from dep_tregex.tree_compiler import compiled_script\n')
+    file.write('from dep_tregex.tree_pattern import predicate_from_spec\n')
+    file.write('\n')
+    for line in compiler.consts:
+        file.write(line + '\n')
+    for line in compiler.lines:
+        file.write((line + '\n') if line else '\n')
+    file.write('\n')
+    file.write('SCRIPTS = [\n')
+    for line in compiler.scripts:
+        file.write('    %s,\n' % line)
+    file.write(']\n')
+
+# Patterns that look at the node through a sub-pattern, by the loop header
+# over related nodes and the filter on them ('{n}' being the node, '{m}' the
+# related node).
+_LOOPS = {
+    HasLeftChild: ('for {m} in tree._children[{n}]:', '{m} < {n}'),
+    HasRightChild: ('for {m} in tree._children[{n}]:', '{m} > {n}'),
+    HasChild: ('for {m} in tree._children[{n}]:', None),
+    HasAdjacentLeftChild: ('for {m} in tree._children[{n}]:',
+                           '{m} + 1 == {n}'),
+    HasAdjacentRightChild: ('for {m} in tree._children[{n}]:',
+                            '{m} - 1 == {n}'),
+    HasAdjacentChild: ('for {m} in tree._children[{n}]:',
+                       '{m} - {n} in (-1, 1)'),
+    HasSuccessor: ('for {m} in tree.children_recursive({n}):', None),
+    HasLeftNeighbor: ('for {m} in range(0, {n}):', None),
+    HasRightNeighbor: ('for {m} in range({n} + 1, len(tree) + 1):', None),
+    }
+
+# Patterns that look at a single related node: guard on the node, the related
+# node, and the filter on it.
+_STEPS = {
+    HasLeftHead: ('{n} != 0', 'tree._heads[{n} - 1]', '{m} < {n}'),
+    HasRightHead: ('{n} != 0', 'tree._heads[{n} - 1]', '{m} > {n}'),
+    HasHead: ('{n} != 0', 'tree._heads[{n} - 1]', None),
+    HasAdjacentLeftHead: ('{n} != 0', 'tree._heads[{n} - 1]',
+                          '{m} + 1 == {n}'),
+    HasAdjacentRightHead: ('{n} != 0', 'tree._heads[{n} - 1]',
+                           '{m} - 1 == {n}'),
+    HasAdjacentHead: ('{n} != 0', 'tree._heads[{n} - 1]',
+                      '{m} - {n} in (-1, 1)'),
+    HasAdjacentLeftNeighbor: ('{n} != 0', '{n} - 1', None),
+    HasAdjacentRightNeighbor: ('{n} != len(tree)', '{n} + 1', None),
+    NotRoot: ('{n} != 0', '{n}', None),
+    }
+
+def _writes_backrefs(pattern):
+    """
+    Return whether matching the pattern may add to the backrefs map.
+    """
+    if isinstance(pattern, SetBackref):
+        return True
+    return any(_writes_backrefs(p) for p in subpatterns(pattern))
+
+class _ScriptCompiler:
+    """
+    Accumulates generated code: module-level constants, functions, and
+    compiled_script() calls.
+    """
+
+    def __init__(self):
+        self.consts = []
+        self.lines = []
+        self.scripts = []
+        self._names = 0
+
+    def name(self, prefix):
+        """
+        Return a fresh variable name.
+        """
+        self._names += 1
+        return '%s%i' % (prefix, self._names)
+
+    def const(self, prefix, expr):
+        """
+        Define a module-level constant; return its name.
+        """
+        name = self.name('_' + prefix)
+        self.consts.append('%s = %s' % (name, expr))
+        return name
+
+    def emit(self, indent, line):
+        self.lines.append('    ' * indent + line)
+
+    # - Scripts - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+    def add_script(self, script_no, script):
+        text = getattr(script, 'text', None)
+        self.lines.append('')
+        self.lines.append('# ' + '-' * 77)
+        if text is not None:
+            for line in text.splitlines():
+                self.lines.append(('# ' + line).rstrip().encode(
+                    'ascii', 'backslashreplace'))
+        self.lines.append('')
+
+        # Pattern.
+        match_fn = 'match_%i' % script_no
+        self.emit(0, 'def %s(tree, node, backrefs_map):' % match_fn)
+        result = self.pattern(script.pattern, 'node', 'backrefs_map', 1)
+        self.emit(1, 'return %s' % result)
+        self.lines.append('')
+
+        # Actions.
+        apply_fn = 'apply_%i' % script_no
+        self.emit(0, 'def %s(state):' % apply_fn)
+        self.emit(1, 'backrefs_map = state.backrefs_map')
+        for action in script.actions:
+            self.action(action, 1)
+
+        # Everything else is known at compile time.
+        requirements = ', '.join(
+            '(%r, frozenset(%r))' % (attr, sorted(values))
+            for attr, values in required_literals(script.pattern))
+        sets_attrs = any(a.sets_attrs for a in script.actions)
+        self.scripts.append(
+            'compiled_script(%s, %s, %r, [%s], %r, %r, %r, %r)' % (
+                match_fn, apply_fn, pattern_radius(script.pattern),
+                requirements, sets_attrs, getattr(script, 'pos', None), text,
+                getattr(script.pattern, 'text', None)))
+
+    # - Patterns  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+    def pattern(self, pattern, node, backrefs_map, indent):
+        """
+        Emit code that does 'pattern.match(tree, node, backrefs_map)'.
+        Return name of the variable that holds the result.
+
+        node, backrefs_map: names of variables
+        """
+        r = self.name('r')
+        emit = lambda line, i=0: self.emit(indent + i, line)
+        cls = pattern.__class__
+
+        if cls in _LOOPS:
+            header, test = _LOOPS[cls]
+            m = self.name('n')
+            emit('%s = False' % r)
+            emit(header.format(n=node, m=m))
+            if test is not None:
+                emit('if not (%s):' % test.format(n=node, m=m), 1)
+                emit('continue', 2)
+            sub = self.pattern(pattern.condition, m, backrefs_map, indent + 1)
+            emit('if %s:' % sub, 1)
+            emit('%s = True' % r, 2)
+            emit('break', 2)
+            return r
+
+        if cls in _STEPS:
+            guard, step, test = _STEPS[cls]
+            emit('%s = False' % r)
+            emit('if %s:' % guard.format(n=node))
+            if step == '{n}':
+                m = node
+            else:
+                m = self.name('n')
+                emit('%s = %s' % (m, step.format(n=node)), 1)
+            i = 1
+            if test is not None:
+                emit('if %s:' % test.format(n=node, m=m), 1)
+                i = 2
+            sub = self.pattern(pattern.condition, m, backrefs_map, indent + i)
+            emit('%s = %s' % (r, sub), i)
+            return r
+
+        if cls is HasPredecessor:
+            m = self.name('n')
+            emit('%s = False' % r)
+            emit('%s = %s' % (m, node))
+            emit('while True:')
+            emit('%s = tree.heads(%s)' % (m, m), 1)
+            sub = self.pattern(pattern.condition, m, backrefs_map, indent + 1)
+            emit('if %s:' % sub, 1)
+            emit('%s = True' % r, 2)
+            emit('break', 2)
+            emit('if %s == 0:' % m, 1)
+            emit('break', 2)
+            return r
+
+        if cls is AttrMatches:
+            value = 'tree.%s[%s - 1]' % ('_' + pattern.attr, node)
+            emit('%s = %s != 0 and %s' % (
+                r, node, self.predicate(pattern.pred_fn, value)))
+            return r
+
+        if cls is FeatsMatch:
+            value = 'tree.feats_string(%s)' % node
+            emit('%s = %s != 0 and %s' % (
+                r, node, self.predicate(pattern.pred_fn, value)))
+            return r
+
+        if cls is HasFeat:
+            emit('%s = %s != 0 and %r in tree.feats_set(%s)' % (
+                r, node, pattern.feat, node))
+            return r
+
+        if cls is CanHead:
+            emit('%s = %r in %s and %s not in tree.subtree(%s[%r])' % (
+                r, pattern.backref, backrefs_map, node, backrefs_map,
+                pattern.backref))
+            return r
+
+        if cls is CanBeHeadedBy:
+            emit('%s = %r in %s and %s[%r] not in tree.subtree(%s)' % (
+                r, pattern.backref, backrefs_map, backrefs_map,
+                pattern.backref, node))
+            return r
+
+        if cls is IsRoot:
+            emit('%s = %s == 0' % (r, node))
+            return r
+
+        if cls is IsTop:
+            emit('%s = %s != 0 and tree._heads[%s - 1] == 0' % (r, node, node))
+            return r
+
+        if cls is IsLeaf:
+            emit('%s = not tree._children[%s]' % (r, node))
+            return r
+
+        if cls is AlwaysTrue:
+            emit('%s = True' % r)
+            return r
+
+        if cls is EqualsBackref:
+            emit('%s = %s.get(%r) == %s' % (
+                r, backrefs_map, pattern.backref, node))
+            return r
+
+        if cls is And:
+            # A failed condition leaves the map intact, so only changes made
+            # by all conditions but the last may need undoing.
+            writes = any(_writes_backrefs(condition)
+                         for condition in pattern.conditions[:-1])
+            if writes:
+                old_map = self.name('m')
+                emit('%s = %s.copy()' % (old_map, backrefs_map))
+            emit('%s = False' % r)
+            for i, condition in enumerate(pattern.conditions):
+                sub = self.pattern(condition, node, backrefs_map, indent + i)
+                emit('if %s:' % sub, i)
+            emit('%s = True' % r, len(pattern.conditions))
+            if writes:
+                emit('if not %s:' % r)
+                emit('%s.clear()' % backrefs_map, 1)
+                emit('%s.update(%s)' % (backrefs_map, old_map), 1)
+            return r
+
+        if cls is Or:
+            for i, condition in enumerate(pattern.conditions):
+                if i:
+                    emit('if not %s:' % r, i - 1)
+                sub = self.pattern(condition, node, backrefs_map, indent + i)
+                emit('%s = %s' % (r, sub), i)
+            return r
+
+        if cls is Not:
+            # Changes to the map are thrown away, so a copy is needed only if
+            # there are any.
+            sub_map = backrefs_map
+            if _writes_backrefs(pattern.condition):
+                sub_map = self.name('m')
+                emit('%s = %s.copy()' % (sub_map, backrefs_map))
+            sub = self.pattern(pattern.condition, node, sub_map, indent)
+            emit('%s = not %s' % (r, sub))
+            return r
+
+        if cls is SetBackref:
+            old = self.name('o')
+            emit('%s = %s.get(%r)' % (old, backrefs_map, pattern.backref))
+            emit('%s[%r] = %s' % (backrefs_map, pattern.backref, node))
+            sub = self.pattern(pattern.condition, node, backrefs_map, indent)
+            emit('if not %s:' % sub)
+            emit('if %s is None:' % old, 1)
+            emit('del %s[%r]' % (backrefs_map, pattern.backref), 2)
+            emit('else:', 1)
+            emit('%s[%r] = %s' % (backrefs_map, pattern.backref, old), 2)
+            emit('%s = %s' % (r, sub))
+            return r
+
+        raise CompileError("can't compile pattern %r" % pattern)
+
+    def predicate(self, pred_fn, value):
+        """
+        Return expression that does 'pred_fn(value)'.
+        """
+        spec = getattr(pred_fn, 'spec', None)
+        if spec is None:
+            raise CompileError("can't compile predicate %r" % pred_fn)
+
+        if spec[0] == 'literals' and len(spec[1]) == 1:
+            return '%s == %r' % (value, spec[1][0])
+        if spec[0] == 'literals':
+            literals = self.const('L', 'frozenset(%r)' % (spec[1],))
+            return '%s in %s' % (value, literals)
+
+        # Substring search, see compile_string_predicate().
+        pattern, ignore_case, anywhere = spec[1:]
+        if not ignore_case and anywhere and _is_literal(pattern):
+            return '%r in %s' % (pattern, value)
+
+        pred_fn = self.const('P', 'predicate_from_spec(%r)' % (spec,))
+        return '%s(%s)' % (pred_fn, value)
+
+    # - Actions - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+    def action(self, action, indent):
+        """
+        Emit code that does 'action.apply(state)'.
+        """
+        emit = lambda line, i=0: self.emit(indent + i, line)
+        info = self.const('A', '(%r, %r)' % (getattr(action, 'pos', None),
+                                             getattr(action, 'text', None)))
+
+        def error(msg, i):
+            emit('raise TreeActionError(%r, *%s)' % (msg, info), i)
+
+        def backref(backref):
+            var = self.name('n')
+            emit('if %r not in backrefs_map:' % backref)
+            error('node %r was not matched in the pattern' % backref, 1)
+            emit('%s = backrefs_map[%r]' % (var, backref))
+            return var
+
+        def gather(node, sel):
+            if sel == NODE:
+                return '[%s]' % node
+            return 'state.gather_group(%s)' % node
+
+        def select_anchor(what, anchor, where):
+            # See _select_anchor(): emit code that replaces the anchor with
+            # the leftmost or rightmost node of its group, or None.
+            anchors = self.name('a')
+            emit('%s = set(state.gather_group(%s)) - set(%s)' % (
+                anchors, anchor, what))
+            emit('%s = %s(%s) if %s else None' % (
+                anchor, 'min' if where == Tree.BEFORE else 'max', anchors,
+                anchors))
+
+        cls = action.__class__
+
+        if cls in (Move, Copy):
+            what = backref(action.what)
+            anchor = backref(action.anchor)
+            emit('if %s == 0:' % what)
+            error("can't move root", 1)
+            if action.where == Tree.BEFORE:
+                emit('if %s == 0:' % anchor)
+                error("can't move something before root", 1)
+
+            nodes = self.name('w')
+            emit('%s = %s' % (nodes, gather(what, action.sel_what)))
+            if cls is Move and action.sel_anchor == GROUP:
+                select_anchor(nodes, anchor, action.where)
+                emit('if %s is not None:' % anchor)
+                emit('state.move(%s, %s, %r)' % (nodes, anchor, action.where),
+                     1)
+            elif cls is Move:
+                emit('state.move(%s, %s, %r)' % (nodes, anchor, action.where))
+            else:
+                if action.sel_anchor == GROUP:
+                    select_anchor('[]', anchor, action.where)
+                emit('state.insert_copy(%s, %s, %r)' % (
+                    nodes, anchor, action.where))
+            return
+
+        if cls is Delete:
+            what = backref(action.what)
+            nodes = self.name('w')
+            emit('%s = %s' % (nodes, gather(what, action.sel_what)))
+            emit('if 0 in %s:' % nodes)
+            error("can't delete root", 1)
+            emit('state.delete(%s)' % nodes)
+            return
+
+        if cls is MutateAttr:
+            if not hasattr(action.newval_fn, 'value'):
+                raise CompileError("can't compile function %r" %
+                                   action.newval_fn)
+            node = backref(action.node)
+            emit('if %s == 0:' % node)
+            error("can't set %r on root" % action.attr, 1)
+            values = self.name('v')
+            emit('%s = state.tree.%s' % (values, action.attr))
+            emit('if %s[%s - 1] != %r:' % (values, node, action.newval_fn.value))
+            emit('%s[%s - 1] = %r' % (values, node, action.newval_fn.value), 1)
+            emit('state.touch(%s)' % node, 1)
+            return
+
+        if cls is SetHead:
+            node = backref(action.node)
+            head = backref(action.head)
+            emit('if %s == 0:' % node)
+            error("can't set root's head", 1)
+            can_set_head = self.name('c')
+            emit('%s = %s not in state.tree.subtree(%s)' % (
+                can_set_head, head, node))
+            if action.raise_on_invalid_head:
+                emit('if not %s:' % can_set_head)
+                error("can't set head, invalid head", 1)
+            emit('if %s:' % can_set_head)
+            emit('state.set_head(node=%s, head=%s)' % (node, head), 1)
+            return
+
+        if cls is GroupTogether:
+            node1 = backref(action.node1)
+            node2 = backref(action.node2)
+            emit('state.group_together(%s, %s)' % (node1, node2))
+            return
+
+        raise CompileError("can't compile action %r" % action)
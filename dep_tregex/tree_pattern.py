@@ -1,6 +1,7 @@
 from __future__ import print_function
 
 import re
+import time
 
 class TreePattern:
     """
@@ -26,6 +27,23 @@ class TreePattern:
         """
         raise NotImplementedError()
 
+    def match_all(self, tree, node, backrefs_map):
+        """
+        Yield once for every way the node matches this pattern.
+
+        Arguments are the same as in match(). On each yield, backrefs_map holds
+        the backreferences of that particular match; copy it if you need to
+        keep it. When the generator is exhausted, backrefs_map is left intact.
+
+        Default implementation suits patterns that have no sub-patterns: it
+        yields at most once.
+        """
+        old_map = backrefs_map.copy()
+        if self.match(tree, node, backrefs_map):
+            yield
+            backrefs_map.clear()
+            backrefs_map.update(old_map)
+
 def compile_regex(pattern, ignore_case, anywhere):
     """
     Return Python compiled regex. Match your string against it with
@@ -41,6 +59,437 @@ def compile_regex(pattern, ignore_case, anywhere):
         pattern = '^' + pattern + '$'
     return re.compile(pattern, flags)
 
+# Characters that have special meaning in a regex.
+_REGEX_METACHARS = frozenset('.^$*+?{}[]\\|()')
+
+def _is_literal(pattern):
+    """
+    Return whether a regex pattern matches only its own text.
+    """
+    return not any(c in _REGEX_METACHARS for c in pattern)
+
+def literal_predicate(literals):
+    """
+    Return a function 'pred_fn(s)', which tells whether a string equals one of
+    the literals.
+
+    The function has a 'literals' attribute (frozenset), so that prefilters
+    (see required_literals()) can inspect it.
+    """
+    literals = frozenset(literals)
+    if len(literals) == 1:
+        literal, = literals
+        pred_fn = lambda x, literal=literal: x == literal
+    else:
+        pred_fn = lambda x, literals=literals: x in literals
+    pred_fn.literals = literals
+    pred_fn.spec = ('literals', sorted(literals))
+    return pred_fn
+
+def compile_string_predicate(pattern, ignore_case, anywhere):
+    """
+    Return a function 'pred_fn(s)', which tells whether a string matches
+    a regex. Arguments are the same as in compile_regex().
+
+    Regexes without metacharacters become plain string comparisons.
+    Everything else, including alternations of literals (compile_regex()
+    anchors the whole of '^dog|cat$', not each alternative), goes through
+    compile_regex() and regex_predicate().
+    """
+    if not ignore_case and _is_literal(pattern):
+        if anywhere:
+            pred_fn = lambda x, literal=pattern: literal in x
+            pred_fn.spec = ('regex', pattern, ignore_case, anywhere)
+            return pred_fn
+        return literal_predicate([pattern])
+
+    r = compile_regex(pattern, ignore_case, anywhere)
+    pred_fn = regex_predicate(r)
+    pred_fn.spec = ('regex', pattern, ignore_case, anywhere)
+    return pred_fn
+
+def predicate_from_spec(spec):
+    """
+    Rebuild a predicate from its 'spec' attribute. Predicates made by
+    literal_predicate() and compile_string_predicate() have one, which makes
+    patterns that use them serializable.
+    """
+    if spec[0] == 'literals':
+        return literal_predicate(spec[1])
+    if spec[0] == 'regex':
+        return compile_string_predicate(*spec[1:])
+    raise ValueError('invalid predicate spec: %r' % (spec,))
+
+def _predicate_spec(pred_fn):
+    """
+    Return 'spec' of a predicate, or raise TypeError if there is none.
+    """
+    spec = getattr(pred_fn, 'spec', None)
+    if spec is None:
+        raise TypeError("can't serialize predicate %r" % pred_fn)
+    return spec
+
+# How many strings per regex remember their match result (per generation,
+# see regex_predicate()).
+_REGEX_CACHE_SIZE = 50000
+
+# Result caches shared by all patterns that use the same regex. Like re's
+# own cache, it is cleared when it grows past _REGEX_PREDICATES_SIZE regexes;
+# patterns made before that keep their predicates.
+_REGEX_PREDICATES = {}
+_REGEX_PREDICATES_SIZE = 100
+
+def regex_predicate(r):
+    """
+    Return a function 'pred_fn(s)', which tells whether r.search(s) succeeds.
+
+    Results are cached per distinct string, and the function is shared among
+    all patterns that use the same regex, so each string is searched once per
+    run.
+
+    Eviction approximates LRU with two generations of dicts: hits in the old
+    generation are promoted into the young one, and when the young generation
+    fills up, it becomes the old one and the previous old one is dropped.
+    """
+    key = (r.pattern, r.flags)
+    if key in _REGEX_PREDICATES:
+        return _REGEX_PREDICATES[key]
+
+    generations = [{}, {}]
+
+    def pred_fn(s):
+        # Young generation.
+        young = generations[0]
+        result = young.get(s)
+        if result is not None:
+            return result
+
+        # Old generation or the regex itself.
+        result = generations[1].get(s)
+        if result is None:
+            result = r.search(s) is not None
+
+        # Remember.
+        if len(young) >= _REGEX_CACHE_SIZE:
+            young = {}
+            generations[:] = [young, generations[0]]
+        young[s] = result
+        return result
+
+    if len(_REGEX_PREDICATES) >= _REGEX_PREDICATES_SIZE:
+        _REGEX_PREDICATES.clear()
+    _REGEX_PREDICATES[key] = pred_fn
+    return pred_fn
+
+def required_literals(pattern):
+    """
+    Return a list of (attr, values) pairs, attr being a Tree getter name
+    ('forms', 'lemmas', etc.) and values being a frozenset of strings.
+
+    For a tree to match the pattern anywhere, for every pair some node of the
+    tree must have 'attr' equal to one of 'values'. ('feats' pairs are
+    checked against single features, not the joined string.)
+
+    The list is conservative: patterns it can't see through contribute
+    nothing.
+    """
+    if isinstance(pattern, AttrMatches):
+        literals = getattr(pattern.pred_fn, 'literals', None)
+        if literals is None:
+            return []
+        return [(pattern.attr, literals)]
+
+    if isinstance(pattern, HasFeat):
+        return [('feats', frozenset([pattern.feat]))]
+
+    if isinstance(pattern, CompiledPattern):
+        return pattern.requirements
+
+    if isinstance(pattern, And):
+        result = []
+        for condition in pattern.conditions:
+            result += required_literals(condition)
+        return result
+
+    # 'not' may match anything, and 'or' may match by any branch.
+    if isinstance(pattern, (Not, Or)):
+        return []
+
+    # Other patterns with a sub-pattern match only if the sub-pattern matches
+    # some node of the tree.
+    condition = getattr(pattern, 'condition', None)
+    if condition is not None:
+        return required_literals(condition)
+    return []
+
+def pattern_radius(pattern):
+    """
+    Return how far from the matched node the pattern may look, or None if
+    the distance is unbounded.
+
+    Distance is counted in steps along tree arcs (head to child and back) and
+    between adjacent words (the root being adjacent to the first word). If
+    nothing changed within that distance from a node (words, arcs, word
+    order), the pattern's verdict on the node stays the same.
+    """
+    # Conditions on the node itself.
+    if isinstance(pattern, (AttrMatches, FeatsMatch, HasFeat, IsRoot,
+                            AlwaysTrue, EqualsBackref)):
+        return 0
+
+    # Conditions on the node's arcs.
+    if isinstance(pattern, (IsTop, IsLeaf)):
+        return 1
+
+    if isinstance(pattern, CompiledPattern):
+        return pattern.radius
+
+    # Logic.
+    if isinstance(pattern, (And, Or)):
+        radii = [pattern_radius(c) for c in pattern.conditions]
+        if None in radii:
+            return None
+        return max(radii)
+    if isinstance(pattern, (Not, NotRoot, SetBackref)):
+        return pattern_radius(pattern.condition)
+
+    # One step away.
+    if isinstance(pattern, (
+            HasLeftChild, HasRightChild, HasChild,
+            HasAdjacentLeftChild, HasAdjacentRightChild, HasAdjacentChild,
+            HasLeftHead, HasRightHead, HasHead,
+            HasAdjacentLeftHead, HasAdjacentRightHead, HasAdjacentHead,
+            HasAdjacentLeftNeighbor, HasAdjacentRightNeighbor)):
+        radius = pattern_radius(pattern.condition)
+        if radius is None:
+            return None
+        return radius + 1
+
+    # HasSuccessor, HasPredecessor, HasLeftNeighbor, HasRightNeighbor,
+    # CanHead, CanBeHeadedBy and unknown patterns.
+    return None
+
+def tree_vocabulary(tree, attr):
+    """
+    Return a set of all values of 'attr' in the tree (for 'feats', a set of
+    all single features).
+    """
+    nodes = range(1, len(tree) + 1)
+    if attr == 'feats':
+        result = set()
+        for node in nodes:
+            result.update(tree.feats(node))
+        return result
+
+    getter = getattr(tree, attr)
+    return set(getter(node) for node in nodes)
+
+def has_required_literals(tree, requirements, vocabularies):
+    """
+    Return whether the tree contains all literals from 'requirements', a
+    result of required_literals(). If not, the pattern can't match.
+
+    vocabularies: dict that caches tree_vocabulary() for this tree, attr ->
+    set; pass the same dict to check several patterns against one tree.
+    """
+    for attr, values in requirements:
+        if attr not in vocabularies:
+            vocabularies[attr] = tree_vocabulary(tree, attr)
+        if vocabularies[attr].isdisjoint(values):
+            return False
+    return True
+
+def iter_matches(tree, pattern):
+    """
+    Yield every distinct backreference binding for which some node of the tree
+    matches the pattern.
+
+    Bindings are yielded lazily as 'dict: unicode -> int'; a binding that was
+    already yielded for this tree is not yielded again.
+    """
+    backrefs_map = {}
+    seen = set()
+
+    for node in range(1, len(tree) + 1):
+        for _ in pattern.match_all(tree, node, backrefs_map):
+            key = frozenset(backrefs_map.items())
+            if key in seen:
+                continue
+            seen.add(key)
+            yield dict(backrefs_map)
+
+def subpatterns(pattern):
+    """
+    Return list of immediate sub-patterns of a pattern.
+    """
+    result = []
+    for name, value in sorted(vars(pattern).items()):
+        if isinstance(value, TreePattern):
+            result.append(value)
+        elif isinstance(value, list):
+            result.extend(v for v in value if isinstance(v, TreePattern))
+    return result
+
+def _shadow_match(pattern, match_fn, shadowed):
+    """
+    Shadow pattern's match() with an instance attribute, so that sub-patterns
+    get called through it as well. Remember what to restore in the 'shadowed'
+    list (see _unshadow_match()).
+    """
+    shadowed.append((pattern, vars(pattern).get('match')))
+    pattern.match = match_fn
+
+def _unshadow_match(shadowed):
+    """
+    Undo _shadow_match() calls remembered in the list, latest first, and
+    clear the list.
+    """
+    while shadowed:
+        pattern, match = shadowed.pop()
+        if match is None:
+            del pattern.match
+        else:
+            # E.g. CompiledPattern, which has match() as instance attribute.
+            pattern.match = match
+
+class PatternProfile:
+    """
+    Counts calls to match() and time spent in them (including sub-patterns)
+    for every node of instrumented patterns.
+    """
+
+    def __init__(self):
+        self.calls = {}
+        self.times = {}
+        self._shadowed = []
+
+    def instrument(self, pattern):
+        """
+        Make the pattern and all its sub-patterns record their match() calls.
+        Modifies the pattern in place until restore().
+        """
+        if pattern in self.calls:
+            return
+        self.calls[pattern] = 0
+        self.times[pattern] = 0.0
+
+        match = pattern.match
+        calls = self.calls
+        times = self.times
+
+        def counting_match(tree, node, backrefs_map):
+            calls[pattern] += 1
+            start = time.time()
+            try:
+                return match(tree, node, backrefs_map)
+            finally:
+                times[pattern] += time.time() - start
+        _shadow_match(pattern, counting_match, self._shadowed)
+
+        for subpattern in subpatterns(pattern):
+            self.instrument(subpattern)
+
+    def restore(self):
+        """
+        Undo instrument() on all patterns; statistics are kept. If patterns are
+        instrumented by something else as well, undo in reverse order.
+        """
+        _unshadow_match(self._shadowed)
+
+    def write_report(self, file, pattern):
+        """
+        Write pattern text broken down into sub-patterns, each annotated with
+        the number of match() calls and time spent, to a text file.
+
+        The pattern should be instrumented and have 'text' set; sub-patterns
+        without 'pos' are folded into their parents. A pattern without 'pos'
+        (e.g. a CompiledPattern) is reported as a single line.
+        """
+        file.write('%9s %9s  %s\n' % ('calls', 'total ms', 'pattern'))
+
+        def write_line(pattern, text, depth):
+            file.write('%9i %9.1f  %s%s\n' % (
+                self.calls.get(pattern, 0),
+                self.times.get(pattern, 0.0) * 1000,
+                '  ' * depth, u' '.join(text.split()).encode('utf-8')))
+
+        if getattr(pattern, 'pos', None) is None:
+            write_line(pattern, pattern.text, 0)
+            return
+        base = pattern.pos[0]
+
+        def write(pattern, depth):
+            pos = getattr(pattern, 'pos', None)
+            if pos is not None:
+                start, end, line, col = pos
+                write_line(pattern, pattern_text[start - base:end - base],
+                           depth)
+                depth += 1
+            for subpattern in subpatterns(pattern):
+                write(subpattern, depth)
+
+        pattern_text = pattern.text
+        write(pattern, 0)
+
+class StepBudgetExceeded(Exception):
+    """
+    Raised from match() of a pattern instrumented by StepBudget, when the
+    budget is exhausted.
+    """
+
+    def __init__(self, steps):
+        Exception.__init__(self, 'pattern exceeded %i steps' % steps)
+        self.steps = steps
+
+class StepBudget:
+    """
+    Limits the number of match() calls of instrumented patterns and their
+    sub-patterns between calls to reset(): one badly written pattern can
+    otherwise take minutes on a long tree.
+    """
+
+    def __init__(self, steps):
+        self.steps = steps
+        self.left = steps
+        self._instrumented = set()
+        self._shadowed = []
+
+    def reset(self):
+        """
+        Restore the full budget.
+        """
+        self.left = self.steps
+
+    def instrument(self, pattern):
+        """
+        Make the pattern and all its sub-patterns raise StepBudgetExceeded
+        when called more times than the budget allows. Modifies the pattern in
+        place until restore().
+        """
+        if id(pattern) in self._instrumented:
+            return
+        self._instrumented.add(id(pattern))
+
+        match = pattern.match
+
+        def limited_match(tree, node, backrefs_map):
+            self.left -= 1
+            if self.left < 0:
+                raise StepBudgetExceeded(self.steps)
+            return match(tree, node, backrefs_map)
+        _shadow_match(pattern, limited_match, self._shadowed)
+
+        for subpattern in subpatterns(pattern):
+            self.instrument(subpattern)
+
+    def restore(self):
+        """
+        Undo instrument() on all patterns. If patterns are instrumented by
+        something else as well, undo in reverse order.
+        """
+        _unshadow_match(self._shadowed)
+        self._instrumented.clear()
+
 ## ----------------------------------------------------------------------------
 #                                  Children
 
@@ -56,6 +505,13 @@ class HasLeftChild(TreePattern):
                 return True
         return False
 
+    def match_all(self, tree, node, backrefs_map):
+        for child in tree.children(node):
+            if child > node:
+                continue
+            for _ in self.condition.match_all(tree, child, backrefs_map):
+                yield
+
 class HasRightChild(TreePattern):
     def __init__(self, condition):
         self.condition = condition
@@ -68,6 +524,13 @@ class HasRightChild(TreePattern):
                 return True
         return False
 
+    def match_all(self, tree, node, backrefs_map):
+        for child in tree.children(node):
+            if child < node:
+                continue
+            for _ in self.condition.match_all(tree, child, backrefs_map):
+                yield
+
 class HasChild(TreePattern):
     def __init__(self, condition):
         self.condition = condition
@@ -76,7 +539,12 @@ class HasChild(TreePattern):
         for child in tree.children(node):
             if self.condition.match(tree, child, backrefs_map):
                 return True
-            return False
+        return False
+
+    def match_all(self, tree, node, backrefs_map):
+        for child in tree.children(node):
+            for _ in self.condition.match_all(tree, child, backrefs_map):
+                yield
 
 class HasSuccessor(TreePattern):
     def __init__(self, condition):
@@ -88,6 +556,19 @@ class HasSuccessor(TreePattern):
                 return True
         return False
 
+    def match_all(self, tree, node, backrefs_map):
+        # Walk descendants in the same order as children_recursive(), without
+        # building the whole list.
+        stack = [iter(tree.children(node))]
+        while stack:
+            for child in stack[-1]:
+                for _ in self.condition.match_all(tree, child, backrefs_map):
+                    yield
+                stack.append(iter(tree.children(child)))
+                break
+            else:
+                stack.pop()
+
 class HasAdjacentLeftChild(TreePattern):
     def __init__(self, condition):
         self.condition = condition
@@ -100,6 +581,13 @@ class HasAdjacentLeftChild(TreePattern):
                 return True
         return False
 
+    def match_all(self, tree, node, backrefs_map):
+        for child in tree.children(node):
+            if child + 1 != node:
+                continue
+            for _ in self.condition.match_all(tree, child, backrefs_map):
+                yield
+
 class HasAdjacentRightChild(TreePattern):
     def __init__(self, condition):
         self.condition = condition
@@ -112,6 +600,13 @@ class HasAdjacentRightChild(TreePattern):
                 return True
         return False
 
+    def match_all(self, tree, node, backrefs_map):
+        for child in tree.children(node):
+            if child - 1 != node:
+                continue
+            for _ in self.condition.match_all(tree, child, backrefs_map):
+                yield
+
 class HasAdjacentChild(TreePattern):
     def __init__(self, condition):
         self.condition = condition
@@ -124,6 +619,13 @@ class HasAdjacentChild(TreePattern):
                 return True
         return False
 
+    def match_all(self, tree, node, backrefs_map):
+        for child in tree.children(node):
+            if (child - node) not in [-1, +1]:
+                continue
+            for _ in self.condition.match_all(tree, child, backrefs_map):
+                yield
+
 ## ----------------------------------------------------------------------------
 #                                   Parents
 
@@ -138,6 +640,16 @@ class HasLeftHead(TreePattern):
         head = tree.heads(node)
         return head < node and self.condition.match(tree, head, backrefs_map)
 
+    def match_all(self, tree, node, backrefs_map):
+        if node == 0:
+            return
+
+        head = tree.heads(node)
+        if not (head < node):
+            return
+        for _ in self.condition.match_all(tree, head, backrefs_map):
+            yield
+
 class HasRightHead(TreePattern):
     def __init__(self, condition):
         self.condition = condition
@@ -149,6 +661,16 @@ class HasRightHead(TreePattern):
         head = tree.heads(node)
         return head > node and self.condition.match(tree, head, backrefs_map)
 
+    def match_all(self, tree, node, backrefs_map):
+        if node == 0:
+            return
+
+        head = tree.heads(node)
+        if not (head > node):
+            return
+        for _ in self.condition.match_all(tree, head, backrefs_map):
+            yield
+
 class HasHead(TreePattern):
     def __init__(self, condition):
         self.condition = condition
@@ -160,6 +682,14 @@ class HasHead(TreePattern):
         head = tree.heads(node)
         return self.condition.match(tree, head, backrefs_map)
 
+    def match_all(self, tree, node, backrefs_map):
+        if node == 0:
+            return
+
+        head = tree.heads(node)
+        for _ in self.condition.match_all(tree, head, backrefs_map):
+            yield
+
 class HasPredecessor(TreePattern):
     def __init__(self, condition):
         self.condition = condition
@@ -173,6 +703,14 @@ class HasPredecessor(TreePattern):
                 break
         return False
 
+    def match_all(self, tree, node, backrefs_map):
+        while True:
+            node = tree.heads(node)
+            for _ in self.condition.match_all(tree, node, backrefs_map):
+                yield
+            if node == 0:
+                break
+
 class HasAdjacentLeftHead(TreePattern):
     def __init__(self, condition):
         self.condition = condition
@@ -185,6 +723,16 @@ class HasAdjacentLeftHead(TreePattern):
         adjacent = (head + 1 == node)
         return adjacent and self.condition.match(tree, head, backrefs_map)
 
+    def match_all(self, tree, node, backrefs_map):
+        if node == 0:
+            return
+
+        head = tree.heads(node)
+        if not (head + 1 == node):
+            return
+        for _ in self.condition.match_all(tree, head, backrefs_map):
+            yield
+
 class HasAdjacentRightHead(TreePattern):
     def __init__(self, condition):
         self.condition = condition
@@ -197,6 +745,16 @@ class HasAdjacentRightHead(TreePattern):
         adjacent = (head - 1 == node)
         return adjacent and self.condition.match(tree, head, backrefs_map)
 
+    def match_all(self, tree, node, backrefs_map):
+        if node == 0:
+            return
+
+        head = tree.heads(node)
+        if not (head - 1 == node):
+            return
+        for _ in self.condition.match_all(tree, head, backrefs_map):
+            yield
+
 class HasAdjacentHead(TreePattern):
     def __init__(self, condition):
         self.condition = condition
@@ -209,6 +767,16 @@ class HasAdjacentHead(TreePattern):
         adjacent = (head - node) in [-1, +1]
         return adjacent and self.condition.match(tree, head, backrefs_map)
 
+    def match_all(self, tree, node, backrefs_map):
+        if node == 0:
+            return
+
+        head = tree.heads(node)
+        if not ((head - node) in [-1, +1]):
+            return
+        for _ in self.condition.match_all(tree, head, backrefs_map):
+            yield
+
 ## ----------------------------------------------------------------------------
 #                                 Neighbors
 
@@ -225,6 +793,14 @@ class HasLeftNeighbor(TreePattern):
                 return True
         return False
 
+    def match_all(self, tree, node, backrefs_map):
+        if node == 0:
+            return
+
+        for neighbor in range(0, node):
+            for _ in self.condition.match_all(tree, neighbor, backrefs_map):
+                yield
+
 class HasRightNeighbor(TreePattern):
     def __init__(self, condition):
         self.condition = condition
@@ -235,6 +811,11 @@ class HasRightNeighbor(TreePattern):
                 return True
         return False
 
+    def match_all(self, tree, node, backrefs_map):
+        for neighbor in range(node + 1, len(tree) + 1):
+            for _ in self.condition.match_all(tree, neighbor, backrefs_map):
+                yield
+
 class HasAdjacentLeftNeighbor(TreePattern):
     def __init__(self, condition):
         self.condition = condition
@@ -246,6 +827,14 @@ class HasAdjacentLeftNeighbor(TreePattern):
         neighbor = node - 1
         return self.condition.match(tree, neighbor, backrefs_map)
 
+    def match_all(self, tree, node, backrefs_map):
+        if node == 0:
+            return
+
+        neighbor = node - 1
+        for _ in self.condition.match_all(tree, neighbor, backrefs_map):
+            yield
+
 class HasAdjacentRightNeighbor(TreePattern):
     def __init__(self, condition):
         self.condition = condition
@@ -257,6 +846,14 @@ class HasAdjacentRightNeighbor(TreePattern):
         neighbor = node + 1
         return self.condition.match(tree, neighbor, backrefs_map)
 
+    def match_all(self, tree, node, backrefs_map):
+        if node == len(tree):
+            return
+
+        neighbor = node + 1
+        for _ in self.condition.match_all(tree, neighbor, backrefs_map):
+            yield
+
 ## ----------------------------------------------------------------------------
 #                            Misc. tree structure
 
@@ -295,6 +892,12 @@ class NotRoot(TreePattern):
     def match(self, tree, node, backrefs_map):
         return node != 0 and self.condition.match(tree, node, backrefs_map)
 
+    def match_all(self, tree, node, backrefs_map):
+        if node == 0:
+            return
+        for _ in self.condition.match_all(tree, node, backrefs_map):
+            yield
+
 class IsTop(TreePattern):
     def match(self, tree, node, backrefs_map):
         return node != 0 and tree.heads(node) == 0
@@ -311,6 +914,15 @@ class AttrMatches(TreePattern):
         self.attr = attr
         self.pred_fn = pred_fn
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['pred_fn'] = _predicate_spec(self.pred_fn)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.pred_fn = predicate_from_spec(self.pred_fn)
+
     def match(self, tree, node, backrefs_map):
         if node == 0:
             return False
@@ -322,13 +934,32 @@ class FeatsMatch(TreePattern):
     def __init__(self, pred_fn):
         self.pred_fn = pred_fn
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['pred_fn'] = _predicate_spec(self.pred_fn)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.pred_fn = predicate_from_spec(self.pred_fn)
+
     def match(self, tree, node, backrefs_map):
         if node == 0:
             return False
 
-        attr = u'|'.join(tree.feats(node))
+        attr = tree.feats_string(node)
         return self.pred_fn(attr)
 
+class HasFeat(TreePattern):
+    def __init__(self, feat):
+        self.feat = feat
+
+    def match(self, tree, node, backrefs_map):
+        if node == 0:
+            return False
+
+        return self.feat in tree.feats_set(node)
+
 ## ----------------------------------------------------------------------------
 #                                   Logic
 
@@ -349,6 +980,22 @@ class And(TreePattern):
                 return False
         return True
 
+    def match_all(self, tree, node, backrefs_map):
+        return self._match_all_from(0, tree, node, backrefs_map)
+
+    def _match_all_from(self, i, tree, node, backrefs_map):
+        """
+        Yield for every joint match of conditions i, i+1, etc.
+        """
+        if i == len(self.conditions):
+            yield
+            return
+
+        condition = self.conditions[i]
+        for _ in condition.match_all(tree, node, backrefs_map):
+            for _ in self._match_all_from(i + 1, tree, node, backrefs_map):
+                yield
+
 class Or(TreePattern):
     def __init__(self, conditions):
         self.conditions = conditions
@@ -359,6 +1006,11 @@ class Or(TreePattern):
                 return True
         return False
 
+    def match_all(self, tree, node, backrefs_map):
+        for condition in self.conditions:
+            for _ in condition.match_all(tree, node, backrefs_map):
+                yield
+
 class Not(TreePattern):
     def __init__(self, condition):
         self.condition = condition
@@ -401,9 +1053,39 @@ class SetBackref(TreePattern):
             return False
         return True
 
+    def match_all(self, tree, node, backrefs_map):
+        old_backref = backrefs_map.get(self.backref)
+        backrefs_map[self.backref] = node
+
+        for _ in self.condition.match_all(tree, node, backrefs_map):
+            yield
+
+        # Undo the changes to backrefs_map.
+        if old_backref is None:
+            del backrefs_map[self.backref]
+        else:
+            backrefs_map[self.backref] = old_backref
+
 class EqualsBackref(TreePattern):
     def __init__(self, backref):
         self.backref = backref
 
     def match(self, tree, node, backrefs_map):
         return backrefs_map.get(self.backref) == node
+
+## ----------------------------------------------------------------------------
+#                                  Compiled
+
+class CompiledPattern(TreePattern):
+    """
+    A pattern compiled into a Python function (see compile_scripts()).
+
+    Keeps what required_literals() and pattern_radius() would have said about
+    the original pattern, since they can't look inside the function.
+    """
+
+    def __init__(self, match_fn, radius, requirements):
+        # Shadow the method: saves a call per node.
+        self.match = match_fn
+        self.radius = radius
+        self.requirements = requirements
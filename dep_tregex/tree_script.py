@@ -1,7 +1,10 @@
+import collections
 import copy
+import cPickle
+import os
 import re
-import ply.lex
-import ply.yacc
+import sys
+import time
 
 from dep_tregex.tree import *
 from dep_tregex.tree_pattern import *
@@ -20,7 +23,223 @@ class TreeScript:
         self.pattern = pattern
         self.actions = actions
 
-def run_tree_scripts(tree, scripts):
+class ScriptIndex:
+    """
+    Dispatch index for a list of TreeScript objects.
+
+    Tells which scripts can possibly apply to a tree, judging by the literals
+    their patterns require (see required_literals()): e.g. a script with
+    pattern "x form 'dog'" can't apply to a tree without a "dog".
+    """
+
+    def __init__(self, scripts):
+        self.scripts = scripts
+
+        # Attributes to collect from trees.
+        self.attrs = set()
+
+        # Script numbers that can't be pruned.
+        self._always = []
+
+        # Script numbers keyed by (attr, value) of their most selective
+        # requirement.
+        self._by_literal = collections.defaultdict(list)
+
+        # All requirements, and whether script sets attributes.
+        self._requirements = []
+        self._sets_attrs = []
+
+        for script_no, script in enumerate(scripts):
+            requirements = required_literals(script.pattern)
+            self._requirements.append(requirements)
+            self._sets_attrs.append(any(a.sets_attrs for a in script.actions))
+
+            if not requirements:
+                self._always.append(script_no)
+                continue
+
+            attr, values = min(requirements, key=lambda r: len(r[1]))
+            for value in values:
+                self._by_literal[attr, value].append(script_no)
+            self.attrs.update(attr for attr, values in requirements)
+
+        # Number of scripts attempted during the last run_tree_scripts().
+        self.attempted = 0
+
+    def vocabularies(self, tree):
+        """
+        Return dict: attr -> set of tree's values of that attr, as needed for
+        candidates().
+        """
+        return dict((attr, tree_vocabulary(tree, attr)) for attr in self.attrs)
+
+    def candidates(self, vocabularies):
+        """
+        Return set of numbers of scripts that can apply to a tree with given
+        vocabularies.
+        """
+        result = set(self._always)
+        for attr, values in vocabularies.items():
+            for value in values:
+                script_nos = self._by_literal.get((attr, value))
+                if script_nos is None:
+                    continue
+                # Vocabularies cover all required attrs, so
+                # has_required_literals() won't need the tree.
+                for script_no in script_nos:
+                    if has_required_literals(
+                            None, self._requirements[script_no], vocabularies):
+                        result.add(script_no)
+        return result
+
+    def sets_attrs(self, script_no):
+        """
+        Return whether script's actions may set new attribute values.
+        """
+        return self._sets_attrs[script_no]
+
+class ScriptProfile:
+    """
+    Per-script statistics, collected by run_tree_scripts(): how many times
+    the pattern was tried and how many times it matched, time spent in
+    matching and in actions, and the number of trees the script was applied
+    to.
+
+    Can profile bare patterns as well (e.g. in grep); then matched trees count
+    as "applied to".
+    """
+
+    def __init__(self, scripts, names=None):
+        """
+        scripts: list of TreeScript or TreePattern objects; their 'pos' and
+        'text' (if any) identify them in the report
+        names: optional list of names for the scripts, also for the report
+        """
+        N = len(scripts)
+        self.scripts = scripts
+        self.names = names
+        self.attempts = [0] * N
+        self.matches = [0] * N
+        self.match_time = [0.0] * N
+        self.apply_time = [0.0] * N
+        self.trees = [0] * N
+
+    def match(self, script_no, pattern, tree, node, backrefs_map):
+        """
+        Return pattern.match(tree, node, backrefs_map); record the attempt.
+        """
+        start = time.time()
+        result = pattern.match(tree, node, backrefs_map)
+        self.match_time[script_no] += time.time() - start
+        self.attempts[script_no] += 1
+        if result:
+            self.matches[script_no] += 1
+        return result
+
+    def apply(self, script_no, actions, state):
+        """
+        Apply actions to the state; record time spent.
+        """
+        start = time.time()
+        try:
+            for action in actions:
+                action.apply(state)
+        finally:
+            self.apply_time[script_no] += time.time() - start
+
+    def add_tree(self, script_nos):
+        """
+        Record that scripts were applied to (or matched) one more tree.
+        """
+        for script_no in script_nos:
+            self.trees[script_no] += 1
+
+    def rows(self):
+        """
+        Return list of dicts, one per script, most expensive scripts first.
+        """
+        rows = []
+        for script_no, script in enumerate(self.scripts):
+            pos = getattr(script, 'pos', None)
+            text = getattr(script, 'text', None)
+            rows.append({
+                'script': script_no,
+                'name': self.names[script_no] if self.names else None,
+                'line': pos[2] if pos else None,
+                'col': pos[3] if pos else None,
+                'text': text,
+                'attempts': self.attempts[script_no],
+                'matches': self.matches[script_no],
+                'match_time': self.match_time[script_no],
+                'apply_time': self.apply_time[script_no],
+                'trees': self.trees[script_no],
+                })
+        rows.sort(key=lambda r: -(r['match_time'] + r['apply_time']))
+        return rows
+
+    def write_report(self, file):
+        """
+        Write a table of rows() to a text file.
+        """
+        header = '%9s %9s %9s %9s %9s %7s  %s\n'
+        row = '%9.1f %9.1f %9.1f %9i %9i %7i  %s\n'
+        file.write(header % ('total ms', 'match ms', 'apply ms', 'attempts',
+                             'matches', 'trees', 'script'))
+
+        for r in self.rows():
+            # Identify the script.
+            where = []
+            if r['name'] is not None:
+                where.append(r['name'])
+            if r['line'] is not None:
+                where.append('%i:%i' % (r['line'], r['col']))
+            if not where:
+                where.append('#%i' % (r['script'] + 1))
+            if r['text'] is not None:
+                where.append(u' '.join(r['text'].split()))
+            where = u' '.join(where)
+
+            file.write(row % (
+                (r['match_time'] + r['apply_time']) * 1000,
+                r['match_time'] * 1000, r['apply_time'] * 1000,
+                r['attempts'], r['matches'], r['trees'],
+                where.encode('utf-8')))
+
+    def write_json(self, file):
+        """
+        Write rows() to a file as JSON.
+        """
+        import json
+        json.dump(self.rows(), file, indent=2, sort_keys=True)
+        file.write('\n')
+
+class Fixpoint:
+    """
+    Tells run_tree_scripts() to repeat the scripts until they stop changing
+    the tree, but at most 'max_rounds' times.
+    """
+
+    def __init__(self, max_rounds):
+        self.max_rounds = max_rounds
+
+        # Rounds made during the last run_tree_scripts(), and whether the
+        # last of them didn't change the tree.
+        self.rounds = 0
+        self.converged = True
+
+def _copy_tree(tree):
+    """
+    Return a copy of the tree which actions can modify without touching the
+    original: unlike copy.copy(), attribute lists are copied as well.
+    """
+    new_tree = copy.copy(tree)
+    for name, value in vars(tree).items():
+        if isinstance(value, list):
+            setattr(new_tree, name, list(value))
+    return new_tree
+
+def run_tree_scripts(tree, scripts, index=None, profile=None, budget=None,
+                     fixpoint=None):
     """
     Apply tree scripts in a specific manner.
 
@@ -32,36 +251,109 @@ def run_tree_scripts(tree, scripts):
     - Script is applied to each "original" node only once.
     - Script is applied until there are no "original" nodes left, to which
       that script hasn't been applied.
-    """
-    backrefs_map = {}
-    state = TreeState(copy.copy(tree), backrefs_map)
 
-    for script in scripts:
-        # Reset the state
-        state.unmark_all()
-        for node in range(0, len(state.tree) + 1):
-            state.mark(node)
-
-        while True:
-            backrefs_map.clear()
-
-            # Find matching node.
-            node = 0
-            while node <= len(state.tree):
-                if state.marked(node):
-                    if script.pattern.match(state.tree, node, backrefs_map):
-                        break
-                node += 1
-
-            # If no matching node, move on to the next script.
-            if node == len(state.tree) + 1:
-                break
-
-            # Apply all actions.
-            state.unmark(node)
-            for action in script.actions:
-                action.apply(state)
+    Nodes on which the pattern has failed are checked in the TreeState, and
+    are not re-tested until some action changes the tree near them (see
+    pattern_radius()).
 
+    If 'index' (a ScriptIndex for 'scripts') is given, scripts that can't
+    apply to the tree are skipped.
+
+    If 'profile' (a ScriptProfile for 'scripts') is given, statistics are
+    recorded to it.
+
+    If 'budget' (a StepBudget with scripts' patterns instrumented) is given,
+    it is reset before each script; StepBudgetExceeded propagates with
+    'script_no' attribute set to the number of the offending script.
+
+    If 'fixpoint' (a Fixpoint) is given, the whole list of scripts is applied
+    again while the previous round changed the tree (see TreeState.changed).
+    Groups don't carry over from one round to the next.
+
+    Return the modified tree; 'tree' itself is left intact, even if an
+    exception is raised.
+    """
+    backrefs_map = {}
+    state = TreeState(_copy_tree(tree), backrefs_map)
+
+    # Select scripts.
+    if index is not None:
+        vocabularies = index.vocabularies(state.tree)
+        candidates = index.candidates(vocabularies)
+        index.attempted = 0
+    if profile is not None:
+        applied = set()
+
+    max_rounds = 1 if fixpoint is None else fixpoint.max_rounds
+    for round_no in range(max_rounds):
+        # Each round starts afresh, as if sed was piped into itself.
+        if round_no:
+            state = TreeState(state.tree, backrefs_map)
+
+        for script_no, script in enumerate(scripts):
+            if index is not None:
+                if script_no not in candidates:
+                    continue
+                index.attempted += 1
+
+            # Reset the state
+            state.unmark_all()
+            for node in range(0, len(state.tree) + 1):
+                state.mark(node)
+            state.uncheck_all()
+            state.check_radius = pattern_radius(script.pattern)
+            if budget is not None:
+                budget.reset()
+
+            while True:
+                backrefs_map.clear()
+
+                # Find matching node.
+                node = 0
+                while node <= len(state.tree):
+                    if state.marked(node) and not state.checked(node):
+                        try:
+                            if profile is None:
+                                matched = script.pattern.match(
+                                    state.tree, node, backrefs_map)
+                            else:
+                                matched = profile.match(
+                                    script_no, script.pattern, state.tree,
+                                    node, backrefs_map)
+                        except StepBudgetExceeded as e:
+                            e.script_no = script_no
+                            raise
+                        if matched:
+                            break
+                        state.check(node)
+                    node += 1
+
+                # If no matching node, move on to the next script.
+                if node == len(state.tree) + 1:
+                    break
+
+                # Apply all actions.
+                state.unmark(node)
+                if profile is None:
+                    for action in script.actions:
+                        action.apply(state)
+                else:
+                    profile.apply(script_no, script.actions, state)
+                    applied.add(script_no)
+
+                # New attribute values may make more scripts applicable.
+                if index is not None and index.sets_attrs(script_no):
+                    vocabularies = index.vocabularies(state.tree)
+                    candidates = index.candidates(vocabularies)
+
+        if not state.changed:
+            break
+
+    if fixpoint is not None:
+        fixpoint.rounds = round_no + 1
+        fixpoint.converged = not state.changed
+    if profile is not None:
+        profile.add_tree(applied)
     return state.tree
 
 ## ----------------------------------------------------------------------------
@@ -73,6 +365,95 @@ class LexerError(ValueError):
 class ParserError(ValueError):
     pass
 
+def _table_cache_dir():
+    """
+    Return a writable directory to cache generated lexer and parser tables in,
+    or None if there is no such directory.
+
+    The directory is $DEP_TREGEX_CACHE_DIR (set it to an empty string to
+    disable caching), or dep_tregex/ in $XDG_CACHE_HOME or ~/.cache; with
+    a subdirectory per PLY and Python version.
+    """
+    import ply
+
+    base = os.environ.get('DEP_TREGEX_CACHE_DIR')
+    if base is None:
+        cache_home = os.environ.get('XDG_CACHE_HOME') or \
+            os.path.join(os.path.expanduser('~'), '.cache')
+        base = os.path.join(cache_home, 'dep_tregex')
+    if not base:
+        return None
+
+    version = 'ply%s-py%i.%i' % ((ply.__version__,) + sys.version_info[:2])
+    path = os.path.join(base, version)
+    try:
+        if not os.path.isdir(path):
+            os.makedirs(path)
+    except OSError:
+        return None
+    if not os.access(path, os.W_OK):
+        return None
+    return path
+
+def _publish(tmp_path, path):
+    """
+    Atomically move a freshly written cache file into place.
+    Concurrent processes will see either no file or a complete one.
+    """
+    try:
+        os.rename(tmp_path, path)
+    except OSError:
+        pass
+
+def _discard(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+def _read_cache_file(path):
+    """
+    Return contents of a cache file, or None if it can't be read.
+    """
+    try:
+        with open(path, 'rb') as f:
+            return f.read()
+    except IOError:
+        return None
+
+def _stage(path, tmp_path):
+    """
+    Copy a cache file to a temporary name, so that whatever is written there
+    never touches the file other processes may be reading. Return the
+    original contents, or None if there is no file.
+    """
+    data = _read_cache_file(path)
+    if data is not None:
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+        except IOError:
+            _discard(tmp_path)
+    return data
+
+def _lexer_signature(tokens, rules):
+    """
+    Return md5 of the token list and lexer rules, as a hex string.
+
+    rules: dict from names to rules, like the locals() PLY builds a lexer
+    from; only 't_' names count. Function rules are represented by their
+    regexes (docstrings), string rules by themselves.
+    """
+    import hashlib
+
+    items = []
+    for name, value in sorted(rules.items()):
+        if name.startswith('t_'):
+            if callable(value):
+                value = value.__doc__
+            items.append((name, value))
+    return hashlib.md5(repr((tokens, items))).hexdigest()
+
 class _TreeScriptParser:
     KEYWORDS = {
         'and': 'AND',
@@ -85,6 +466,7 @@ class _TreeScriptParser:
         'cpostag': 'CPOSTAG',
         'postag': 'POSTAG',
         'feats': 'FEATS',
+        'has_feat': 'HAS_FEAT',
         'deprel': 'DEPREL',
         'can_head': 'CAN_HEAD',
         'can_be_headed_by': 'CAN_BE_HEADED_BY',
@@ -137,6 +519,11 @@ class _TreeScriptParser:
 
     @classmethod
     def make_lexer(cls):
+        # PLY and friends are imported here rather than at the top, so that
+        # commands which don't parse scripts start faster.
+        import imp
+        import ply.lex
+
         tokens = cls.TOKENS
         t_ignore = ' '
 
@@ -231,10 +618,42 @@ class _TreeScriptParser:
             msg = '(at line %i, col %i) invalid character %r' % (line, col, c)
             raise LexerError(msg)
 
-        return ply.lex.lex()
+        # PLY doesn't check cached lexer tables against the rules, so put
+        # a signature of the rules into the table name.
+        lextab = 'lextab_%s' % _lexer_signature(tokens, locals())
+
+        # Try cached tables (PLY looks up rules in the caller's locals, so
+        # call lex() right here).
+        cache_dir = _table_cache_dir()
+        if cache_dir is not None:
+            path = os.path.join(cache_dir, lextab + '.py')
+            if os.path.exists(path):
+                try:
+                    module = imp.load_source(lextab, path)
+                    return ply.lex.lex(optimize=1, lextab=module)
+                except Exception:
+                    pass
+
+        # Build from scratch.
+        lexer = ply.lex.lex()
+
+        # Cache.
+        if cache_dir is not None:
+            tmp_lextab = '%s_%i' % (lextab, os.getpid())
+            try:
+                lexer.writetab(tmp_lextab, cache_dir)
+            except IOError:
+                pass
+            else:
+                tmp_path = os.path.join(cache_dir, tmp_lextab + '.py')
+                _publish(tmp_path, path)
+
+        return lexer
 
     @classmethod
     def make_parser(cls, start):
+        import ply.yacc
+
         tokens = cls.TOKENS
 
         def untrack(p):
@@ -337,6 +756,7 @@ class _TreeScriptParser:
                 p[0] = condition_and
             else:
                 p[0] = Or([condition_and] + or_conditions)
+                p[0].pos = pos[0]
             track(p, pos)
 
         def p_or_conditions(p):
@@ -363,6 +783,7 @@ class _TreeScriptParser:
                 p[0] = condition_not
             else:
                 p[0] = And([condition_not] + and_conditions)
+                p[0].pos = pos[0]
             track(p, pos)
 
         def p_and_conditions(p):
@@ -387,6 +808,7 @@ class _TreeScriptParser:
                 p[0] = s[1]
             else:
                 p[0] = Not(s[2])
+                p[0].pos = pos[0]
             track(p, pos)
 
         def p_condition_op_parens(p):
@@ -403,6 +825,7 @@ class _TreeScriptParser:
             """
             s, pos = untrack(p)
             p[0] = cls.BINARY_OPS[s[1]](s[2])
+            p[0].pos = pos[0]
             track(p, pos)
 
         def p_condition_op_equals(p):
@@ -411,6 +834,7 @@ class _TreeScriptParser:
             """
             s, pos = untrack(p)
             p[0] = EqualsBackref(s[2])
+            p[0].pos = pos[0]
             track(p, pos)
 
         def p_condition_op_attr(p):
@@ -422,6 +846,16 @@ class _TreeScriptParser:
                 p[0] = FeatsMatch(pred_fn=s[2])
             else:
                 p[0] = AttrMatches(attr=s[1], pred_fn=s[2])
+            p[0].pos = pos[0]
+            track(p, pos)
+
+        def p_condition_op_has_feat(p):
+            """
+            condition_op : HAS_FEAT STRING
+            """
+            s, pos = untrack(p)
+            p[0] = HasFeat(s[2])
+            p[0].pos = pos[0]
             track(p, pos)
 
         def p_condition_op_is_top(p):
@@ -430,6 +864,7 @@ class _TreeScriptParser:
             """
             s, pos = untrack(p)
             p[0] = IsTop()
+            p[0].pos = pos[0]
             track(p, pos)
 
         def p_condition_op_is_leaf(p):
@@ -438,6 +873,7 @@ class _TreeScriptParser:
             """
             s, pos = untrack(p)
             p[0] = IsLeaf()
+            p[0].pos = pos[0]
             track(p, pos)
 
         def p_condition_op_can_head(p):
@@ -446,6 +882,7 @@ class _TreeScriptParser:
             """
             s, pos = untrack(p)
             p[0] = CanHead(s[2])
+            p[0].pos = pos[0]
             track(p, pos)
 
         def p_condition_op_can_be_headed_by(p):
@@ -454,6 +891,7 @@ class _TreeScriptParser:
             """
             s, pos = untrack(p)
             p[0] = CanBeHeadedBy(s[2])
+            p[0].pos = pos[0]
             track(p, pos)
 
         def p_action_copy_move(p):
@@ -493,8 +931,7 @@ class _TreeScriptParser:
                 newval = s[4].split(u'|')
             else:
                 newval = s[4]
-            newval_fn = lambda x, newval=newval: newval
-            p[0] = MutateAttr(s[3], '_' + s[2], newval_fn)
+            p[0] = MutateAttr(s[3], '_' + s[2], constant_fn(newval))
             track(p, pos)
 
         def p_action_set_head(p):
@@ -546,7 +983,7 @@ class _TreeScriptParser:
             string_condition : STRING
             """
             s, pos = untrack(p)
-            p[0] = lambda x, string=s[1]: x == string
+            p[0] = literal_predicate([s[1]])
             track(p, pos)
 
         def p_string_condition_regex(p):
@@ -555,8 +992,7 @@ class _TreeScriptParser:
             """
             s, pos = untrack(p)
             pattern, ignore_case, anywhere = s[1]
-            r = compile_regex(pattern, ignore_case, anywhere)
-            p[0] = lambda x, r=r: r.search(x)
+            p[0] = compile_string_predicate(pattern, ignore_case, anywhere)
             track(p, pos)
 
         def p_selector(p):
@@ -583,11 +1019,43 @@ class _TreeScriptParser:
                 p[0] = Tree.AFTER
             track(p, pos)
 
-        return ply.yacc.yacc(
-            debug=0,
-            write_tables=0,
-            errorlog=ply.yacc.NullLogger()
-            )
+        # Cached tables are checked against the grammar signature by PLY,
+        # and regenerated in place if they don't match. So PLY only gets a
+        # private copy; if that changes, it is moved over the cached file.
+        picklefile = None
+        cache_dir = _table_cache_dir()
+        if cache_dir is not None:
+            path = os.path.join(cache_dir, 'parsetab_%s.pickle' % start)
+            picklefile = '%s.%i.tmp' % (path, os.getpid())
+            cached = _stage(path, picklefile)
+
+        # PLY looks up grammar rules in the caller's locals, so call yacc()
+        # right here.
+        try:
+            parser = ply.yacc.yacc(
+                debug=0,
+                write_tables=0,
+                picklefile=picklefile,
+                errorlog=ply.yacc.NullLogger()
+                )
+        except Exception:
+            # E.g. a corrupted cache file: build and cache the tables anew.
+            if picklefile is None:
+                raise
+            _discard(picklefile)
+            parser = ply.yacc.yacc(
+                debug=0,
+                write_tables=0,
+                picklefile=picklefile,
+                errorlog=ply.yacc.NullLogger()
+                )
+
+        if picklefile is not None:
+            if _read_cache_file(picklefile) != cached:
+                _publish(picklefile, path)
+            else:
+                _discard(picklefile)
+        return parser
 
     def __init__(self, start):
         self.lexer = self.make_lexer()
@@ -612,7 +1080,12 @@ def parse_pattern(text):
         _TREE_PATTERN_PARSER = _TreeScriptParser(start='tree_pattern')
 
     # Parse.
-    return _TREE_PATTERN_PARSER.parse(text)
+    pattern = _TREE_PATTERN_PARSER.parse(text)
+
+    # Augment pattern with its text.
+    start, end, line, col = pattern.pos
+    pattern.text = text[start:end]
+    return pattern
 
 def parse_scripts(text):
     """
@@ -643,3 +1116,71 @@ def parse_scripts(text):
             action.text = text[start:end]
 
     return scripts
+
+## ----------------------------------------------------------------------------
+#                              Script bundles
+
+# Bundles are this header followed by a pickled list of TreeScript objects.
+# Bundles start with a line of _BUNDLE_MAGIC and _bundle_version().
+_BUNDLE_MAGIC = 'dep_tregex scripts bundle '
+
+def _bundle_version():
+    """
+    Return md5 of the modules whose classes bundles pickle, as a hex string:
+    a bundle only loads into the code that wrote it.
+    """
+    import hashlib
+    import dep_tregex.tree
+    import dep_tregex.tree_action
+    import dep_tregex.tree_pattern
+
+    md5 = hashlib.md5()
+    for module in [dep_tregex.tree, dep_tregex.tree_action,
+                   dep_tregex.tree_pattern, sys.modules[__name__]]:
+        # Prefer the source: .pyc files change when merely recompiled.
+        filename = os.path.splitext(module.__file__)[0] + '.py'
+        if not os.path.exists(filename):
+            filename = module.__file__
+        with open(filename, 'rb') as f:
+            md5.update(f.read())
+    return md5.hexdigest()
+
+def write_scripts_bundle(file, scripts):
+    """
+    Write parsed scripts to a binary file, so that read_scripts_bundle() can
+    get them back without parsing.
+
+    file: file-like object, opened in binary mode.
+    scripts: list of TreeScript objects, e.g. from parse_scripts().
+    """
+    file.write('%s%s\n' % (_BUNDLE_MAGIC, _bundle_version()))
+    cPickle.dump(scripts, file, cPickle.HIGHEST_PROTOCOL)
+
+def read_scripts_bundle(file):
+    """
+    Read scripts written by write_scripts_bundle().
+    Return list of TreeScript objects.
+
+    Raise ValueError if the file is not a bundle, or if it was written by
+    another version of dep_tregex.
+
+    Loading a bundle runs cPickle.load(), which can execute arbitrary code:
+    only read bundles you trust.
+    """
+    header = file.readline()
+    if not header.startswith(_BUNDLE_MAGIC):
+        raise ValueError('not a dep_tregex scripts bundle: %r' % file)
+    version = header[len(_BUNDLE_MAGIC):].rstrip('\n')
+    if version != _bundle_version():
+        msg = "%r was written by another version of dep_tregex; " \
+              "rebuild it with the 'bundle' command"
+        raise ValueError(msg % getattr(file, 'name', file))
+    return cPickle.load(file)
+
+def is_scripts_bundle(filename):
+    """
+    Return whether the file was written by write_scripts_bundle(), of any
+    version.
+    """
+    with open(filename, 'rb') as f:
+        return f.read(len(_BUNDLE_MAGIC)) == _BUNDLE_MAGIC
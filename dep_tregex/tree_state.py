@@ -1,5 +1,3 @@
-import collections
-
 class TreeState:
     """
     Class for simultaneously manipulating a dependency tree and a
@@ -10,13 +8,37 @@ class TreeState:
     {'x': 1}.
 
     Also can mark and group nodes together,
+
+    Also can "check" nodes: a check says that something (e.g. a pattern) was
+    computed for a node, and stays valid while nothing changes within
+    'check_radius' of that node (see pattern_radius()). Modifications uncheck
+    nodes they could have affected; if 'check_radius' is None, they uncheck
+    all nodes.
+
+    'changed' is set by every modification that actually changes the tree;
+    clear it to find out whether the following ones do.
+
+    Marks, checks and groups are kept by node id (see Tree.ids()) rather
+    than by index, so they need no renumbering when nodes are moved or
+    deleted.
     """
 
     def __init__(self, tree, backrefs_map):
         self.tree = tree
         self.backrefs_map = backrefs_map
-        self._marked = set()
-        self._grouped_with = collections.defaultdict(set)
+        self.check_radius = None
+        self.changed = False
+
+        # Flags by id; set of ids.
+        self._marked = bytearray()
+        self._checked = set()
+
+        # Union-find over ids: parent by id, and members by root id.
+        self._group_parent = {}
+        self._group_members = {}
+
+        # Gathered groups by node index, until the tree or groups change.
+        self._gathered = {}
 
     # - Modifications - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
@@ -25,27 +47,29 @@ class TreeState:
         Move nodes in the tree.
         Re-adjust backrefs, groupings, and markings as well.
         """
+        if not isinstance(nodes, (list, tuple, set)):
+            nodes = [nodes]
+
+        # Remember old neighbors of the moved nodes.
+        N = len(self.tree)
+        old_neighbors = set()
+        for node in nodes:
+            old_neighbors.update([node - 1, node + 1])
+        old_neighbors.discard(N + 1)
+
         # Reorder tree.
         new_indices = self.tree.move(nodes, anchor, where)
+        if new_indices == list(range(N)):
+            return
+        self._remap_backrefs(new_indices)
+        self._tree_changed()
 
-        # Reorder marks.
-        marked = set()
-        for node in self._marked:
-            if node != 0:
-                node = new_indices[node - 1] + 1
-            marked.add(node)
-        self._marked = marked
-
-        # Reorder grouping.
-        grouped_with = collections.defaultdict(set)
-        for node, grouped_nodes in self._grouped_with.items():
-            if node != 0:
-                node = new_indices[node - 1] + 1
-            for grouped_node in grouped_nodes:
-                if grouped_node != 0:
-                    grouped_node = new_indices[grouped_node - 1] + 1
-                grouped_with[node].add(grouped_node)
-        self._grouped_with = grouped_with
+        # Uncheck around moved nodes, and their old and new neighbors.
+        touched = self._remap(old_neighbors, new_indices)
+        for node in self._remap(nodes, new_indices):
+            touched.update([node - 1, node, node + 1])
+        touched.discard(N + 1)
+        self._uncheck_around(touched)
 
     def delete(self, nodes):
         """
@@ -55,29 +79,132 @@ class TreeState:
         if not isinstance(nodes, (list, tuple, set)):
             nodes = [nodes]
 
-        # Truncate the tree.
+        # Remember what's going to be affected: old neighbors of deleted
+        # nodes, their orphaned children, and their non-deleted heads.
         deleted = set(nodes)
-        self.tree.delete(deleted)
-
-        # Erase marks and groupings.
+        touched = set()
         for node in deleted:
-            if node in self._marked:
-                self._marked.remove(node)
+            touched.update([node - 1, node + 1])
+            touched.update(self.tree.children(node))
+            head = self.tree.heads(node)
+            while head in deleted:
+                head = self.tree.heads(head)
+            touched.add(head)
+        touched.discard(len(self.tree) + 1)
+        touched -= deleted
 
-        # Erase groupings.
-        for node in deleted:
-            if node in self._grouped_with:
-                for grouped_node in self._grouped_with[node]:
-                    self._grouped_with[grouped_node].remove(node)
-                del self._grouped_with[node]
+        # Truncate the tree. Ids of deleted nodes just won't be found anymore.
+        new_indices = self.tree.delete(deleted)
+        self._remap_backrefs(new_indices)
+        self._tree_changed()
+
+        # Uncheck affected nodes.
+        self._uncheck_around(self._remap(touched, new_indices))
+
+    def insert_copy(self, nodes, anchor, where):
+        """
+        Insert a copy of nodes before or after the anchor node (see
+        Tree.insert_copy).
+        """
+        if not isinstance(nodes, (list, tuple, set)):
+            nodes = [nodes]
+
+        # Insert.
+        N = len(self.tree)
+        new_indices = self.tree.insert_copy(nodes, anchor, where)
+        self._remap_backrefs(new_indices)
+        self._tree_changed()
+
+        # Uncheck new nodes, their neighbors and their heads.
+        touched = set()
+        for new_index in new_indices[N:]:
+            node = new_index + 1
+            touched.update([node - 1, node, node + 1, self.tree.heads(node)])
+        touched.discard(len(self.tree) + 1)
+        self._uncheck_around(touched)
+
+    def set_head(self, node, head):
+        """
+        Make 'head' the head of the 'node' (see Tree.set_head).
+        """
+        old_head = self.tree.heads(node)
+        self.tree.set_head(node, head)
+        if head != old_head:
+            self._tree_changed()
+            self._uncheck_around([node, old_head, head])
+
+    def touch(self, node):
+        """
+        Tell that node's attributes (FORM, LEMMA, etc.) have changed.
+        """
+        self.changed = True
+        self._uncheck_around([node])
+
+    def _tree_changed(self):
+        """
+        Drop caches which depend on node indices or tree structure.
+        """
+        self.changed = True
+        self._gathered = {}
 
-        # Erase backrefs.
-        backrefs_to_erase = []
+    def _remap_backrefs(self, new_indices):
+        """
+        Update backrefs, given new_indices returned by Tree.move() or
+        Tree.delete(). Backrefs to deleted nodes are erased.
+        """
         for backref, node in self.backrefs_map.items():
-            if node in deleted:
-                backrefs_to_erase.append(backref)
-        for backref in backrefs_to_erase:
-            del self.backrefs_map[backref]
+            if node != 0:
+                node = new_indices[node - 1]
+                if node is None:
+                    del self.backrefs_map[backref]
+                    continue
+                self.backrefs_map[backref] = node + 1
+
+    def _remap(self, nodes, new_indices):
+        """
+        Return set of new indices for 'nodes', given new_indices returned by
+        Tree.move() or Tree.delete(). Deleted nodes are dropped.
+        """
+        result = set()
+        for node in nodes:
+            if node != 0:
+                node = new_indices[node - 1]
+                if node is None:
+                    continue
+                node += 1
+            result.add(node)
+        return result
+
+    def _uncheck_around(self, nodes):
+        """
+        Uncheck nodes within 'check_radius' from given nodes.
+        """
+        if not self._checked:
+            return
+        if self.check_radius is None:
+            self._checked.clear()
+            return
+
+        # Breadth-first search along arcs and between adjacent words.
+        N = len(self.tree)
+        frontier = set(nodes)
+        visited = set(frontier)
+        for step in range(self.check_radius):
+            next_frontier = set()
+            for node in frontier:
+                neighbors = list(self.tree.children(node))
+                if node != 0:
+                    neighbors += [self.tree.heads(node), node - 1]
+                if node != N:
+                    neighbors.append(node + 1)
+                for neighbor in neighbors:
+                    if neighbor not in visited:
+                        visited.add(neighbor)
+                        next_frontier.add(neighbor)
+            frontier = next_frontier
+
+        ids = self.tree.ids
+        self._checked.difference_update(ids(node) for node in visited)
 
     # - Marks - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
@@ -85,36 +212,91 @@ class TreeState:
         """
         Flag a tree node.
         """
-        self._marked.add(node)
+        id = self.tree.ids(node)
+        if id >= len(self._marked):
+            self._marked.extend(bytearray(id + 1 - len(self._marked)))
+        self._marked[id] = 1
 
     def marked(self, node):
         """
         Check whether a node has the flag set.
         """
-        return node in self._marked
+        id = self.tree.ids(node)
+        return id < len(self._marked) and self._marked[id] == 1
 
     def unmark(self, node):
         """
         Reset flag on a tree node.
         """
-        if node in self._marked:
-            self._marked.remove(node)
+        id = self.tree.ids(node)
+        if id < len(self._marked):
+            self._marked[id] = 0
 
     def unmark_all(self):
         """
         Reset flags on all nodes.
         """
-        self._marked.clear()
+        self._marked = bytearray()
+
+    # - Checks  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+    def check(self, node):
+        """
+        Check a tree node.
+        """
+        self._checked.add(self.tree.ids(node))
+
+    def checked(self, node):
+        """
+        Return whether a node is checked.
+        """
+        return self.tree.ids(node) in self._checked
+
+    def uncheck_all(self):
+        """
+        Uncheck all nodes.
+        """
+        self._checked.clear()
 
     # - Grouping  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
+    def _group_root(self, node_id):
+        """
+        Return representative id of the node's group (union-find 'find').
+        """
+        parent = self._group_parent
+        root = node_id
+        while parent.get(root, root) != root:
+            root = parent[root]
+
+        # Compress the path.
+        while node_id != root:
+            node_id, parent[node_id] = parent[node_id], root
+        return root
+
     def group_together(self, node1, node2):
         """
         For the purposes of gather_group(), always add node1 to the result of
         gather_group(node2) and vice versa.
+
+        Grouped nodes form equivalence classes, which aren't split when
+        a member is deleted.
         """
-        self._grouped_with[node1].add(node2)
-        self._grouped_with[node2].add(node1)
+        root1 = self._group_root(self.tree.ids(node1))
+        root2 = self._group_root(self.tree.ids(node2))
+        if root1 == root2:
+            return
+
+        # Union by size.
+        members1 = self._group_members.pop(root1, [root1])
+        members2 = self._group_members.pop(root2, [root2])
+        if len(members1) < len(members2):
+            root1, root2 = root2, root1
+            members1, members2 = members2, members1
+        self._group_parent[root2] = root1
+        members1.extend(members2)
+        self._group_members[root1] = members1
+        self._gathered = {}
 
     def gather_group(self, node):
         """
@@ -122,22 +304,42 @@ class TreeState:
         explicitly grouped with group_together(), and groups of their children
         (also recursively).
         """
-        indices = [node]
-        visited = set()
+        gathered = self._gathered.get(node)
+        if gathered is None:
+            gathered = self._gather_group(node)
+            self._gathered[node] = gathered
+        return list(gathered)
 
-        i = 0
-        while i < len(indices):
-            node = indices[i]
-            i += 1
+    def _gather_group(self, node):
+        """
+        Compute gather_group(node).
+        """
+        if not self._group_members:
+            return self.tree.subtree(node)
 
-            # Check visited.
+        # Add whole subtrees; for grouped nodes in them, add subtrees of the
+        # nodes they're grouped with.
+        group_parent = self._group_parent
+        group_members = self._group_members
+        indices = []
+        visited = set()
+        pending = [node]
+        while pending:
+            node = pending.pop()
             if node in visited:
                 continue
-            visited.add(node)
-
-            # Recurse.
-            indices.extend(self.tree.children(node))
-            indices.extend(self._grouped_with.get(node, []))
+            for node in self.tree.subtree(node):
+                if node in visited:
+                    continue
+                visited.add(node)
+                indices.append(node)
 
+                id = self.tree.ids(node)
+                if id in group_parent or id in group_members:
+                    root = self._group_root(id)
+                    for node_id in group_members[root]:
+                        grouped_node = self.tree.node_by_id(node_id)
+                        if grouped_node is not None:
+                            pending.append(grouped_node)
 
         return indices
@@ -1,6 +1,10 @@
 from __future__ import print_function
 
-import cgi
+import bisect
+import codecs
+import collections
+import io
+import os
 import sys
 import math
 
@@ -86,6 +90,18 @@ _STYLE = u"""\
       g:hover + g > text.role { fill: %s; }
       g:hover + g > path.arc { stroke: %s; stroke-dasharray: 5,5; }
       g:hover + g > path.arrow { fill: %s; }
+
+      /* Highlight of descendants on label hover (set by the script) */
+      .hl1 > text.big { fill: %s; }
+      .hl1 > text.small { fill: %s; }
+      .hl1 > text.role { fill: %s; }
+      .hl1 > path.arc { stroke: %s; }
+      .hl1 > path.arrow { fill: %s; }
+      .hl0 > text.big { fill: %s; }
+      .hl0 > text.small { fill: %s; }
+      .hl0 > text.role { fill: %s; }
+      .hl0 > path.arc { stroke: %s; }
+      .hl0 > path.arrow { fill: %s; }
     </style>""" % (
     _TRANSITION, _SMALL_FONT, _SMALL_FONT,            # Generic
     _BIG_FONT, _COLOR_BIG, _SMALL_FONT, _COLOR_SMALL, # .big, .small
@@ -94,9 +110,54 @@ _STYLE = u"""\
     _ARC_WIDTH, _COLOR_BIG,                           # .arc
                                                       # Label highlight
     _COLOR_BIG_H2, _COLOR_SMALL_H2, _COLOR_BIG_H2, _COLOR_BIG_H2, _COLOR_BIG_H2,
-    _COLOR_BIG_H2, _COLOR_BIG_H2, _COLOR_BIG_H2       # Arc hover
+    _COLOR_BIG_H2, _COLOR_BIG_H2, _COLOR_BIG_H2,      # Arc hover
+    _COLOR_BIG_H1, _COLOR_SMALL_H1, _COLOR_BIG_H1, _COLOR_BIG_H1, _COLOR_BIG_H1,
+    _COLOR_BIG_H0, _COLOR_SMALL_H0, _COLOR_BIG_H0, _COLOR_BIG_H0, _COLOR_BIG_H0
     )
 
+# Page-wide hover script. An interactive <svg> lists heads of its words in
+# 'data-heads'; when a word's label is hovered over, its children get class
+# 'hl1' and the rest of its descendants get class 'hl0'.
+_SCRIPT = u"""\
+    <script type="text/javascript">
+      function hoverTree(event, on) {
+        var g = event.target.closest ? event.target.closest('g') : null;
+        if (!g || g.contains(event.relatedTarget))
+          return;
+        var svg = g.ownerSVGElement;
+        var label = /^w(\\d+)/.exec(g.getAttribute('class'));
+        if (!label || !svg.hasAttribute('data-heads'))
+          return;
+
+        // Index children and groups of the tree on first hover.
+        if (!svg.treeChildren) {
+          var heads = svg.getAttribute('data-heads').split(' ');
+          var groups = svg.getElementsByTagName('g');
+          svg.treeChildren = {};
+          svg.treeGroups = {};
+          for (var i = 0; i < heads.length; i++) {
+            svg.treeChildren[heads[i]] = svg.treeChildren[heads[i]] || [];
+            svg.treeChildren[heads[i]].push(i + 1);
+          }
+          for (var i = 0; i < groups.length; i++)
+            svg.treeGroups[groups[i].getAttribute('class').split(' ')[0]] =
+              groups[i];
+        }
+
+        // Walk the descendants breadth-first.
+        var queue = (svg.treeChildren[label[1]] || []).slice();
+        var children = queue.length;
+        for (var i = 0; i < queue.length; i++) {
+          var cls = i < children ? 'hl1' : 'hl0';
+          svg.treeGroups['w' + queue[i]].classList.toggle(cls, on);
+          svg.treeGroups['a' + queue[i]].classList.toggle(cls, on);
+          queue.push.apply(queue, svg.treeChildren[queue[i]] || []);
+        }
+      }
+      document.addEventListener('mouseover', function(e) { hoverTree(e, true); });
+      document.addEventListener('mouseout', function(e) { hoverTree(e, false); });
+    </script>"""
+
 _PROLOGUE_HTML = u"""\
 <!DOCTYPE html>
 <html>
@@ -106,37 +167,25 @@ _PROLOGUE_HTML = u"""\
         svg { display: block; }
     </style>
     %s
+    %s
   </head>
   <body>
-""" % _STYLE
+""" % (_STYLE, _SCRIPT)
 
 _EPILOGUE_HTML = u"""\
   </body>
 </html>
 """
 
-# Styles that are applied to a tree node when its immediate head is
-# hovered over.
-_HEAD_HOVER_STYLES = [
-    u'.w%%i > text.big { fill: %s; }' % (_COLOR_BIG_H1,),
-    u'.w%%i > text.small { fill: %s; }' % (_COLOR_SMALL_H1,),
-    u'.a%%i > text.role { fill: %s; }' % (_COLOR_BIG_H1,),
-    u'.a%%i > path.arc { stroke: %s; }' % (_COLOR_BIG_H1,),
-    u'.a%%i > path.arrow { fill: %s; }' % (_COLOR_BIG_H1,)
-    ]
-
-# Styles that are applied to a tree node when its parent is hovered over,
-_PARENT_HOVER_STYLES = [
-    u'.w%%i > text.big { fill: %s; }' % (_COLOR_BIG_H0,),
-    u'.w%%i > text.small { fill: %s; }' % (_COLOR_SMALL_H0,),
-    u'.a%%i > text.role { fill: %s; }' % (_COLOR_BIG_H0,),
-    u'.a%%i > path.arc { stroke: %s; }' % (_COLOR_BIG_H0,),
-    u'.a%%i > path.arrow { fill: %s; }' % (_COLOR_BIG_H0,)
-    ]
-
 ## -----------------------------------------------------------------------------
 #                                 Utilities
 
+def _escape(s):
+    """
+    Same as cgi.escape(s), without importing cgi, which is slow to import.
+    """
+    return s.replace(u'&', u'&amp;').replace(u'<', u'&lt;').replace(u'>', u'&gt;')
+
 def _label(tree, node, fields):
     """
     Compose a label for i'th word of a tree, according to 'fields'.
@@ -160,9 +209,9 @@ def _label(tree, node, fields):
 
     # Features.
     if 'feats' in fields:
-        label += u'\n' + u'|'.join(tree.feats(node))
+        label += u'\n' + tree.feats_string(node)
 
-    return cgi.escape(label)
+    return _escape(label)
 
 def _label_height(text):
     """
@@ -198,6 +247,115 @@ def _arc_min_length(height_in_units):
     """
     return 2 * _arc_radius(height_in_units) * math.sin(_ANGLE)
 
+#         ~ Each flight level keeps the word positions it occupies ~
+#       as sorted, disjoint [start, end) intervals: 'starts' and 'ends'.
+
+def _level_is_free(level, lo, hi):
+    """
+    Return whether no position in [lo, hi) is occupied at a flight level.
+    """
+    starts, ends = level
+    if lo >= hi:
+        return True
+
+    # Intervals are disjoint, so the last one starting before 'hi' is also
+    # the one that reaches furthest to the right.
+    i = bisect.bisect_left(starts, hi) - 1
+    return i < 0 or ends[i] <= lo
+
+def _occupy_level(level, lo, hi):
+    """
+    Mark positions [lo, hi) as occupied at a flight level.
+    """
+    starts, ends = level
+
+    # Merge with all intervals that overlap or touch [lo, hi).
+    i = bisect.bisect_left(ends, lo)
+    j = bisect.bisect_right(starts, hi)
+    if i < j:
+        lo = min(lo, starts[i])
+        hi = max(hi, ends[j - 1])
+    starts[i:j] = [lo]
+    ends[i:j] = [hi]
+
+def _arc_heights(arcs):
+    """
+    Return "flight levels" of the arcs: 1, 2, 3, etc.
+
+    Shorter arcs are placed first, each at the lowest level that is free
+    strictly between its ends. Arcs from the root go above all others.
+    """
+    arc_length = lambda arc: abs(arc[0] - arc[1])
+    arc_heights = [0] * len(arcs)
+    levels = []
+
+    # Assign lower levels to arcs sequentially, starting from shorter arcs.
+    for arc in sorted(arcs, key=arc_length):
+        node, head = arc
+        start, end = min(arc) - 1, max(arc)
+
+        # Skip arcs from the root (they go vertically).
+        if head == 0:
+            continue
+
+        # Find the first flight level that is free below arc.
+        level = 1
+        while level <= len(levels) and \
+                not _level_is_free(levels[level - 1], start + 1, end - 1):
+            level += 1
+        if level > len(levels):
+            levels.append(([], []))
+
+        # Remember the height of the arc.
+        arc_heights[node - 1] = level
+        _occupy_level(levels[level - 1], start, end)
+
+    # Assign height for root arcs.
+    root_height = max(arc_heights) + 1
+    for i in range(len(arcs)):
+        if arc_heights[i] == 0:
+            arc_heights[i] = root_height
+    return arc_heights
+
+def _shift_centers(centers, arcs, arc_heights):
+    """
+    Shift words' centers to the right, so that every arc fits between its
+    words. Modify 'centers' in place.
+
+    Shifting a word shifts all words after it; accumulated shifts are kept in
+    a Fenwick tree, so that each arc costs O(log N) instead of O(N).
+    """
+    N = len(centers)
+    shifts = [0.0] * (N + 1)
+
+    def shift(i):
+        # Total shift of the i'th (1-based) word.
+        total = 0.0
+        while i > 0:
+            total += shifts[i]
+            i -= i & -i
+        return total
+
+    for node, head in arcs:
+        if head == 0:
+            continue
+
+        # Compute real margin and minimal required margin.
+        start, end = sorted((node, head))
+        margin = (centers[end - 1] + shift(end)) - \
+            (centers[start - 1] + shift(start)) - 2 * _PORT_OFFSET
+        min_margin = _arc_min_length(arc_heights[node - 1])
+
+        # Shift words to the right.
+        if margin < min_margin:
+            i = end
+            while i <= N:
+                shifts[i] += min_margin - margin
+                i += i & -i
+
+    for i in range(N):
+        centers[i] += shift(i + 1)
+
 def _parent_arc_start_offset(tree, node):
     head = tree.heads(node)
     head_head = tree.heads(head)
@@ -265,7 +423,7 @@ def _draw_root_arc(file, x, y, height_in_units, deprel, css_class):
     _draw_arrow(file, x, y, math.pi / 2)
 
     # Role.
-    deprel = cgi.escape(deprel)
+    deprel = _escape(deprel)
     file.write(u'        <text x="%i" y="%i" class="role">%s</text>\n' %
         (x, y - height - 0.2 * _SMALL_FONT, deprel))
 
@@ -304,7 +462,7 @@ def _draw_arc(file, start_x, end_x, y, height_in_units, deprel, css_class):
     _draw_arrow(file, end_x, y, arrow_angle)
 
     # Role.
-    deprel = cgi.escape(deprel)
+    deprel = _escape(deprel)
     file.write(u'        <text x="%i" y="%i" class="role">%s</text>\n' %
         ((start_x + end_x) / 2, y - height - 0.2 * _SMALL_FONT, deprel))
 
@@ -338,6 +496,121 @@ def _draw_arrow(file, tip_x, tip_y, angle):
         )
     file.write(u'        <path d="%s" class="arrow"/>\n' % (path,))
 
+## -----------------------------------------------------------------------------
+#                                  Cache
+
+# Bump to invalidate cached drawings whenever drawing changes.
+_SVG_CACHE_VERSION = 1
+
+def _svg_cache_key(tree, fields, highlight_nodes, static):
+    """
+    Return a hash of everything a drawing of the tree depends on.
+    """
+    import hashlib
+
+    lines = [u'%i %r %r %r' % (
+        _SVG_CACHE_VERSION, sorted(set(fields)), sorted(set(highlight_nodes)),
+        bool(static))]
+    for node in range(1, len(tree) + 1):
+        lines.append(u'\t'.join([
+            tree.forms(node), tree.lemmas(node), tree.cpostags(node),
+            tree.postags(node), tree.feats_string(node),
+            unicode(tree.heads(node)), tree.deprels(node)]))
+    return hashlib.sha1(u'\n'.join(lines).encode('utf-8')).hexdigest()
+
+class SvgCache:
+    """
+    On-disk cache of tree drawings, one file per drawing.
+
+    Keeps at most 'max_bytes' of drawings, evicting least recently used ones.
+    Hits touch the file, so that the next run starts with the same order.
+    Several processes may share a directory; the size bound is then only
+    approximate.
+    """
+
+    def __init__(self, dirname, max_bytes=100 * 2**20):
+        """
+        dirname: directory to keep drawings in; created if doesn't exist.
+        max_bytes: maximal total size of drawings.
+        """
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+
+        self.dirname = dirname
+        self.max_bytes = max_bytes
+
+        # Sizes of drawings, least recently used first.
+        entries = []
+        for name in os.listdir(dirname):
+            if not name.endswith('.svg'):
+                continue
+            try:
+                st = os.stat(os.path.join(dirname, name))
+            except OSError:
+                continue
+            entries.append((st.st_mtime, name, st.st_size))
+        entries.sort()
+
+        self._sizes = collections.OrderedDict()
+        self._total = 0
+        for mtime, name, size in entries:
+            self._sizes[name] = size
+            self._total += size
+        self._evict()
+
+    def get(self, key):
+        """
+        Return the drawing stored under 'key', or None.
+        """
+        name = key + '.svg'
+        path = os.path.join(self.dirname, name)
+        try:
+            with io.open(path, 'rt', encoding='utf-8', newline='') as f:
+                svg = f.read()
+            os.utime(path, None)
+        except (IOError, OSError, ValueError):
+            return None
+
+        # Mark as recently used.
+        size = self._sizes.pop(name, None)
+        if size is None:
+            size = len(svg.encode('utf-8'))
+            self._total += size
+        self._sizes[name] = size
+        return svg
+
+    def put(self, key, svg):
+        """
+        Store the drawing under 'key', evicting old ones if needed.
+        """
+        name = key + '.svg'
+        path = os.path.join(self.dirname, name)
+        data = svg.encode('utf-8')
+
+        # Write and atomically move into place, so that concurrent processes
+        # see either no file or a complete one.
+        tmp_path = '%s.%i.tmp' % (path, os.getpid())
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.rename(tmp_path, path)
+        except (IOError, OSError):
+            return
+
+        self._total -= self._sizes.pop(name, 0)
+        self._sizes[name] = len(data)
+        self._total += len(data)
+        self._evict()
+
+    def _evict(self):
+        while self._total > self.max_bytes and self._sizes:
+            name, size = self._sizes.popitem(last=False)
+            self._total -= size
+            try:
+                os.remove(os.path.join(self.dirname, name))
+            except OSError:
+                pass
+
 ## -----------------------------------------------------------------------------
 #                                   Main
 
@@ -346,48 +619,46 @@ def write_prologue_html(file):
 
 _UID = 0
 
-def write_tree_html(file, tree, fields=[], highlight_nodes=[], static=False):
-    N = len(tree)
-    if N == 0:
-        return
-
-    # Collect all tree arcs.
-    arcs = [(node, tree.heads(node)) for node in range(1, N + 1)]
-    arc_length = lambda arc: abs(arc[0] - arc[1])
-
-    # Determine height of every arc: 1, 2, 3, etc.
-    # At each position, track the occupied flight levels.
-    arc_heights = [0] * N
-    occupied = [set() for i in range(N)]
+# Stands for the UID in cached drawings.
+_UID_PLACEHOLDER = u'svg-uid'
 
-    # Assign lower levels to arcs sequentially, starting from shorter arcs.
-    for arc in sorted(arcs, key=arc_length):
-        node, head = arc
-        start, end = min(arc) - 1, max(arc)
+def write_tree_html(file, tree, fields=[], highlight_nodes=[], static=False,
+                    cache=None):
+    """
+    Draw a tree as an <svg> element.
 
-        # Skip arcs from the root (they go vertically).
-        if head == 0:
-            continue
+    cache: SvgCache to reuse the drawing from and to store it to, or None
+    """
+    if len(tree) == 0:
+        return
 
-        # Determine the occupied flight levels below arc.
-        positions = occupied[start+1:end-1] + [set()]
-        occupied_below_arc = set.union(*positions)
+    # Assign UID.
+    global _UID
+    uid = 'svg%i' % _UID
+    _UID += 1
 
-        # Find the first available flight level.
-        level = 1
-        while level in occupied_below_arc:
-            level += 1
+    if cache is None:
+        _write_tree_svg(file, tree, fields, highlight_nodes, static, uid)
+        return
 
-        # Remember the height of the arc.
-        arc_heights[node - 1] = level
-        for pos in range(start, end):
-            occupied[pos].add(level)
+    # Cached drawings have a placeholder instead of the UID, which comes
+    # first in the drawing.
+    key = _svg_cache_key(tree, fields, highlight_nodes, static)
+    svg = cache.get(key)
+    if svg is None:
+        buf = io.StringIO()
+        _write_tree_svg(buf, tree, fields, highlight_nodes, static,
+                        _UID_PLACEHOLDER)
+        svg = buf.getvalue()
+        cache.put(key, svg)
+    file.write(svg.replace(_UID_PLACEHOLDER, uid, 1))
+
+def _write_tree_svg(file, tree, fields, highlight_nodes, static, uid):
+    N = len(tree)
 
-    # Assign height for root arcs.
-    root_height = max(arc_heights) + 1
-    for i in range(N):
-        if arc_heights[i] == 0:
-            arc_heights[i] = root_height
+    # Collect all tree arcs and determine their heights: 1, 2, 3, etc.
+    arcs = [(node, tree.heads(node)) for node in range(1, N + 1)]
+    arc_heights = _arc_heights(arcs)
 
     # Get and measure labels.
     labels = [_label(tree, node, fields) for node in range(1, N + 1)]
@@ -402,51 +673,20 @@ def write_tree_html(file, tree, fields=[], highlight_nodes=[], static=False):
         start += width + _BIG_FONT
 
     # Shift words' centers to accomodate arcs.
-    for node, head in arcs:
-        if head == 0:
-            continue
-
-        # Compute real margin and minimal required margin.
-        start, end = sorted((node, head))
-        margin = centers[end - 1] - centers[start - 1] - 2 * _PORT_OFFSET
-        min_margin = _arc_min_length(arc_heights[node - 1])
-
-        # Shift words to the right.
-        if margin < min_margin:
-            for i in range(end - 1, len(centers)):
-                centers[i] += min_margin - margin
+    _shift_centers(centers, arcs, arc_heights)
 
     # Compute width and height.
     baseline = _BIG_FONT + (max(arc_heights) + 1) * _ARC_HEIGHT_UNIT
     svg_width = centers[-1] + label_widths[-1] / 2 + _BIG_FONT
     svg_height = baseline + max(label_heights) + _BIG_FONT
 
-    # Assign UID.
-    global _UID
-    uid = 'svg%i' % _UID
-    _UID += 1
-
-    # Start drawing.
-    file.write(u'    <svg width="%i" height="%i" class="%s">\n' %
-        (svg_width, svg_height, uid))
-
-    # Write hover styles.
+    # Start drawing. Interactive trees carry their heads for the hover script.
+    heads = u''
     if not static:
-        file.write(u'      <style type="text/css">\n')
-        for node in range(1, N + 1):
-            # Start with head.
-            styles = _HEAD_HOVER_STYLES
-            head = tree.heads(node)
-            # Iterate through all parents.
-            while head != 0:
-                # Highlight a node its arc when head's label is hovered over.
-                for style in styles:
-                    file.write(u'        .%s .w%i:hover ~ %s\n' %
-                        (uid, head, style % node))
-                # Go to head's head.
-                head = tree.heads(head)
-                styles = _PARENT_HOVER_STYLES
-        file.write(u'      </style>\n')
+        heads = u' data-heads="%s"' % u' '.join(
+            unicode(tree.heads(node)) for node in range(1, N + 1))
+    file.write(u'    <svg width="%i" height="%i" class="%s"%s>\n' %
+        (svg_width, svg_height, uid, heads))
 
     # Write text and arcs in topsorted order.
     queue = tree.children(0)[:]
@@ -483,3 +723,126 @@ def write_tree_html(file, tree, fields=[], highlight_nodes=[], static=False):
 
 def write_epilogue_html(file):
     file.write(_EPILOGUE_HTML)
+
+## -----------------------------------------------------------------------------
+#                                 Reports
+
+_INDEX_NAME = 'index.html'
+_PAGE_NAME = 'page%i.html'
+
+def _is_page_name(filename):
+    """
+    Return whether the file name is _PAGE_NAME of some page number.
+    """
+    prefix, suffix = _PAGE_NAME.split('%i')
+    number = filename[len(prefix):-len(suffix)]
+    return filename.startswith(prefix) and filename.endswith(suffix) and \
+        number.isdigit()
+
+class HtmlWriter:
+    """
+    Draw trees into a single HTML page, written to a file-like object.
+    """
+
+    def __init__(self, file, cache=None):
+        """
+        file: file-like object to write to.
+        cache: SvgCache for write_tree_html(), or None.
+        """
+        self.file = file
+        self._cache = cache
+        write_prologue_html(file)
+
+    def write_tree(self, tree, fields=[], highlight_nodes=[]):
+        write_tree_html(self.file, tree, fields, highlight_nodes,
+                        cache=self._cache)
+
+    def close(self):
+        """
+        Finish the page. The file itself is left open.
+        """
+        write_epilogue_html(self.file)
+
+class PagedHtmlWriter:
+    """
+    Draw trees into a directory of HTML pages of at most 'page_size' trees
+    each, plus an 'index.html' linking to all of them. Unlike a single page,
+    every page stays small enough for a browser to load quickly, however many
+    trees there are.
+    """
+
+    def __init__(self, dirname, page_size=100, cache=None):
+        """
+        dirname: directory to write pages to; created if doesn't exist.
+        Pages left there by a previous run are removed first.
+        page_size: maximal number of trees on a page.
+        cache: SvgCache for write_tree_html(), or None.
+        """
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        for filename in os.listdir(dirname):
+            if _is_page_name(filename):
+                os.remove(os.path.join(dirname, filename))
+
+        self.dirname = dirname
+        self.index_filename = os.path.join(dirname, _INDEX_NAME)
+        self._page_size = page_size
+        self._cache = cache
+        self._page_sizes = []
+        self._file = None
+
+    def _open_page(self):
+        self._page_sizes.append(0)
+        page_no = len(self._page_sizes)
+        filename = os.path.join(self.dirname, _PAGE_NAME % page_no)
+        self._file = codecs.open(filename, 'wb', encoding='utf-8')
+        write_prologue_html(self._file)
+        self._write_nav(page_no, False)
+
+    def _close_page(self, has_next):
+        self._write_nav(len(self._page_sizes), has_next)
+        write_epilogue_html(self._file)
+        self._file.close()
+        self._file = None
+
+    def _write_nav(self, page_no, has_next):
+        links = [u'<a href="%s">index</a>' % _INDEX_NAME]
+        if page_no > 1:
+            links.append(u'<a href="%s">previous</a>' %
+                (_PAGE_NAME % (page_no - 1)))
+        if has_next:
+            links.append(u'<a href="%s">next</a>' %
+                (_PAGE_NAME % (page_no + 1)))
+        self._file.write(u'    <p>Page %i: %s</p>\n' %
+            (page_no, u' | '.join(links)))
+
+    def write_tree(self, tree, fields=[], highlight_nodes=[]):
+        # Start a new page when the current one is full.
+        if self._file is not None and \
+                self._page_sizes[-1] == self._page_size:
+            self._close_page(True)
+        if self._file is None:
+            self._open_page()
+
+        write_tree_html(self._file, tree, fields, highlight_nodes,
+                        cache=self._cache)
+        self._page_sizes[-1] += 1
+
+    def close(self):
+        """
+        Finish the last page and write the index.
+        """
+        if self._file is not None:
+            self._close_page(False)
+
+        with codecs.open(self.index_filename, 'wb', encoding='utf-8') as f:
+            write_prologue_html(f)
+            f.write(u'    <p>%i trees</p>\n' % sum(self._page_sizes))
+            f.write(u'    <ul>\n')
+            first = 1
+            for page_no, size in enumerate(self._page_sizes, 1):
+                f.write(u'      <li><a href="%s">Trees %i-%i</a></li>\n' %
+                    (_PAGE_NAME % page_no, first, first + size - 1))
+                first += size
+            f.write(u'    </ul>\n')
+            write_epilogue_html(f)
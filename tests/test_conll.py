@@ -0,0 +1,95 @@
+import errno
+import io
+import unittest
+
+from dep_tregex.conll import *
+from dep_tregex.conll import _CHUNK_SIZE, _ReadAhead
+
+_TREES = (
+    u'1\tthe\tthe\tDET\tDET\t_\t2\tdet\t_\t_\n'
+    u'2\tdog\tdog\tNOUN\tNOUN\tNum=Sg\t0\troot\t_\t_\n'
+    u'\n'
+    u'1\tcats\tcat\tNOUN\tNOUN\t_\t0\troot\t_\t_\n'
+    u'\n').encode('utf-8')
+
+class _BrokenFile:
+    """
+    File which fails with EPIPE once more than 'size' bytes are written, or
+    on the second readlines() call.
+    """
+
+    def __init__(self, size=0):
+        self.size = size
+        self.written = []
+        self.reads = 0
+
+    def write(self, s):
+        if sum(map(len, self.written)) + len(s) > self.size:
+            raise IOError(errno.EPIPE, 'Broken pipe')
+        self.written.append(s)
+
+    def readlines(self, size):
+        self.reads += 1
+        if self.reads > 1:
+            raise IOError(errno.EPIPE, 'Broken pipe')
+        return [u'line\n']
+
+def _dump(tree):
+    nodes = range(1, len(tree) + 1)
+    return [(tree.forms(node), tree.lemmas(node), tree.postags(node),
+             tree.feats(node), tree.heads(node), tree.deprels(node))
+            for node in nodes]
+
+class ReadAheadTest(unittest.TestCase):
+    def test_same_trees(self):
+        expected = [_dump(t) for t in read_trees_conll(io.BytesIO(_TREES))]
+        actual = [_dump(t) for t in
+                  read_trees_conll_threaded(io.BytesIO(_TREES), queue_size=1)]
+        self.assertEqual(actual, expected)
+        self.assertEqual(len(actual), 2)
+
+    def test_many_chunks(self):
+        lines = ['%i\n' % i for i in range(3 * _CHUNK_SIZE // 4)]
+        self.assertEqual(list(_ReadAhead(io.BytesIO(''.join(lines)), 1)),
+                         lines)
+
+    def test_error_propagates(self):
+        lines = iter(_ReadAhead(_BrokenFile(), 1))
+        self.assertEqual(next(lines), u'line\n')
+        with self.assertRaises(IOError) as cm:
+            next(lines)
+        self.assertEqual(cm.exception.errno, errno.EPIPE)
+
+class ThreadedWriterTest(unittest.TestCase):
+    def test_writes_everything_in_order(self):
+        f = io.BytesIO()
+        writer = ThreadedWriter(f, queue_size=1)
+        data = ['%i\n' % i for i in range(_CHUNK_SIZE // 2)]
+        for s in data:
+            writer.write(s)
+        writer.close()
+        self.assertEqual(f.getvalue(), ''.join(data))
+        self.assertFalse(f.closed)
+
+    def test_error_raised_by_close(self):
+        writer = ThreadedWriter(_BrokenFile())
+        writer.write('x')
+        with self.assertRaises(IOError) as cm:
+            writer.close()
+        self.assertEqual(cm.exception.errno, errno.EPIPE)
+
+    def test_error_raised_by_write(self):
+        # The first chunk is written, the second one fails; whatever comes
+        # after it must neither block nor be written.
+        f = _BrokenFile(_CHUNK_SIZE)
+        writer = ThreadedWriter(f, queue_size=1)
+        with self.assertRaises(IOError) as cm:
+            for i in range(100 * _CHUNK_SIZE // 1024):
+                writer.write('x' * 1024)
+        self.assertEqual(cm.exception.errno, errno.EPIPE)
+        self.assertEqual(f.written, ['x' * _CHUNK_SIZE])
+        with self.assertRaises(IOError):
+            writer.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_DOG = (
+    u'1\tthe\tthe\tDET\tDET\t_\t2\tdet\t_\t_\n'
+    u'2\tdog\tdog\tNOUN\tNOUN\t_\t0\troot\t_\t_\n'
+    u'\n')
+_CAT = (
+    u'1\ta\ta\tDET\tDET\t_\t2\tdet\t_\t_\n'
+    u'2\tcat\tcat\tNOUN\tNOUN\t_\t0\troot\t_\t_\n'
+    u'\n')
+
+class GrepPatternsTest(unittest.TestCase):
+    def setUp(self):
+        self.dirname = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dirname)
+
+    def grep(self, patterns, input, *args):
+        filename = os.path.join(self.dirname, 'patterns.txt')
+        with open(filename, 'w') as f:
+            f.write(patterns)
+        process = subprocess.Popen(
+            [sys.executable, '-m', 'dep_tregex', 'grep', '--patterns',
+             filename] + list(args),
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE, cwd=_ROOT)
+        output, errors = process.communicate(input.encode('utf-8'))
+        return process.returncode, output.decode('utf-8'), \
+            errors.decode('utf-8')
+
+    def test_patterns(self):
+        patterns = (
+            u'# Comment.\n'
+            u"noun x postag 'NOUN'\n"
+            u'\n'
+            u"dog x form 'dog'\n"
+            u"dog2 x form 'dog'\n"
+            u"none x form 'mouse'\n")
+        code, output, errors = self.grep(patterns, _DOG + _CAT)
+        self.assertEqual(code, 0, errors)
+        self.assertEqual(output,
+                         u'# patterns: noun dog dog2\n' + _DOG +
+                         u'# patterns: noun\n' + _CAT)
+
+    def test_output_dir(self):
+        patterns = u"dog x form 'dog'\nnoun x postag 'NOUN'\n"
+        code, output, errors = self.grep(patterns, _DOG + _CAT,
+                                         '--output-dir', self.dirname)
+        self.assertEqual(code, 0, errors)
+        self.assertEqual(output, u'')
+        with open(os.path.join(self.dirname, 'dog.conll')) as f:
+            self.assertEqual(f.read().decode('utf-8'), _DOG)
+        with open(os.path.join(self.dirname, 'noun.conll')) as f:
+            self.assertEqual(f.read().decode('utf-8'), _DOG + _CAT)
+
+    def test_duplicate_names(self):
+        patterns = u"a x form 'dog'\nb x form 'cat'\na x form 'a'\n"
+        code, output, errors = self.grep(patterns, _DOG + _CAT,
+                                         '--output-dir', self.dirname)
+        self.assertNotEqual(code, 0)
+        self.assertIn(u"line 3: pattern name u'a' is already used on line 1",
+                      errors)
+        self.assertEqual(os.listdir(self.dirname), ['patterns.txt'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+import io
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import dep_tregex.tree_to_html
+from dep_tregex.conll import read_trees_conll
+from dep_tregex.tree_to_html import SvgCache, write_tree_html
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_TREE = (
+    u'1\tthe\tthe\tDET\tDET\t_\t2\tdet\t_\t_\n'
+    u'2\tdog\tdog\tNOUN\tNOUN\t_\t0\troot\t_\t_\n'
+    u'\n')
+
+class HtmlTest(unittest.TestCase):
+    def setUp(self):
+        self.dirname = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dirname)
+
+    def write_pages(self, trees):
+        process = subprocess.Popen(
+            [sys.executable, '-m', 'dep_tregex', 'html', '--print',
+             '--pages', self.dirname, '--page-size', '1'],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE, cwd=_ROOT)
+        output, errors = process.communicate((_TREE * trees).encode('utf-8'))
+        self.assertEqual(process.returncode, 0, errors)
+
+    def test_pages_removes_stale_pages(self):
+        with open(os.path.join(self.dirname, 'notes.html'), 'w') as f:
+            f.write('mine')
+        self.write_pages(3)
+        self.write_pages(1)
+        self.assertEqual(sorted(os.listdir(self.dirname)),
+                         ['index.html', 'notes.html', 'page1.html'])
+
+def _draw(tree, cache=None, fields=[]):
+    """
+    Return write_tree_html() output, numbering drawings from zero.
+    """
+    dep_tregex.tree_to_html._UID = 0
+    f = io.StringIO()
+    write_tree_html(f, tree, fields, cache=cache)
+    return f.getvalue()
+
+class SvgCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.dirname = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dirname)
+
+    def svg_files(self):
+        return sorted(name for name in os.listdir(self.dirname)
+                      if name.endswith('.svg'))
+
+    def test_hit_and_miss(self):
+        tree, = read_trees_conll(io.BytesIO(_TREE.encode('utf-8')))
+        # The directory is created if needed.
+        shutil.rmtree(self.dirname)
+        cache = SvgCache(self.dirname)
+        expected = _draw(tree)
+
+        # Miss, then hit.
+        self.assertEqual(_draw(tree, cache), expected)
+        name, = self.svg_files()
+        self.assertEqual(_draw(tree, cache), expected)
+        self.assertEqual(self.svg_files(), [name])
+
+        # Hits come from the file, with the drawing's UID put in.
+        with open(os.path.join(self.dirname, name), 'w') as f:
+            f.write('<svg id="svg-uid"/>')
+        self.assertEqual(_draw(tree, cache), u'<svg id="svg0"/>')
+
+        # Other fields or other trees are other drawings.
+        self.assertEqual(_draw(tree, cache, [u'lemma']),
+                         _draw(tree, fields=[u'lemma']))
+        tree.set_head(1, 0)
+        self.assertEqual(_draw(tree, cache), _draw(tree))
+        self.assertEqual(len(self.svg_files()), 3)
+
+    def test_eviction(self):
+        cache = SvgCache(self.dirname, max_bytes=25)
+        cache.put('a', u'a' * 10)
+        cache.put('b', u'b' * 10)
+        self.assertEqual(cache.get('a'), u'a' * 10)
+
+        # 'b' is the least recently used.
+        cache.put('c', u'c' * 10)
+        self.assertEqual(self.svg_files(), ['a.svg', 'c.svg'])
+        self.assertEqual(cache.get('b'), None)
+
+        # Replacing a drawing doesn't count it twice.
+        cache.put('c', u'C' * 10)
+        self.assertEqual(self.svg_files(), ['a.svg', 'c.svg'])
+
+        # Too big to keep at all.
+        cache.put('d', u'd' * 30)
+        self.assertEqual(self.svg_files(), [])
+
+    def test_reopen(self):
+        # Order of use survives in modification times.
+        with open(os.path.join(self.dirname, 'notes.txt'), 'w') as f:
+            f.write('x' * 100)
+        for i, key in enumerate(['c', 'a', 'b']):
+            path = os.path.join(self.dirname, key + '.svg')
+            with open(path, 'w') as f:
+                f.write(key * 10)
+            os.utime(path, (1000 + i, 1000 + i))
+
+        cache = SvgCache(self.dirname, max_bytes=25)
+        self.assertEqual(self.svg_files(), ['a.svg', 'b.svg'])
+        self.assertEqual(cache.get('a'), u'a' * 10)
+        cache = SvgCache(self.dirname, max_bytes=15)
+        self.assertEqual(self.svg_files(), ['a.svg'])
+        self.assertTrue(os.path.exists(os.path.join(self.dirname,
+                                                    'notes.txt')))
+
+if __name__ == '__main__':
+    unittest.main()
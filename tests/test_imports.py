@@ -0,0 +1,27 @@
+import os
+import subprocess
+import sys
+import unittest
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules that only some commands need, so they are imported lazily.
+_LAZY_MODULES = [
+    'cgi', 'hashlib', 'imp', 'ply', 'ply.lex', 'ply.yacc', 'random',
+    'tempfile', 'threading', 'webbrowser'
+    ]
+
+class ImportTest(unittest.TestCase):
+    def test_startup_imports_are_lazy(self):
+        # A fresh interpreter: the test runner may have imported anything.
+        code = (
+            'import sys\n'
+            'import dep_tregex.__main__\n'
+            'print(" ".join(m for m in %r if m in sys.modules))\n'
+            % (_LAZY_MODULES,))
+        output = subprocess.check_output([sys.executable, '-c', code],
+                                         cwd=_ROOT)
+        self.assertEqual(output.split(), [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_TREE = (
+    u'1\tthe\tthe\tDET\tDET\t_\t2\tdet\t_\t_\n'
+    u'2\tdog\tdog\tNOUN\tNOUN\t_\t3\tnsubj\t_\t_\n'
+    u'3\tsaw\tsee\tVERB\tVERB\t_\t0\troot\t_\t_\n'
+    u'4\ta\ta\tDET\tDET\t_\t5\tdet\t_\t_\n'
+    u'5\tbig\tbig\tADJ\tADJ\t_\t6\tamod\t_\t_\n'
+    u'6\tcat\tcat\tNOUN\tNOUN\t_\t3\tobj\t_\t_\n'
+    u'\n')
+
+def _forms(conll):
+    return [line.split(u'\t')[1] for line in conll.splitlines() if line]
+
+class SedTest(unittest.TestCase):
+    def setUp(self):
+        self.dirname = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dirname)
+
+    def run_cmd(self, args, input=u''):
+        process = subprocess.Popen(
+            [sys.executable, '-m', 'dep_tregex'] + args,
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE, cwd=_ROOT)
+        output, errors = process.communicate(input.encode('utf-8'))
+        return process.returncode, output.decode('utf-8'), \
+            errors.decode('utf-8')
+
+    def write_scripts(self, scripts):
+        filename = os.path.join(self.dirname, 'scripts.txt')
+        with open(filename, 'w') as f:
+            f.write(scripts)
+        return filename
+
+    def sed(self, scripts, input, *args):
+        filename = self.write_scripts(scripts)
+        code, output, errors = self.run_cmd(['sed', filename] + list(args),
+                                            input)
+        self.assertEqual(code, 0, errors)
+        return output, errors
+
+    def test_over_budget_skip_prints_original_tree(self):
+        # The first script edits the tree in place, then the second one
+        # (which can never match) runs out of steps.
+        scripts = (
+            u"{ x form 'dog' :: set form x 'DOG'; set lemma x 'ZZ'; }\n"
+            u'{ x $++ (y $++ (z $++ x)) :: delete node x; }\n')
+        output, errors = self.sed(scripts, _TREE, '--max-steps', '20',
+                                  '--over-budget', 'skip')
+        self.assertIn(u'exceeded 20 steps', errors)
+        self.assertIn(u'the dog saw a big cat', errors)
+        self.assertEqual(output, _TREE)
+
+        # Within the budget, the edits are kept.
+        output, errors = self.sed(scripts, _TREE, '--max-steps', '1000',
+                                  '--over-budget', 'skip')
+        self.assertIn(u'\tDOG\tZZ\t', output)
+
+    def test_max_steps_refuses_compiled_module(self):
+        # A compiled pattern is a single call: there are no steps to count.
+        filename = self.write_scripts(u"{ x form 'dog' :: delete node x; }\n")
+        module = os.path.join(self.dirname, 'scripts.py')
+        code, output, errors = self.run_cmd(
+            ['compile-scripts', filename, module])
+        self.assertEqual(code, 0, errors)
+        code, output, errors = self.run_cmd(
+            ['sed', module, '--max-steps', '20'], _TREE)
+        self.assertEqual(code, 2)
+        self.assertIn(u"can't use --max-steps", errors)
+        self.assertEqual(output, u'')
+
+    def test_until_fixpoint(self):
+        # Each round moves 'cat' one word to the left, up to 'saw'.
+        scripts = (u"{ x form 'cat' and $- (y not form 'saw') :: "
+                   u"move node x before node y; }\n")
+        output, errors = self.sed(scripts, _TREE)
+        self.assertEqual(_forms(output),
+                         [u'the', u'dog', u'saw', u'a', u'cat', u'big'])
+
+        output, errors = self.sed(scripts, _TREE, '--until-fixpoint')
+        self.assertEqual(_forms(output),
+                         [u'the', u'dog', u'saw', u'cat', u'a', u'big'])
+        self.assertEqual(errors, u'')
+
+        # Two rounds make all the changes, but only a third one would tell.
+        output, errors = self.sed(scripts, _TREE + _TREE, '--until-fixpoint',
+                                  '--max-rounds', '2')
+        self.assertEqual(_forms(output),
+                         2 * [u'the', u'dog', u'saw', u'cat', u'a', u'big'])
+        self.assertEqual(errors.splitlines(),
+                         [u'tree #1: still changing after 2 rounds',
+                          u'tree #2: still changing after 2 rounds'])
+
+        code, output, errors = self.run_cmd(
+            ['sed', self.write_scripts(scripts), '--until-fixpoint',
+             '--max-rounds', '0'], _TREE)
+        self.assertEqual(code, 2)
+        self.assertIn(u'--max-rounds has to be positive', errors)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,222 @@
+import cPickle
+import unittest
+
+from dep_tregex.tree import Tree
+from dep_tregex.tree_pattern import *
+from dep_tregex.tree_script import parse_pattern
+
+def _tree(words):
+    """
+    Make a tree from a list of (form, head) pairs.
+    """
+    forms = [form for form, head in words]
+    heads = [head for form, head in words]
+    N = len(words)
+    return Tree(forms, forms, [u'_'] * N, [u'_'] * N, [[]] * N, heads,
+                [u'dep'] * N)
+
+# 1:a <- root; 2:b, 3:c, 4:b <- a; 5:c <- 4:b
+_TREE = _tree([(u'a', 0), (u'b', 1), (u'c', 1), (u'b', 1), (u'c', 4)])
+
+class MatchAllTest(unittest.TestCase):
+    def bindings(self, text, tree=_TREE):
+        """
+        Return list of bindings iter_matches() yields for a pattern.
+        """
+        return list(iter_matches(tree, parse_pattern(text)))
+
+    def match_all(self, text, node, backrefs_map=None, tree=_TREE):
+        """
+        Return list of bindings match_all() yields on a node.
+        """
+        if backrefs_map is None:
+            backrefs_map = {}
+        pattern = parse_pattern(text)
+        return [dict(backrefs_map)
+                for _ in pattern.match_all(tree, node, backrefs_map)]
+
+    def test_or_branches(self):
+        # 'a' has a 'c' both to the right and to the left.
+        tree = _tree([(u'c', 2), (u'a', 0), (u'c', 2)])
+        text = u"x $++ (y form 'c') or $-- (y form 'c')"
+        self.assertEqual(self.match_all(text, 2, tree=tree),
+                         [{u'x': 2, u'y': 3}, {u'x': 2, u'y': 1}])
+        self.assertEqual(
+            sorted(self.bindings(text, tree)),
+            sorted([{u'x': 1, u'y': 3}, {u'x': 2, u'y': 3},
+                    {u'x': 2, u'y': 1}, {u'x': 3, u'y': 1}]))
+
+    def test_backtracking_across_child_and_neighbor(self):
+        # Children 'b' of 'a', each with a 'c' somewhere to the right.
+        self.assertEqual(
+            self.bindings(u"x > (y form 'b' and $++ (z form 'c'))"),
+            [{u'x': 1, u'y': 2, u'z': 3}, {u'x': 1, u'y': 2, u'z': 5},
+             {u'x': 1, u'y': 4, u'z': 5}])
+
+        # The first 'b' with a 'c' child is the second one.
+        self.assertEqual(
+            self.bindings(u"x > (y form 'b' and > (z form 'c'))"),
+            [{u'x': 1, u'y': 4, u'z': 5}])
+
+    def test_and_enumerates_all_combinations(self):
+        text = u"x form 'a' and > (y form 'b') and >> (z form 'c')"
+        self.assertEqual(
+            self.bindings(text),
+            [{u'x': 1, u'y': 2, u'z': 3}, {u'x': 1, u'y': 2, u'z': 5},
+             {u'x': 1, u'y': 4, u'z': 3}, {u'x': 1, u'y': 4, u'z': 5}])
+
+    def test_set_backref_rebinding(self):
+        # The inner 'y' shadows the outer one while matching.
+        self.assertEqual(
+            self.bindings(u"x > (y form 'b' and $++ (y form 'c'))"),
+            [{u'x': 1, u'y': 3}, {u'x': 1, u'y': 5}])
+
+        # Bindings made before match_all() are shadowed while it yields, and
+        # restored when it's done.
+        backrefs_map = {u'x': 5, u'w': 1}
+        self.assertEqual(
+            self.match_all(u"x > (y form 'c')", 4, backrefs_map),
+            [{u'x': 4, u'y': 5, u'w': 1}])
+        self.assertEqual(backrefs_map, {u'x': 5, u'w': 1})
+
+    def test_identical_bindings_are_yielded_once(self):
+        text = u"x > (y form 'c') or >> (y form 'c')"
+        self.assertEqual(len(self.match_all(text, 1)), 3)
+        self.assertEqual(self.bindings(text),
+                         [{u'x': 1, u'y': 3}, {u'x': 1, u'y': 5},
+                          {u'x': 4, u'y': 5}])
+
+    def test_agrees_with_match(self):
+        texts = [
+            u"x > (y form 'c')",
+            u"x < (y form 'a')",
+            u"x << (y form 'a')",
+            u"x $+ (y form 'c') or $- (y form 'c')",
+            u"x -->. (y) and .<-- (z)",
+            u"x not > y",
+            u"x >> (y form 'c' and not == x)",
+            u"x is_leaf and <-. y",
+            ]
+        for text in texts:
+            pattern = parse_pattern(text)
+            for node in range(len(_TREE) + 1):
+                backrefs_map = {u'w': 1}
+                all_maps = [dict(backrefs_map) for _ in
+                            pattern.match_all(_TREE, node, backrefs_map)]
+                self.assertEqual(backrefs_map, {u'w': 1})
+
+                matched = pattern.match(_TREE, node, backrefs_map)
+                self.assertEqual(bool(all_maps), matched, (text, node))
+                if matched:
+                    self.assertEqual(all_maps[0], backrefs_map, (text, node))
+
+    def test_lazy(self):
+        matches = iter_matches(_TREE, parse_pattern(u'x >> y'))
+        self.assertEqual(next(matches), {u'x': 1, u'y': 2})
+
+class StringPredicateTest(unittest.TestCase):
+    def test_same_as_regex(self):
+        patterns = [
+            u'dog', u'a|b', u'^x|y$', u'dog|cat|bird', u'|a', u'a|',
+            u'd.g', u'a+', u'do?g', u'(dog)', u'[dc]at', u'dog\\.', u'o{2}',
+            u'^dog', u'dog$', u'do*g|cat', u'\\w+',
+            ]
+        # No newlines: regex '$' also matches before a trailing one, but
+        # CoNLL fields can't have them.
+        strings = [
+            u'', u'a', u'b', u'ab', u'ba', u'xay', u'x', u'y', u'dog',
+            u'Dog', u'cat', u'hotdog', u'dogs', u'bird', u'dg', u'dag',
+            u'dog.', u'dogx', u'goo', u'd', u'^x', u'y$', u'a|b', u'd.g',
+            ]
+        for pattern in patterns:
+            for ignore_case in [False, True]:
+                for anywhere in [False, True]:
+                    args = (pattern, ignore_case, anywhere)
+                    r = compile_regex(*args)
+                    pred_fn = compile_string_predicate(*args)
+                    rebuilt_fn = predicate_from_spec(pred_fn.spec)
+                    for s in strings:
+                        expected = r.search(s) is not None
+                        self.assertEqual(pred_fn(s), expected, (args, s))
+                        self.assertEqual(rebuilt_fn(s), expected, (args, s))
+
+    def test_literals_are_visible(self):
+        # Prefilters rely on whole-string literals being tagged.
+        pred_fn = compile_string_predicate(u'dog', False, False)
+        self.assertEqual(pred_fn.literals, frozenset([u'dog']))
+        for args in [(u'dog|cat', False, False), (u'dog', True, False),
+                     (u'dog', False, True), (u'd.g', False, False)]:
+            pred_fn = compile_string_predicate(*args)
+            self.assertFalse(hasattr(pred_fn, 'literals'), args)
+
+def _all_subpatterns(pattern):
+    result = [pattern]
+    for subpattern in subpatterns(pattern):
+        result.extend(_all_subpatterns(subpattern))
+    return result
+
+def _match_nodes(pattern, tree=_TREE):
+    return [node for node in range(len(tree) + 1)
+            if pattern.match(tree, node, {})]
+
+class InstrumentationTest(unittest.TestCase):
+    def assert_intact(self, pattern, matches):
+        """
+        Check that pattern and all its sub-patterns have no instrumentation
+        left, and that they match the same nodes, even after pickling.
+        """
+        for subpattern in _all_subpatterns(pattern):
+            self.assertNotIn('match', vars(subpattern))
+        self.assertEqual(_match_nodes(pattern), matches)
+        pickled = cPickle.loads(cPickle.dumps(pattern, -1))
+        self.assertEqual(_match_nodes(pickled), matches)
+
+    def test_profile_restore(self):
+        pattern = parse_pattern(u"x > (y form 'c') or $++ (z form 'b')")
+        matches = _match_nodes(pattern)
+
+        profile = PatternProfile()
+        profile.instrument(pattern)
+        self.assertEqual(_match_nodes(pattern), matches)
+        profile.restore()
+
+        self.assert_intact(pattern, matches)
+        self.assertEqual(profile.calls[pattern], len(_TREE) + 1)
+        self.assertTrue(profile.calls[pattern.condition.condition] > 0)
+
+    def test_profile_restore_compiled(self):
+        match_fn = lambda tree, node, backrefs_map: node == 2
+        pattern = CompiledPattern(match_fn, 0, [])
+        profile = PatternProfile()
+        profile.instrument(pattern)
+        self.assertEqual(_match_nodes(pattern), [2])
+        profile.restore()
+        self.assertIs(pattern.match, match_fn)
+        self.assertEqual(profile.calls[pattern], len(_TREE) + 1)
+
+    def test_budget_restore(self):
+        pattern = parse_pattern(u"x >> (y form 'c') and $++ (z form 'b')")
+        matches = _match_nodes(pattern)
+
+        budget = StepBudget(3)
+        budget.instrument(pattern)
+        with self.assertRaises(StepBudgetExceeded):
+            _match_nodes(pattern)
+        budget.restore()
+        self.assert_intact(pattern, matches)
+
+    def test_budget_and_profile_restore(self):
+        pattern = parse_pattern(u"x > (y form 'c')")
+        matches = _match_nodes(pattern)
+
+        profile = PatternProfile()
+        profile.instrument(pattern)
+        budget = StepBudget(1000)
+        budget.instrument(pattern)
+        self.assertEqual(_match_nodes(pattern), matches)
+        budget.restore()
+        profile.restore()
+        self.assert_intact(pattern, matches)
+
+if __name__ == '__main__':
+    unittest.main()
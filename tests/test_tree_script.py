@@ -0,0 +1,390 @@
+import io
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+import ply.lex
+import ply.yacc
+
+import dep_tregex.tree_script
+from dep_tregex.tree import Tree
+from dep_tregex.tree_script import *
+from dep_tregex.tree_script import _TreeScriptParser, _lexer_signature
+
+class LexerSignatureTest(unittest.TestCase):
+    def test_rules_change_signature(self):
+        def t_ID(t):
+            r'[a-z]+'
+            return t
+
+        def t_NUMBER(t):
+            r'[0-9]+'
+            return t
+
+        tokens = ['ID']
+        rules = {'t_ID': t_ID, 't_ignore_COMMENT': r'\#.*', 'other': 1}
+        signature = _lexer_signature(tokens, rules)
+        self.assertEqual(signature, _lexer_signature(tokens, dict(rules)))
+
+        # String rules count by their regex.
+        changed = dict(rules, t_ignore_COMMENT=r'//.*')
+        self.assertNotEqual(signature, _lexer_signature(tokens, changed))
+
+        # Function rules count by their docstring.
+        changed = dict(rules, t_ID=t_NUMBER)
+        self.assertNotEqual(signature, _lexer_signature(tokens, changed))
+
+        # Tokens count, but names other than 't_...' don't.
+        self.assertNotEqual(signature, _lexer_signature(['ID', 'X'], rules))
+        changed = dict(rules, other=2)
+        self.assertEqual(signature, _lexer_signature(tokens, changed))
+
+class _ChangedParser(_TreeScriptParser):
+    # One more keyword: both the lexer rules and the grammar change.
+    KEYWORDS = dict(_TreeScriptParser.KEYWORDS, is_odd='IS_ODD')
+    TOKENS = _TreeScriptParser.TOKENS + ['IS_ODD']
+
+class TableCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.dirname = tempfile.mkdtemp()
+        self.old_cache_dir = os.environ.get('DEP_TREGEX_CACHE_DIR')
+        self.set_cache_dir(os.path.join(self.dirname, 'cache'))
+
+    def tearDown(self):
+        self.set_cache_dir(self.old_cache_dir)
+        shutil.rmtree(self.dirname)
+
+    def set_cache_dir(self, path):
+        if path is None:
+            os.environ.pop('DEP_TREGEX_CACHE_DIR', None)
+        else:
+            os.environ['DEP_TREGEX_CACHE_DIR'] = path
+
+    def cache_files(self):
+        """
+        Return dict from names of cached files to their contents.
+        """
+        files = {}
+        for dirpath, dirnames, filenames in os.walk(self.dirname):
+            for filename in filenames:
+                if not filename.endswith('.pyc'):
+                    with open(os.path.join(dirpath, filename), 'rb') as f:
+                        files[filename] = f.read()
+        return files
+
+    def parse(self, parser_cls=_TreeScriptParser):
+        """
+        Build a parser and parse a script with it.
+        Return how many times lexer and parser tables were read from cache,
+        and how many times parser tables were generated.
+        """
+        counts = {'readtab': 0, 'generated': 0}
+
+        readtab = ply.lex.Lexer.readtab
+        def counting_readtab(*args, **kwargs):
+            counts['readtab'] += 1
+            return readtab(*args, **kwargs)
+
+        generated_table = ply.yacc.LRGeneratedTable
+        class CountingTable(generated_table):
+            def __init__(self, *args, **kwargs):
+                counts['generated'] += 1
+                generated_table.__init__(self, *args, **kwargs)
+
+        ply.lex.Lexer.readtab = counting_readtab
+        ply.yacc.LRGeneratedTable = CountingTable
+        try:
+            parser = parser_cls('tree_scripts')
+        finally:
+            ply.lex.Lexer.readtab = readtab
+            ply.yacc.LRGeneratedTable = generated_table
+
+        scripts = parser.parse(u"{ x form 'dog' :: delete node x; }")
+        self.assertEqual(len(scripts), 1)
+        return counts['readtab'], counts['generated']
+
+    def test_tables_are_reused(self):
+        self.assertEqual(self.parse(), (0, 1))
+        files = self.cache_files()
+        self.assertEqual(len(files), 2)
+        self.assertIn('parsetab_tree_scripts.pickle', files)
+
+        self.assertEqual(self.parse(), (1, 0))
+        self.assertEqual(self.cache_files(), files)
+
+    def test_tables_are_regenerated_on_grammar_change(self):
+        self.parse()
+        files = self.cache_files()
+
+        self.assertEqual(self.parse(_ChangedParser), (0, 1))
+        changed_files = self.cache_files()
+        new_lextabs = set(changed_files) - set(files)
+        self.assertEqual(len(new_lextabs), 1)
+        self.assertTrue(new_lextabs.pop().startswith('lextab_'))
+        self.assertNotEqual(changed_files['parsetab_tree_scripts.pickle'],
+                            files['parsetab_tree_scripts.pickle'])
+
+        # Old lexer tables still apply to the old rules.
+        self.assertEqual(self.parse(), (1, 1))
+
+    def test_broken_tables_are_rebuilt(self):
+        self.parse()
+        for dirpath, dirnames, filenames in os.walk(self.dirname):
+            for filename in filenames:
+                with open(os.path.join(dirpath, filename), 'wb') as f:
+                    f.write('garbage')
+        self.assertEqual(self.parse(), (0, 1))
+        self.assertEqual(self.parse(), (1, 0))
+
+    def test_unusable_cache_dir(self):
+        # A cache dir that can't be created: tables are built every time,
+        # and nothing is written.
+        filename = os.path.join(self.dirname, 'file')
+        with open(filename, 'w') as f:
+            f.write('')
+        self.set_cache_dir(os.path.join(filename, 'cache'))
+        self.assertEqual(self.parse(), (0, 1))
+        self.assertEqual(self.parse(), (0, 1))
+        self.assertEqual(os.listdir(self.dirname), ['file'])
+
+    @unittest.skipIf(os.geteuid() == 0, 'root can write anywhere')
+    def test_read_only_cache_dir(self):
+        path = os.path.join(self.dirname, 'cache')
+        os.mkdir(path)
+        os.chmod(path, 0o500)
+        try:
+            self.assertEqual(self.parse(), (0, 1))
+            self.assertEqual(os.listdir(path), [])
+        finally:
+            os.chmod(path, 0o700)
+
+    def test_caching_disabled(self):
+        self.set_cache_dir('')
+        self.assertEqual(self.parse(), (0, 1))
+        self.assertEqual(self.parse(), (0, 1))
+        self.assertEqual(os.listdir(self.dirname), [])
+
+class BundleTest(unittest.TestCase):
+    def test_round_trip(self):
+        scripts = parse_scripts(
+            u"{ x form /dog|cat/ :: set lemma x 'animal'; }\n"
+            u"{ x form 'the' and $+ (y lemma 'animal') :: delete node x; }")
+        f = io.BytesIO()
+        write_scripts_bundle(f, scripts)
+        f.seek(0)
+        loaded = read_scripts_bundle(f)
+
+        tree = Tree([u'the', u'dog'], [u'the', u'dog'], [u'_'] * 2,
+                    [u'_'] * 2, [[]] * 2, [2, 0], [u'det', u'root'])
+        self.assertEqual(len(loaded), 2)
+        new_tree = run_tree_scripts(tree, loaded)
+        self.assertEqual(len(new_tree), 1)
+        self.assertEqual(new_tree.forms(1), u'dog')
+        self.assertEqual(new_tree.lemmas(1), u'animal')
+
+    def test_header(self):
+        dirname = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(dirname, 'scripts.bundle')
+            with open(filename, 'wb') as f:
+                write_scripts_bundle(f, [])
+            self.assertTrue(is_scripts_bundle(filename))
+            with open(filename, 'rb') as f:
+                self.assertEqual(read_scripts_bundle(f), [])
+
+            # A bundle of another version is still a bundle, but it doesn't
+            # get unpickled.
+            with open(filename, 'wb') as f:
+                f.write('dep_tregex scripts bundle v1\n')
+                f.write('not a pickle')
+            self.assertTrue(is_scripts_bundle(filename))
+            with open(filename, 'rb') as f:
+                with self.assertRaisesRegexp(ValueError, 'rebuild it'):
+                    read_scripts_bundle(f)
+
+            with open(filename, 'wb') as f:
+                f.write("{ x :: delete node x; }")
+            self.assertFalse(is_scripts_bundle(filename))
+            with open(filename, 'rb') as f:
+                with self.assertRaisesRegexp(ValueError, 'not a dep_tregex'):
+                    read_scripts_bundle(f)
+        finally:
+            shutil.rmtree(dirname)
+
+def _random_tree(rng, N):
+    """
+    Return a random tree of N words.
+    """
+    order = range(1, N + 1)
+    rng.shuffle(order)
+    heads = [0] * N
+    for i, node in enumerate(order[1:], start=1):
+        heads[node - 1] = order[rng.randint(0, i - 1)]
+    forms = [rng.choice([u'a', u'b', u'c', u'd']) for node in range(N)]
+    return Tree(forms, forms, [u'_'] * N, [u'_'] * N, [[]] * N, heads,
+                [u'dep'] * N)
+
+def _dump(tree):
+    nodes = range(1, len(tree) + 1)
+    return [(tree.forms(node), tree.lemmas(node), tree.heads(node),
+             tree.deprels(node)) for node in nodes]
+
+# Scripts with bounded pattern radius which edit the tree near the matched
+# node: nodes which failed earlier may match afterwards, as 'c' spreads
+# leftwards and upwards.
+_LOCAL_SCRIPTS = (
+    u"{ x form 'a' and $+ (y form 'c') :: set form x 'c'; }\n"
+    u"{ x form 'a' and > (y form 'c') :: set form x 'c'; }\n"
+    u"{ x form 'b' and $+ (y form 'a') :: move node x after node y; }\n"
+    u"{ x form 'd' and $- (y form 'a' and < z) :: delete node z; }\n"
+    u"{ x form 'b' and ->. (y form 'd') :: copy node y before node x; }\n"
+    u"{ x form 'b' and is_leaf and <-. (y form 'a') :: "
+    u"set form y 'd'; }\n")
+
+class CheckRadiusTest(unittest.TestCase):
+    def test_radius(self):
+        radii = [
+            (u"x form 'a'", 0),
+            (u"x is_leaf", 1),
+            (u"x > (y form 'a' and $+ z)", 2),
+            (u"x form 'a' or <-. (y < z)", 2),
+            (u"x $++ (y form 'a')", None),
+            (u"x > (y >> z)", None),
+            ]
+        for text, radius in radii:
+            self.assertEqual(pattern_radius(parse_pattern(text)), radius,
+                             text)
+
+    def test_checks_dont_change_results(self):
+        scripts = parse_scripts(_LOCAL_SCRIPTS)
+        self.assertNotIn(None, [pattern_radius(script.pattern)
+                                for script in scripts])
+
+        # Results with per-script radii and with every change unchecking
+        # all nodes must be the same.
+        rng = random.Random(0)
+        trees = [_random_tree(rng, rng.randint(1, 12)) for i in range(300)]
+        expected = [_dump(run_tree_scripts(tree, scripts)) for tree in trees]
+        pattern_radius_fn = dep_tregex.tree_script.pattern_radius
+        dep_tregex.tree_script.pattern_radius = lambda pattern: None
+        try:
+            actual = [_dump(run_tree_scripts(tree, scripts))
+                      for tree in trees]
+        finally:
+            dep_tregex.tree_script.pattern_radius = pattern_radius_fn
+        self.assertEqual(actual, expected)
+
+def _forms_tree(forms):
+    """
+    Make a tree where the words are children of the root.
+    """
+    N = len(forms)
+    return Tree(forms, forms, [u'_'] * N, [u'_'] * N, [[]] * N, [0] * N,
+                [u'dep'] * N)
+
+def _forms(tree):
+    return [tree.forms(node) for node in range(1, len(tree) + 1)]
+
+class FixpointTest(unittest.TestCase):
+    # Each round moves 'b' one word to the right.
+    BUBBLE = u"{ x form 'b' and $+ (y form 'a') :: move node x after node y; }"
+
+    def test_converges(self):
+        scripts = parse_scripts(self.BUBBLE)
+        tree = _forms_tree([u'b', u'a', u'a', u'a'])
+        self.assertEqual(_forms(run_tree_scripts(tree, scripts)),
+                         [u'a', u'b', u'a', u'a'])
+
+        # Three rounds change the tree, the fourth one finds nothing to do.
+        fixpoint = Fixpoint(10)
+        new_tree = run_tree_scripts(tree, scripts, fixpoint=fixpoint)
+        self.assertEqual(_forms(new_tree), [u'a', u'a', u'a', u'b'])
+        self.assertEqual((fixpoint.rounds, fixpoint.converged), (4, True))
+        self.assertEqual(_forms(tree), [u'b', u'a', u'a', u'a'])
+
+        # Nothing to do at all.
+        new_tree = run_tree_scripts(new_tree, scripts, fixpoint=fixpoint)
+        self.assertEqual((fixpoint.rounds, fixpoint.converged), (1, True))
+
+    def test_max_rounds(self):
+        scripts = parse_scripts(self.BUBBLE)
+        tree = _forms_tree([u'b', u'a', u'a', u'a'])
+        fixpoint = Fixpoint(2)
+        new_tree = run_tree_scripts(tree, scripts, fixpoint=fixpoint)
+        self.assertEqual(_forms(new_tree), [u'a', u'a', u'b', u'a'])
+        self.assertEqual((fixpoint.rounds, fixpoint.converged), (2, False))
+
+        # Scripts which undo each other never converge.
+        scripts = parse_scripts(
+            u"{ x form 'a' :: set form x 'b'; }\n"
+            u"{ x form 'b' :: set form x 'a'; }\n")
+        fixpoint = Fixpoint(5)
+        new_tree = run_tree_scripts(tree, scripts, fixpoint=fixpoint)
+        self.assertEqual(_forms(new_tree), [u'a', u'a', u'a', u'a'])
+        self.assertEqual((fixpoint.rounds, fixpoint.converged), (5, False))
+
+        # Setting a value that's already there isn't a change.
+        scripts = parse_scripts(u"{ x form 'a' :: set form x 'a'; }")
+        run_tree_scripts(tree, scripts, fixpoint=fixpoint)
+        self.assertEqual((fixpoint.rounds, fixpoint.converged), (1, True))
+
+def _tagged_tree(rng, N):
+    """
+    Return a random tree of N words with random forms, lemmas, tags and
+    features.
+    """
+    tree = _random_tree(rng, N)
+    forms = [rng.choice([u'the', u'dog', u'cat', u'mouse', u'saw', u'Dig'])
+             for node in range(N)]
+    lemmas = [rng.choice([u'the', u'animal', u'see']) for node in range(N)]
+    postags = [rng.choice([u'DET', u'NOUN', u'VERB']) for node in range(N)]
+    feats = [rng.choice([[], [u'Case=Gen'], [u'Num=Sg', u'Case=Nom']])
+             for node in range(N)]
+    heads = [tree.heads(node) for node in range(1, N + 1)]
+    return Tree(forms, lemmas, postags, postags, feats, heads, [u'dep'] * N)
+
+# Scripts with and without required literals; some set attributes that make
+# the following ones applicable.
+_DISPATCH_SCRIPTS = (
+    u"{ x form 'mouse' and not $- (y form 'the') :: set form x 'dog'; }\n"
+    u"{ x form 'dog' :: set lemma x 'animal'; }\n"
+    u"{ x lemma 'animal' and < (y postag 'VERB') :: set postag x 'OBJ'; }\n"
+    u"{ x postag 'OBJ' :: set feats x 'Obj=Yes'; }\n"
+    u"{ x has_feat 'Obj=Yes' or form 'cat' :: set deprel x 'obj'; }\n"
+    u"{ x form /dog|cat/ and $+ (y form 'the') :: delete node y; }\n"
+    u"{ x form /^d/i and feats /Case=Gen/g :: set lemma x 'gen'; }\n"
+    u"{ x has_feat 'Case=Nom' and postag 'VERB' :: delete node x; }\n"
+    u"{ x form 'cow' :: set form x 'mouse'; }\n"
+    u"{ x form 'mouse' and $++ (y form 'saw') :: "
+    u"copy node x after node y; }\n")
+
+class DispatchTest(unittest.TestCase):
+    def test_same_as_plain_run(self):
+        scripts = parse_scripts(_DISPATCH_SCRIPTS)
+        index = ScriptIndex(scripts)
+        rng = random.Random(0)
+        attempted = 0
+        changed = 0
+        for i in range(300):
+            tree = _tagged_tree(rng, rng.randint(1, 8))
+            for fixpoint in [None, Fixpoint(5)]:
+                expected = run_tree_scripts(tree, scripts, fixpoint=fixpoint)
+                actual = run_tree_scripts(tree, scripts, index,
+                                          fixpoint=fixpoint)
+                self.assertEqual(_dump(actual), _dump(expected))
+                self.assertEqual([actual.feats(node) for node in
+                                  range(1, len(actual) + 1)],
+                                 [expected.feats(node) for node in
+                                  range(1, len(expected) + 1)])
+                if fixpoint is None:
+                    attempted += index.attempted
+                changed += _dump(expected) != _dump(tree)
+
+        # The index does prune, and the scripts do edit trees.
+        self.assertTrue(attempted < 300 * len(scripts) * 2 / 3)
+        self.assertTrue(changed > 300)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+import unittest
+
+from dep_tregex.tree import Tree
+from dep_tregex.tree_state import TreeState
+
+def _flat_tree(forms):
+    """
+    Make a tree where the first word is the root and the others are its
+    children.
+    """
+    N = len(forms)
+    heads = [0] + [1] * (N - 1)
+    return Tree(forms, forms, [u'_'] * N, [u'_'] * N, [[]] * N, heads,
+                [u'dep'] * N)
+
+def _forms(tree, nodes):
+    return [tree.forms(node) for node in nodes]
+
+class TreeStateTest(unittest.TestCase):
+    def setUp(self):
+        tree = _flat_tree([u'a', u'b', u'c', u'd', u'e'])
+        self.state = TreeState(tree, {u'x': 5})
+
+    def marked_forms(self):
+        tree = self.state.tree
+        return [tree.forms(node) for node in range(1, len(tree) + 1)
+                if self.state.marked(node)]
+
+    def checked_forms(self):
+        tree = self.state.tree
+        return [tree.forms(node) for node in range(1, len(tree) + 1)
+                if self.state.checked(node)]
+
+    def test_marks_follow_nodes(self):
+        self.state.mark(2)
+        self.state.mark(5)
+        self.state.move([2], 4, Tree.AFTER)
+        self.assertEqual(self.marked_forms(), [u'b', u'e'])
+        self.assertEqual(self.state.backrefs_map, {u'x': 5})
+
+        # Node 'e' moves before 'a'; the backref follows it.
+        self.state.move([5], 1, Tree.BEFORE)
+        self.assertEqual(self.marked_forms(), [u'e', u'b'])
+        self.assertEqual(self.state.backrefs_map, {u'x': 1})
+
+        # Deleted nodes take their marks along; copies get none.
+        self.state.delete([1])
+        self.state.insert_copy([4], 0, Tree.AFTER)
+        self.assertEqual(self.marked_forms(), [u'b'])
+        self.assertEqual(self.state.backrefs_map, {})
+
+        self.state.unmark(self.state.tree.node_by_id(2))
+        self.assertEqual(self.marked_forms(), [])
+
+    def test_checks_follow_nodes(self):
+        # Without a radius, any change unchecks everything.
+        for node in range(1, 6):
+            self.state.check(node)
+        self.state.touch(3)
+        self.assertEqual(self.checked_forms(), [])
+        self.assertTrue(self.state.changed)
+
+        # With radius 0, only touched nodes and the old and new neighbors of
+        # moved ones are unchecked; the rest stay checked wherever they go.
+        self.state.check_radius = 0
+        for node in range(1, 6):
+            self.state.check(node)
+        self.state.touch(3)
+        self.assertEqual(self.checked_forms(), [u'a', u'b', u'd', u'e'])
+
+        self.state.move([5], 3, Tree.AFTER)
+        self.assertEqual(_forms(self.state.tree, range(1, 6)),
+                         [u'a', u'b', u'c', u'e', u'd'])
+        self.assertEqual(self.checked_forms(), [u'a', u'b'])
+
+        # Radius 1 reaches the head, 'a', through the arc from 'b'.
+        self.state.check_radius = 1
+        self.state.check(5)
+        self.state.touch(2)
+        self.assertEqual(self.checked_forms(), [u'd'])
+
+    def test_unchanged_move_keeps_checks(self):
+        self.state.check_radius = 0
+        self.state.check(2)
+        self.state.move([2], 1, Tree.AFTER)
+        self.assertEqual(self.checked_forms(), [u'b'])
+        self.assertFalse(self.state.changed)
+
+    def test_groups_follow_nodes(self):
+        self.state.group_together(2, 3)
+        self.state.group_together(3, 5)
+        self.assertEqual(_forms(self.state.tree,
+                                sorted(self.state.gather_group(2))),
+                         [u'b', u'c', u'e'])
+
+        # Moves don't break groups.
+        self.state.move([5], 1, Tree.BEFORE)
+        self.assertEqual(_forms(self.state.tree,
+                                sorted(self.state.gather_group(1))),
+                         [u'e', u'b', u'c'])
+
+        # Deleting a member doesn't split the group.
+        self.state.delete([4])
+        self.assertEqual(_forms(self.state.tree, range(1, 5)),
+                         [u'e', u'a', u'b', u'd'])
+        self.assertEqual(_forms(self.state.tree,
+                                sorted(self.state.gather_group(3))),
+                         [u'e', u'b'])
+
+        # Subtrees of grouped nodes come along.
+        self.assertEqual(_forms(self.state.tree,
+                                sorted(self.state.gather_group(2))),
+                         [u'e', u'a', u'b', u'd'])
+
+if __name__ == '__main__':
+    unittest.main()